@@ -1,7 +1,8 @@
 from logging.config import fileConfig
 
-from sqlalchemy import engine_from_config
+from sqlalchemy import engine_from_config, text
 from sqlalchemy import pool
+from sqlalchemy import Column
 from app.models import Base
 
 from alembic import context
@@ -16,6 +17,16 @@ config.set_main_option(
     f"postgresql+psycopg2://{settings.database_username}:{settings.database_password}@{settings.database_hostname}/{settings.database_name}",
 )
 
+# `alembic -x shard=N upgrade head` migrates the N-th database of
+# DATABASE_SHARD_URLS instead; every shard has the whole schema
+shard = context.get_x_argument(as_dictionary=True).get("shard")
+if shard and int(shard) > 0:
+    shard_url = settings.database_shard_urls.split(",")[int(shard) - 1].strip()
+    config.set_main_option(
+        "sqlalchemy.url",
+        shard_url.replace("postgresql://", "postgresql+psycopg2://", 1),
+    )
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -28,6 +39,18 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Expression indexes never compare equal to their reflected form, so
+    # autogenerate would drop and recreate them on every run. They are
+    # written by hand in their migrations instead.
+    if type_ == "index" and not all(
+        isinstance(expr, Column) for expr in object.expressions
+    ):
+        return False
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -52,6 +75,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -65,6 +89,12 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # Scripts can pass their own connection, see benchmarks.migration_locks
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run_migrations_on(connection)
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -72,10 +102,27 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        run_migrations_on(connection)
+
 
-        with context.begin_transaction():
-            context.run_migrations()
+def run_migrations_on(connection) -> None:
+    # DDL waiting for a lock blocks every query queued behind it, so give up
+    # instead. Set per session, so it also holds in autocommit blocks.
+    connection.execute(
+        text(f"SET lock_timeout = {int(settings.migration_lock_timeout_ms)}")
+    )
+    connection.commit()
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        # Each migration commits on its own, so locks are held no longer
+        # than one migration, and app.migrations can step outside it
+        transaction_per_migration=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,29 @@
+"""note id sequence steps by one
+
+Revision ID: 4e8a1d6c3b70
+Revises: 9c4f2a6e8b13
+Create Date: 2026-10-20 14:51:12.308214
+
+Revision e3b9d1c47f28 set ``notes_id_seq``'s ``INCREMENT BY`` to 100, which
+every insert of an unsharded database used up in full, running the
+``integer`` ids out a hundred times sooner. `app.database.NoteIds` now
+takes its blocks of ids one ``nextval`` each, in a single query.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4e8a1d6c3b70'
+down_revision: Union[str, None] = '9c4f2a6e8b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER SEQUENCE notes_id_seq INCREMENT BY 1")
+
+
+def downgrade() -> None:
+    op.execute("ALTER SEQUENCE notes_id_seq INCREMENT BY 100")
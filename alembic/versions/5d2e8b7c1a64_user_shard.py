@@ -0,0 +1,32 @@
+"""user shard
+
+Revision ID: 5d2e8b7c1a64
+Revises: c4a81f5e2d93
+Create Date: 2026-10-19 21:12:45.608114
+
+Adds ``users.shard``, the directory `app.database.ShardRouter` reads. The
+default is a constant, so PostgreSQL adds the column without rewriting
+``users``: every existing user stays on shard 0, the primary.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2e8b7c1a64'
+down_revision: Union[str, None] = 'c4a81f5e2d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("shard", sa.Integer(), server_default=sa.text("0"), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "shard")
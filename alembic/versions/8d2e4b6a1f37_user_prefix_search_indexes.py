@@ -0,0 +1,28 @@
+"""user prefix search indexes
+
+Revision ID: 8d2e4b6a1f37
+Revises: 3c1f0d7e5a92
+Create Date: 2026-10-19 10:03:17.554210
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e4b6a1f37'
+down_revision: Union[str, None] = '3c1f0d7e5a92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_username_prefix', 'users', [sa.text('lower(username) COLLATE "C"')], unique=False)
+    op.create_index('ix_users_email_prefix', 'users', [sa.text('lower(email) COLLATE "C"')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_email_prefix', table_name='users')
+    op.drop_index('ix_users_username_prefix', table_name='users')
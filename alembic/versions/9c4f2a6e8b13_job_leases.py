@@ -0,0 +1,36 @@
+"""job leases
+
+Revision ID: 9c4f2a6e8b13
+Revises: e3b9d1c47f28
+Create Date: 2026-10-20 11:24:09.531870
+
+Adds ``jobs.lease_until``, which the worker running a job renews. Jobs
+already running get the 900 seconds from ``locked_at`` they had before.
+Workers started before this revision claim jobs without a lease, which are
+never requeued; restart them along with it.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4f2a6e8b13'
+down_revision: Union[str, None] = 'e3b9d1c47f28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "jobs", sa.Column("lease_until", sa.TIMESTAMP(timezone=True), nullable=True)
+    )
+    op.execute(
+        "UPDATE jobs SET lease_until = locked_at + interval '900 seconds' "
+        "WHERE status = 'running'"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("jobs", "lease_until")
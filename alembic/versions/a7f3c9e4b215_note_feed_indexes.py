@@ -0,0 +1,88 @@
+"""note feed indexes
+
+Revision ID: a7f3c9e4b215
+Revises: 5d2e8b7c1a64
+Create Date: 2026-10-19 23:04:18.530947
+
+Indexes for ``GET /api/notes/feed``, which reads a user's notes and the
+notes shared with them newest first, in ``(created_at, id)`` order:
+
+- ``notes (owner_id, created_at, id)``, which replaces
+  ``(owner_id, created_at)``.
+- ``shared_notes.note_created_at``, the note's ``created_at``, copied onto
+  every share by a trigger on insert and backfilled for existing shares.
+  It is indexed as ``(user_id, note_created_at, note_id)``.
+
+The indexes are built one partition at a time, without blocking writes.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.migrations import backfill, create_partitioned_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7f3c9e4b215'
+down_revision: Union[str, None] = '5d2e8b7c1a64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "shared_notes",
+        sa.Column("note_created_at", sa.TIMESTAMP(timezone=True), nullable=True),
+    )
+    # Shares written from here on, by this version or the previous one
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION shared_notes_note_created_at()
+        RETURNS trigger AS $$
+        BEGIN
+            IF NEW.note_created_at IS NULL THEN
+                SELECT created_at INTO NEW.note_created_at FROM notes
+                WHERE id = NEW.note_id AND owner_id = NEW.owner_id;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute("DROP TRIGGER IF EXISTS note_created_at ON shared_notes")
+    op.execute(
+        "CREATE TRIGGER note_created_at BEFORE INSERT ON shared_notes "
+        "FOR EACH ROW EXECUTE FUNCTION shared_notes_note_created_at()"
+    )
+
+    backfill(
+        "shared_notes",
+        "note_created_at = (SELECT created_at FROM notes "
+        "WHERE notes.id = shared_notes.note_id "
+        "AND notes.owner_id = shared_notes.owner_id)",
+        "note_created_at IS NULL",
+        key=["user_id", "note_id", "owner_id"],
+    )
+    create_partitioned_index_concurrently(
+        "ix_shared_notes_user_id_note_created_at",
+        "shared_notes",
+        "user_id, note_created_at, note_id",
+    )
+    create_partitioned_index_concurrently(
+        "ix_notes_owner_id_created_at_id", "notes", "owner_id, created_at, id"
+    )
+    # Partitioned indexes cannot be dropped concurrently; this only waits
+    # for the table lock, and gives up after MIGRATION_LOCK_TIMEOUT_MS
+    op.drop_index("ix_notes_owner_id_created_at", table_name="notes", if_exists=True)
+
+
+def downgrade() -> None:
+    op.create_index(
+        "ix_notes_owner_id_created_at", "notes", ["owner_id", "created_at"]
+    )
+    op.drop_index("ix_notes_owner_id_created_at_id", table_name="notes")
+    op.drop_index("ix_shared_notes_user_id_note_created_at", table_name="shared_notes")
+    op.execute("DROP TRIGGER note_created_at ON shared_notes")
+    op.execute("DROP FUNCTION shared_notes_note_created_at()")
+    op.drop_column("shared_notes", "note_created_at")
@@ -0,0 +1,249 @@
+"""partition notes by owner
+
+Revision ID: c4a81f5e2d93
+Revises: 17b67b9fd658
+Create Date: 2026-10-19 18:41:07.203518
+
+Rebuilds ``notes`` and ``shared_notes`` as tables hash-partitioned by
+``owner_id`` while the API keeps serving:
+
+1. Create ``notes_partitioned`` and ``shared_notes_partitioned``, and
+   triggers that repeat every write to the old tables on the new ones.
+2. Copy the existing rows in batches with `copy_rows`.
+3. Swap the tables in one short transaction.
+
+If the swap cannot get its locks within ``MIGRATION_LOCK_TIMEOUT_MS``, run
+the migration again: every step can be redone.
+
+A foreign key into a partitioned table must name its whole unique key, so
+``note_revisions`` and ``attachments`` lose theirs on ``notes.id``.
+`app.purge` removes them before their note.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.migrations import copy_rows
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a81f5e2d93'
+down_revision: Union[str, None] = '17b67b9fd658'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# app.models.NOTE_PARTITIONS when this was written
+NOTE_PARTITIONS = 16
+
+NOTE_COLUMNS = ["id", "title", "detail", "owner_id", "created_at", "deleted_at", "tags"]
+SHARE_COLUMNS = ["user_id", "note_id", "owner_id", "permission", "created_at"]
+
+# Indexes of the new tables that take the name of one on the old tables
+# once those are dropped
+RENAMED_INDEXES = [
+    "ix_notes_title",
+    "ix_notes_created_at",
+    "ix_notes_tags",
+    "ix_notes_deleted_at",
+    "ix_shared_notes_permission",
+    "ix_shared_notes_created_at",
+]
+
+
+def create_partitioned_tables():
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS notes_partitioned (
+            LIKE notes INCLUDING DEFAULTS,
+            CONSTRAINT notes_partitioned_pkey PRIMARY KEY (id, owner_id),
+            CONSTRAINT notes_owner_id_fkey FOREIGN KEY (owner_id) REFERENCES users (id)
+        ) PARTITION BY HASH (owner_id)
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shared_notes_partitioned (
+            LIKE shared_notes INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+            owner_id INTEGER NOT NULL,
+            CONSTRAINT shared_notes_partitioned_pkey
+                PRIMARY KEY (user_id, note_id, owner_id),
+            CONSTRAINT shared_notes_user_id_fkey FOREIGN KEY (user_id)
+                REFERENCES users (id) ON DELETE CASCADE,
+            CONSTRAINT shared_notes_note_id_owner_id_fkey FOREIGN KEY (note_id, owner_id)
+                REFERENCES notes_partitioned (id, owner_id) ON DELETE CASCADE
+        ) PARTITION BY HASH (owner_id)
+        """
+    )
+    for table in ("notes", "shared_notes"):
+        for remainder in range(NOTE_PARTITIONS):
+            op.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_p{remainder} "
+                f"PARTITION OF {table}_partitioned "
+                f"FOR VALUES WITH (MODULUS {NOTE_PARTITIONS}, REMAINDER {remainder})"
+            )
+
+    # The tables are empty, so building their indexes blocks nothing
+    indexes = {
+        "ix_notes_title": "notes_partitioned (title)",
+        "ix_notes_created_at": "notes_partitioned (created_at)",
+        "ix_notes_owner_id_created_at": "notes_partitioned (owner_id, created_at)",
+        "ix_notes_tags": "notes_partitioned USING gin (tags)",
+        "ix_notes_deleted_at": (
+            "notes_partitioned (deleted_at) WHERE deleted_at IS NOT NULL"
+        ),
+        "ix_shared_notes_note_id": "shared_notes_partitioned (note_id)",
+        "ix_shared_notes_permission": "shared_notes_partitioned (permission)",
+        "ix_shared_notes_created_at": "shared_notes_partitioned (created_at)",
+    }
+    for name, definition in indexes.items():
+        if name in RENAMED_INDEXES:
+            name += "_partitioned"
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+def create_mirror_triggers():
+    """Repeat every write to `notes` and `shared_notes` on their partitioned
+    copies. A share of a note not copied yet is left for `copy_rows`."""
+    note_values = ", ".join(f"NEW.{column}" for column in NOTE_COLUMNS)
+    note_updates = ", ".join(
+        f"{column} = EXCLUDED.{column}" for column in NOTE_COLUMNS[1:]
+    )
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION mirror_notes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM notes_partitioned
+                WHERE id = OLD.id AND owner_id = OLD.owner_id;
+                RETURN OLD;
+            END IF;
+            INSERT INTO notes_partitioned ({", ".join(NOTE_COLUMNS)})
+            VALUES ({note_values})
+            ON CONFLICT (id, owner_id) DO UPDATE SET {note_updates};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION mirror_shared_notes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM shared_notes_partitioned
+                WHERE user_id = OLD.user_id AND note_id = OLD.note_id;
+                RETURN OLD;
+            END IF;
+            INSERT INTO shared_notes_partitioned
+                (user_id, note_id, owner_id, permission, created_at)
+            SELECT NEW.user_id, NEW.note_id, n.owner_id, NEW.permission, NEW.created_at
+            FROM notes_partitioned n WHERE n.id = NEW.note_id
+            ON CONFLICT (user_id, note_id, owner_id)
+            DO UPDATE SET permission = EXCLUDED.permission;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    for table in ("notes", "shared_notes"):
+        op.execute(f"DROP TRIGGER IF EXISTS mirror_{table} ON {table}")
+        op.execute(
+            f"CREATE TRIGGER mirror_{table} AFTER INSERT OR UPDATE OR DELETE "
+            f"ON {table} FOR EACH ROW EXECUTE FUNCTION mirror_{table}()"
+        )
+
+
+def upgrade() -> None:
+    create_partitioned_tables()
+    create_mirror_triggers()
+
+    copy_rows("notes_partitioned", NOTE_COLUMNS, "notes", ["id"])
+    # Every note is in notes_partitioned by now, and so is every share
+    # written from here on
+    copy_rows(
+        "shared_notes_partitioned",
+        [f"s.{column}" for column in SHARE_COLUMNS if column != "owner_id"]
+        + ["n.owner_id"],
+        "shared_notes s JOIN notes_partitioned n ON n.id = s.note_id",
+        ["s.user_id", "s.note_id"],
+    )
+
+    # Catalog changes only, so the API waits for at most a moment
+    op.execute("LOCK TABLE notes, shared_notes IN ACCESS EXCLUSIVE MODE")
+    op.drop_constraint("note_revisions_note_id_fkey", "note_revisions")
+    op.drop_constraint("attachments_note_id_fkey", "attachments")
+    op.execute("ALTER SEQUENCE notes_id_seq OWNED BY notes_partitioned.id")
+    op.drop_table("shared_notes")
+    op.drop_table("notes")
+    op.execute("DROP FUNCTION mirror_notes(), mirror_shared_notes()")
+    for table in ("notes", "shared_notes"):
+        op.rename_table(f"{table}_partitioned", table)
+        op.execute(
+            f"ALTER TABLE {table} RENAME CONSTRAINT "
+            f"{table}_partitioned_pkey TO {table}_pkey"
+        )
+    for name in RENAMED_INDEXES:
+        op.execute(f"ALTER INDEX {name}_partitioned RENAME TO {name}")
+
+
+def downgrade() -> None:
+    # Offline: rebuilds both tables in one transaction
+    op.execute("ALTER TABLE shared_notes RENAME TO shared_notes_partitioned")
+    op.execute("ALTER TABLE notes RENAME TO notes_partitioned")
+    for name in RENAMED_INDEXES + ["notes_pkey", "shared_notes_pkey"]:
+        op.execute(f"ALTER INDEX {name} RENAME TO {name}_partitioned")
+    op.execute(
+        """
+        CREATE TABLE notes (
+            LIKE notes_partitioned INCLUDING DEFAULTS,
+            CONSTRAINT notes_pkey PRIMARY KEY (id)
+        )
+        """
+    )
+    op.execute("ALTER SEQUENCE notes_id_seq OWNED BY notes.id")
+    op.execute(
+        f"INSERT INTO notes ({', '.join(NOTE_COLUMNS)}) "
+        f"SELECT {', '.join(NOTE_COLUMNS)} FROM notes_partitioned"
+    )
+    op.execute(
+        """
+        CREATE TABLE shared_notes (
+            user_id INTEGER NOT NULL,
+            note_id INTEGER NOT NULL,
+            permission permissions NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            CONSTRAINT shared_notes_pkey PRIMARY KEY (user_id, note_id)
+        )
+        """
+    )
+    op.execute(
+        "INSERT INTO shared_notes (user_id, note_id, permission, created_at) "
+        "SELECT user_id, note_id, permission, created_at FROM shared_notes_partitioned"
+    )
+    op.drop_table("shared_notes_partitioned")
+    op.drop_table("notes_partitioned")
+
+    op.create_foreign_key(None, "notes", "users", ["owner_id"], ["id"])
+    op.create_foreign_key(
+        None, "shared_notes", "notes", ["note_id"], ["id"], ondelete="CASCADE"
+    )
+    op.create_foreign_key(
+        None, "shared_notes", "users", ["user_id"], ["id"], ondelete="CASCADE"
+    )
+    op.create_foreign_key(
+        None, "note_revisions", "notes", ["note_id"], ["id"], ondelete="CASCADE"
+    )
+    op.create_foreign_key(
+        None, "attachments", "notes", ["note_id"], ["id"], ondelete="CASCADE"
+    )
+    op.create_index("ix_notes_title", "notes", ["title"])
+    op.create_index("ix_notes_created_at", "notes", ["created_at"])
+    op.create_index("ix_notes_tags", "notes", ["tags"], postgresql_using="gin")
+    op.create_index(
+        "ix_notes_deleted_at",
+        "notes",
+        ["deleted_at"],
+        postgresql_where="deleted_at IS NOT NULL",
+    )
+    op.create_index("ix_shared_notes_permission", "shared_notes", ["permission"])
+    op.create_index("ix_shared_notes_created_at", "shared_notes", ["created_at"])
@@ -0,0 +1,31 @@
+"""note id blocks
+
+Revision ID: e3b9d1c47f28
+Revises: a7f3c9e4b215
+Create Date: 2026-10-20 10:02:37.114052
+
+`app.database.NoteIds` reserves note ids in blocks of ``notes_id_seq``'s
+``INCREMENT BY``, which was still 1, so every note created asked the
+primary for its id. ``ALTER SEQUENCE`` only locks the sequence, briefly.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b9d1c47f28'
+down_revision: Union[str, None] = 'a7f3c9e4b215'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# app.models.NOTE_ID_BLOCK when this was written
+NOTE_ID_BLOCK = 100
+
+
+def upgrade() -> None:
+    op.execute(f"ALTER SEQUENCE notes_id_seq INCREMENT BY {NOTE_ID_BLOCK}")
+
+
+def downgrade() -> None:
+    op.execute("ALTER SEQUENCE notes_id_seq INCREMENT BY 1")
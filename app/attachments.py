@@ -0,0 +1,341 @@
+"""Note attachments.
+
+Uploads are parsed with python-multipart as the body arrives. The file part
+is written straight to a temporary file under `attachment_dir`, and hashed
+along the way, so memory use does not depend on the size of the file. The
+finished file is then renamed to its sha256 (``ab/cd/abcd...``). Identical
+content uploaded by anyone is stored once: every upload gets its own
+`attachments` row, and they all point at one shared `blobs` row.
+
+Downloads serve one byte range of the blob. If the server offers the ASGI
+``http.response.zerocopysend`` extension, the range is handed to it to
+`sendfile()` from the page cache. Otherwise it is read in fixed-size chunks.
+
+When an attachment is removed its blob is only marked released. `app.purge`
+deletes the file once no attachment uses it any more.
+
+Each shard keeps its blobs in a directory of its own, so that purging a
+blob on one shard never deletes a file that another shard still uses.
+"""
+import hashlib
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import anyio
+from fastapi import HTTPException, Request, status
+from fastapi.responses import FileResponse, Response
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, object_session
+from starlette.concurrency import run_in_threadpool
+from starlette.types import Receive, Scope, Send
+
+from app.config import settings
+from app.database import shard_index
+from app.models import Attachment, Blob
+
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+@dataclass
+class Upload:
+    """An uploaded file waiting in `path` to be stored or discarded."""
+
+    path: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+
+class FilePart:
+    """python-multipart callbacks that write the first file in form field
+    `field` to `file`, hashing it on the way."""
+
+    def __init__(self, file, field: str = "file"):
+        self.file = file
+        self.field = field.encode()
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.filename = None
+        self.content_type = None
+        self.writing = False
+        self.headers = {}
+        self.header_field = b""
+        self.header_value = b""
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition"))
+        if (
+            self.filename is None
+            and options.get(b"name") == self.field
+            and b"filename" in options
+        ):
+            name = options[b"filename"].decode("utf-8", "replace")
+            # Browsers on Windows may send the full client-side path
+            self.filename = os.path.basename(name.replace("\\", "/")) or "file"
+            self.content_type = self.headers.get(
+                b"content-type", b"application/octet-stream"
+            ).decode("latin-1")
+            self.writing = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.writing:
+            chunk = memoryview(data)[start:end]
+            self.hash.update(chunk)
+            self.file.write(chunk)
+            self.size += end - start
+
+    def on_part_end(self):
+        self.writing = False
+
+
+def max_body_bytes():
+    """The largest multipart body that can hold an attachment within the
+    limit: the file plus room for the part headers and boundaries."""
+    return settings.attachment_max_bytes + 65536
+
+
+def too_large():
+    return HTTPException(
+        detail=f"Attachments are limited to {settings.attachment_max_bytes} bytes",
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
+
+
+async def receive(request: Request) -> Upload:
+    """Stream the `file` field of a multipart/form-data request to a
+    temporary file, without holding more than one body chunk in memory."""
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(
+            detail="Expected a multipart/form-data body with a file field",
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        )
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > max_body_bytes():
+        raise too_large()
+
+    # Same filesystem as the blobs, so storing the upload is a rename
+    tmp_dir = Path(settings.attachment_dir) / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    file = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+    part = FilePart(file)
+    parser = MultipartParser(options[b"boundary"], part.callbacks())
+
+    def finish():
+        parser.finalize()
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+
+    try:
+        try:
+            async for chunk in request.stream():
+                # Hashing and writing a chunk blocks, so keep it off the loop
+                await run_in_threadpool(parser.write, chunk)
+                if part.size > settings.attachment_max_bytes:
+                    raise too_large()
+            await run_in_threadpool(finish)
+        except MultipartParseError as e:
+            raise HTTPException(
+                detail=f"Malformed multipart body: {e}",
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        if part.filename is None:
+            raise HTTPException(
+                detail='The form has no file in a "file" field',
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+    except BaseException:
+        file.close()
+        os.unlink(file.name)
+        raise
+    return Upload(
+        path=file.name,
+        filename=part.filename,
+        content_type=part.content_type,
+        size=part.size,
+        sha256=part.hash.hexdigest(),
+    )
+
+
+def blob_path(sha256: str, shard: int = 0):
+    root = Path(settings.attachment_dir)
+    if shard:
+        root = root / "shards" / str(shard)
+    return root / sha256[:2] / sha256[2:4] / sha256
+
+
+def store(db: Session, upload: Upload):
+    """Move `upload` into place as the blob for its content, or drop it if
+    that content is already stored. The blob row stays locked until `db`
+    commits, so `app.purge` cannot remove the file in the meantime."""
+    db.execute(
+        insert(Blob)
+        .values(sha256=upload.sha256, size=upload.size)
+        .on_conflict_do_update(index_elements=[Blob.sha256], set_={"released_at": None})
+    )
+    path = blob_path(upload.sha256, shard_index(db))
+    if path.exists():
+        os.unlink(upload.path)
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(upload.path, path)
+
+
+def discard(upload: Upload):
+    """Remove `upload` if `store` has not moved it into place."""
+    Path(upload.path).unlink(missing_ok=True)
+
+
+def release(db: Session, sha256s):
+    """Mark the blobs of removed attachments for `app.purge` to check."""
+    if sha256s:
+        db.execute(
+            update(Blob)
+            .where(Blob.sha256.in_(sorted(set(sha256s))))
+            .values(released_at=func.now())
+        )
+
+
+def purge_blob(db: Session, sha256: str):
+    """Delete a released blob and its file unless an attachment still uses
+    it. The caller must hold the blob's row lock. Returns rows touched."""
+    if db.scalar(select(exists().where(Attachment.sha256 == sha256))):
+        return db.execute(
+            update(Blob).where(Blob.sha256 == sha256).values(released_at=None)
+        ).rowcount
+    blob_path(sha256, shard_index(db)).unlink(missing_ok=True)
+    return db.execute(delete(Blob).where(Blob.sha256 == sha256)).rowcount
+
+
+def byte_range(header: str, size: int):
+    """The `(start, stop)` a `Range` header asks for, or None to send the
+    whole file. Only single ranges are served; a malformed or multi-range
+    header is ignored, as RFC 9110 allows. Raises ValueError if the range
+    lies outside the file."""
+    match = RANGE_RE.fullmatch(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last `last` bytes
+        start, stop = max(size - int(last), 0), size
+    elif last and int(last) < int(first):
+        return None
+    else:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+    if start >= stop:
+        raise ValueError(f"Range {header} is outside a {size}-byte file")
+    return start, stop
+
+
+class BlobResponse(FileResponse):
+    """Send bytes `start:stop` of the file at `path`."""
+
+    def __init__(self, path, start: int, stop: int, **kwargs):
+        super().__init__(path, **kwargs)
+        self.start = start
+        self.count = stop - start
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if self.count and "http.response.zerocopysend" in scope.get("extensions", {}):
+            # The server sendfile()s the range without copying it through us
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": self.start,
+                        "count": self.count,
+                        "more_body": False,
+                    }
+                )
+            return
+        remaining = self.count
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while True:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                more_body = bool(chunk) and remaining > 0
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": more_body,
+                    }
+                )
+                if not more_body:
+                    break
+
+
+def download(request: Request, attachment: Attachment):
+    """The response for `attachment`, honouring `Range` and `If-Range`."""
+    etag = f'"{attachment.sha256}"'
+    headers = {"accept-ranges": "bytes", "etag": etag}
+    start, stop = 0, attachment.size
+    requested = request.headers.get("range")
+    if requested and request.headers.get("if-range", etag) == etag:
+        try:
+            requested = byte_range(requested, attachment.size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"content-range": f"bytes */{attachment.size}", **headers},
+            )
+        if requested is not None:
+            start, stop = requested
+            headers["content-range"] = f"bytes {start}-{stop - 1}/{attachment.size}"
+    return BlobResponse(
+        blob_path(attachment.sha256, shard_index(object_session(attachment))),
+        start,
+        stop,
+        status_code=(
+            status.HTTP_206_PARTIAL_CONTENT
+            if "content-range" in headers
+            else status.HTTP_200_OK
+        ),
+        headers=headers,
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+    )
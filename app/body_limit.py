@@ -0,0 +1,109 @@
+"""Request body size limits, enforced while the body arrives.
+
+FastAPI reads a JSON body whole before it parses and validates it, so a
+single ``POST /api/notes`` with a 500MB body would be held in memory, and
+then parsed, before the note's field limits could reject it.
+`BodySizeLimitMiddleware` answers ``413`` as soon as a request declares a
+``Content-Length`` over its route's limit, without reading the body, or
+once the bytes received so far pass it.
+
+Routes are limited to ``MAX_BODY_BYTES`` (default 1 MiB) unless their
+endpoint says otherwise:
+
+    @router.post("/{id}/attachments")
+    @body_limit.max_body_bytes(attachments.max_body_bytes)
+    async def upload_attachment(...):
+
+A callable limit is read on every request, so it follows the settings.
+"""
+from typing import Callable, Union
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.utils import matching_route
+
+Limit = Union[int, Callable[[], int]]
+
+
+def max_body_bytes(limit: Limit):
+    """Give the decorated endpoint a body limit other than the default."""
+
+    def decorate(endpoint):
+        endpoint.max_body_bytes = limit
+        return endpoint
+
+    return decorate
+
+
+def route_limit(scope: Scope):
+    """The body limit of the route `scope` goes to."""
+    endpoint = getattr(matching_route(scope), "endpoint", None)
+    limit = getattr(endpoint, "max_body_bytes", settings.max_body_bytes)
+    return limit() if callable(limit) else limit
+
+
+async def reject(limit: int, scope: Scope, receive: Receive, send: Send):
+    response = JSONResponse(
+        content={"detail": f"Request bodies are limited to {limit} bytes"},
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
+    await response(scope, receive, send)
+
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        declared = None
+        chunked = False
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                declared = int(value) if value.isdigit() else None
+            elif name == b"transfer-encoding":
+                chunked = True
+        # Most requests have no body; they skip the route lookup
+        if not chunked and not declared:
+            return await self.app(scope, receive, send)
+
+        limit = route_limit(scope)
+        if declared is not None and declared > limit:
+            return await reject(limit, scope, receive, send)
+
+        received = 0
+        started = rejected = False
+
+        async def send_unless_rejected(message: Message):
+            nonlocal started
+            if not rejected:
+                started = True
+                await send(message)
+
+        async def receive_limited() -> Message:
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Answer for the app, and tell it the client has gone,
+                    # as a server does: the rest of the body is never read
+                    rejected = True
+                    if not started:
+                        await reject(limit, scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        try:
+            await self.app(scope, receive_limited, send_unless_rejected)
+        except Exception:
+            # Such as the ClientDisconnect of an endpoint reading the body
+            if not rejected:
+                raise
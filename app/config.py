@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -8,11 +10,75 @@ class Settings(BaseSettings):
     database_name: str
     database_username: str
     secret_key: str
-    refresh_secret_key: str
     algorithm: str
     access_expire_minutes: int
     refresh_expire_minutes: int
     database_test_url: str
+    database_replica_url: Optional[str] = None
+    database_test_replica_url: Optional[str] = None
+    database_shard_urls: str = ""
+    shard_directory_ttl_seconds: float = 5.0
+    shard_directory_cache_size: int = 100000
+    shard_move_batch_size: int = 1000
+    replica_max_lag_seconds: float = 2.0
+    replica_check_interval_seconds: float = 1.0
+    read_your_writes_seconds: int = 5
+    jwt_backend: str = "jose"
+    jwt_cache_size: int = 10000
+    db_prepare_threshold: int = 5
+    db_max_parallel_workers_per_gather: int = 0
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    user_search_max_results: int = 20
+    user_search_cache_ttl_seconds: float = 30.0
+    user_search_cache_size: int = 10000
+    search_max_results: int = 50
+    search_scan_chars: int = 20000
+    search_snippet_budget_chars: int = 200000
+    search_snippet_chars: int = 160
+    search_max_snippets: int = 3
+    list_cache_backend: Optional[str] = None
+    list_cache_redis_url: Optional[str] = None
+    list_cache_redis_timeout_seconds: float = 0.5
+    list_cache_ttl_seconds: float = 60.0
+    list_cache_size: int = 10000
+    coalesce_note_reads: bool = True
+    note_owner_cache_size: int = 100000
+    drain_seconds: float = 5.0
+    drain_dir: Optional[str] = None
+    ready_max_pool_saturation: float = 1.0
+    log_level: str = "INFO"
+    log_queue_size: int = 10000
+    log_access_sample_rate: float = 0.1
+    log_slow_request_ms: float = 500.0
+    log_sql: bool = False
+    log_sql_sample_rate: float = 1.0
+    concurrency_limit_enabled: bool = True
+    concurrency_initial_limit: int = 20
+    concurrency_min_limit: int = 2
+    concurrency_max_limit: int = 200
+    concurrency_latency_tolerance: float = 2.0
+    concurrency_backoff: float = 0.9
+    concurrency_retry_after_seconds: int = 1
+    revision_snapshot_interval: int = 20
+    max_body_bytes: int = 1024**2
+    attachment_dir: str = "attachments"
+    attachment_max_bytes: int = 5 * 1024**3
+    migration_lock_timeout_ms: int = 5000
+    migration_batch_size: int = 5000
+    migration_batch_pause_seconds: float = 0.05
+    purge_batch_size: int = 1000
+    purge_batch_pause_seconds: float = 0.1
+    purge_poll_seconds: float = 5.0
+    job_worker_threads: int = 4
+    job_poll_seconds: float = 1.0
+    job_retry_base_seconds: float = 5.0
+    job_retry_max_seconds: float = 600.0
+    job_lease_seconds: float = 60.0
+    admin_user_ids: str = ""
+    profiling_enabled: bool = False
+    profile_sample_rate: float = 0.0
+    profile_max_snapshots: int = 10
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
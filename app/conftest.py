@@ -0,0 +1,192 @@
+"""Test fixtures.
+
+Every pytest-xdist worker gets its own database, cloned from a template that
+is rebuilt only when the models change. Each test then runs inside a
+transaction that is rolled back afterwards; the session joins it through
+savepoints, so the code under test can commit and roll back as usual.
+"""
+import hashlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app import main
+from app.config import settings
+from app.database import Base, create_db_engine, get_db
+from app.models import Note, SharedNotes, User
+from app.utils import hash_password
+
+# Serializes template builds between xdist workers
+TEMPLATE_LOCK_ID = 7_310_251
+
+TEST_PASSWORD = "testpassword"
+TEST_PASSWORD_HASH = hash_password(TEST_PASSWORD)
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "slow: long-running test, deselect with -m 'not slow'"
+    )
+
+
+def schema_fingerprint():
+    dialect = postgresql.dialect()
+    ddl = []
+    for table in Base.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        ddl.extend(str(CreateIndex(i).compile(dialect=dialect)) for i in table.indexes)
+    return hashlib.sha256("\n".join(ddl).encode()).hexdigest()
+
+
+def clone_for_worker(url: str, suffix: str = ""):
+    """Create a fresh database for this xdist worker and return its URL."""
+    base = make_url(url)
+    template = f"{base.database}_template"
+    worker = f"{base.database}_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}{suffix}"
+    fingerprint = schema_fingerprint()
+
+    admin = create_engine(base, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+    with admin.connect() as conn:
+        conn.execute(select(func.pg_advisory_lock(TEMPLATE_LOCK_ID)))
+        try:
+            current = conn.execute(
+                text(
+                    "SELECT shobj_description(oid, 'pg_database') "
+                    "FROM pg_database WHERE datname = :name"
+                ),
+                {"name": template},
+            ).scalar()
+            if current != fingerprint:
+                conn.execute(text(f'DROP DATABASE IF EXISTS "{template}" WITH (FORCE)'))
+                conn.execute(text(f'CREATE DATABASE "{template}"'))
+                template_engine = create_engine(
+                    base.set(database=template), poolclass=NullPool
+                )
+                Base.metadata.create_all(bind=template_engine)
+                template_engine.dispose()
+                conn.execute(
+                    text(f"COMMENT ON DATABASE \"{template}\" IS '{fingerprint}'")
+                )
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{worker}" WITH (FORCE)'))
+            conn.execute(text(f'CREATE DATABASE "{worker}" TEMPLATE "{template}"'))
+        finally:
+            conn.execute(select(func.pg_advisory_unlock(TEMPLATE_LOCK_ID)))
+    admin.dispose()
+    return base.set(database=worker).render_as_string(hide_password=False)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_db_engine(clone_for_worker(settings.database_test_url))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def replica_engine():
+    if not settings.database_test_replica_url:
+        pytest.skip("DATABASE_TEST_REPLICA_URL is not set")
+    engine = create_db_engine(clone_for_worker(settings.database_test_replica_url))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def shard_engines():
+    """Two more databases, shards 1 and 2 next to the test database."""
+    engines = [
+        create_db_engine(clone_for_worker(settings.database_test_url, f"_shard{i}"))
+        for i in (1, 2)
+    ]
+    yield engines
+    for shard_engine in engines:
+        shard_engine.dispose()
+
+
+def transactional_session(engine):
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = Session(
+        bind=connection,
+        autoflush=True,
+        join_transaction_mode="create_savepoint",
+    )
+    return connection, transaction, session
+
+
+@pytest.fixture
+def db(engine):
+    connection, transaction, session = transactional_session(engine)
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def client(db):
+    def override_get_db():
+        yield db
+
+    main.app.dependency_overrides[get_db] = override_get_db
+    main.bucket.tokens = main.bucket.capacity
+    main.concurrency_limiter.reset()
+    yield TestClient(main.app)
+    main.app.dependency_overrides.pop(get_db, None)
+
+
+# * Factories
+@pytest.fixture
+def make_user(db):
+    count = 0
+
+    def make_user(**fields):
+        nonlocal count
+        count += 1
+        fields.setdefault("username", f"user{count}")
+        fields.setdefault("email", f"user{count}@example.com")
+        fields.setdefault("password", TEST_PASSWORD_HASH)
+        user = User(**fields)
+        db.add(user)
+        db.commit()
+        return user
+
+    return make_user
+
+
+@pytest.fixture
+def make_note(db, make_user):
+    def make_note(owner=None, **fields):
+        owner = owner or make_user()
+        fields.setdefault("title", "Test Note")
+        fields.setdefault("detail", "This is a test note.")
+        note = Note(owner_id=owner.id, **fields)
+        db.add(note)
+        db.commit()
+        return note
+
+    return make_note
+
+
+@pytest.fixture
+def make_share(db):
+    def make_share(note, user, permission="read_only"):
+        share = SharedNotes(
+            note_id=note.id,
+            owner_id=note.owner_id,
+            user_id=user.id,
+            permission=permission,
+        )
+        db.add(share)
+        db.commit()
+        return share
+
+    return make_share
+
@@ -1,16 +1,281 @@
-from sqlalchemy import create_engine, engine
+import threading
+import time
+from collections import deque
+
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, engine, text
 from sqlalchemy.engine import base
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker, declarative_base
 from .config import settings
+from .utils import TTLCache
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}/{settings.database_name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
+def create_db_engine(url: str, **kwargs):
+    """Engine on the psycopg 3 driver.
+
+    psycopg prepares a statement server-side once it has run
+    `db_prepare_threshold` times on a connection; a negative threshold turns
+    that off (needed behind a transaction-pooling PgBouncer).
+
+    Parallel query is off unless `db_max_parallel_workers_per_gather` says
+    otherwise (negative keeps the server's setting). Starting workers takes
+    milliseconds, more than they save on the API's short queries, yet the
+    planner picks them for joins across the partitions of `notes`.
+
+    Pools keep `db_pool_size` connections and open up to `db_max_overflow`
+    more under load, unless the caller says otherwise.
+    """
+    if "poolclass" not in kwargs:
+        kwargs.setdefault("pool_size", settings.db_pool_size)
+        kwargs.setdefault("max_overflow", settings.db_max_overflow)
+    if url.startswith("postgresql://"):
+        url = "postgresql+psycopg://" + url[len("postgresql://") :]
+    prepare_threshold = settings.db_prepare_threshold
+    if prepare_threshold < 0:
+        prepare_threshold = None
+    connect_args = {"prepare_threshold": prepare_threshold}
+    workers = settings.db_max_parallel_workers_per_gather
+    if workers >= 0:
+        connect_args["options"] = f"-c max_parallel_workers_per_gather={workers}"
+    return create_engine(url, connect_args=connect_args, **kwargs)
+
+
+# The primary database, which is also shard 0. Users, refresh tokens and
+# jobs live only here; notes and everything hanging off them live on their
+# owner's shard, see `ShardRouter`.
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=True, bind=engine, info={"shard": 0}
+)
 
 Base = declarative_base()
 
+# Clients that wrote within the last `read_your_writes_seconds` carry this
+# cookie and have their reads pinned to the primary.
+READ_PRIMARY_COOKIE = "read_primary"
+
+REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+    """
+)
+
+
+class ReplicaRouter:
+    """Decides whether a read can be served by the replica.
+
+    The replica's replay lag is sampled at most once per `check_interval`
+    seconds; a replica that lags more than `max_lag` or cannot be reached
+    is skipped until the next sample.
+    """
+
+    def __init__(self, replica_engine, max_lag, check_interval) -> None:
+        self.engine = replica_engine
+        self.session_factory = sessionmaker(
+            autocommit=False, autoflush=True, bind=replica_engine
+        )
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.healthy = False
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                lag = conn.execute(REPLICA_LAG_QUERY).scalar()
+            return lag is not None and float(lag) <= self.max_lag
+        except SQLAlchemyError:
+            return False
+
+    def is_available(self):
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return self.healthy
+        with self.lock:
+            if now - self.last_check >= self.check_interval:
+                self.healthy = self.check()
+                self.last_check = time.monotonic()
+        return self.healthy
+
+    def should_use_replica(self, request: Request):
+        if request.cookies.get(READ_PRIMARY_COOKIE):
+            return False
+        return self.is_available()
+
+
+replica_router = None
+if settings.database_replica_url:
+    replica_router = ReplicaRouter(
+        create_db_engine(settings.database_replica_url, pool_pre_ping=True),
+        max_lag=settings.replica_max_lag_seconds,
+        check_interval=settings.replica_check_interval_seconds,
+    )
+
+
+class StaleShard(Exception):
+    """The user's notes moved to another shard after the directory lookup."""
+
+
+# Note ids one `NoteIds` reserves per query to the primary
+NOTE_ID_BLOCK = 100
+
+
+class NoteIds:
+    """Note ids unique across shards, taken from the primary's
+    `notes_id_seq` in blocks of `NOTE_ID_BLOCK`, so the primary is asked once
+    per block. The sequence still steps by 1 for the inserts of an unsharded
+    database, and the ids of a block are consecutive unless other processes
+    took some meanwhile."""
+
+    def __init__(self) -> None:
+        self.ids = deque()
+        self.lock = threading.Lock()
+
+    def take(self, primary_db):
+        with self.lock:
+            if not self.ids:
+                self.ids.extend(
+                    primary_db.scalars(
+                        text(
+                            "SELECT nextval('notes_id_seq') "
+                            "FROM generate_series(1, :block)"
+                        ),
+                        {"block": NOTE_ID_BLOCK},
+                    ).all()
+                )
+            return self.ids.popleft()
+
+
+class ShardRouter:
+    """Maps a user to the database (shard) holding the notes they own.
+
+    `users.shard` on the primary is the directory. Lookups are cached for
+    `directory_ttl` seconds, which is why the rebalancer waits that long
+    before deleting a moved user's rows from the old shard. The `users`
+    table itself is copied to every shard so that notes and shares keep
+    their foreign keys and joins.
+
+    With a single database every user maps to shard 0 and nothing is looked
+    up or checked.
+    """
+
+    def __init__(self, engines, directory_ttl, cache_size) -> None:
+        self.engines = engines
+        self.session_factories = [
+            sessionmaker(
+                autocommit=False, autoflush=True, bind=shard_engine, info={"shard": i}
+            )
+            for i, shard_engine in enumerate(engines)
+        ]
+        self.directory_ttl = directory_ttl
+        self.directory = TTLCache(maxsize=cache_size)
+        self.note_ids = NoteIds()
+
+    @property
+    def sharded(self):
+        return len(self.engines) > 1
+
+    def shard_of(self, primary_db, user_id: int):
+        if not self.sharded:
+            return 0
+        shard = self.directory.get(user_id)
+        if shard is None:
+            shard = primary_db.scalar(
+                text("SELECT shard FROM users WHERE id = :id"), {"id": user_id}
+            )
+            if shard is None:
+                return 0
+            self.directory.set(
+                user_id, shard, expires_at=time.time() + self.directory_ttl
+            )
+        return shard
+
+    def forget(self, user_id: int):
+        self.directory.discard(user_id)
+
+    def new_note_id(self, primary_db):
+        """An id for a new note, or None to let the database pick one."""
+        return self.note_ids.take(primary_db) if self.sharded else None
+
+
+shard_router = ShardRouter(
+    [engine]
+    + [
+        create_db_engine(url.strip(), pool_pre_ping=True)
+        for url in settings.database_shard_urls.split(",")
+        if url.strip()
+    ],
+    directory_ttl=settings.shard_directory_ttl_seconds,
+    cache_size=settings.shard_directory_cache_size,
+)
+
+
+def shard_index(db):
+    """The shard `db` is connected to."""
+    return db.info.get("shard", 0)
+
+
+class ShardSessions:
+    """The sessions of one request, one per shard it touches, opened on
+    first use. Shard 0's is the request's primary (or replica) session."""
+
+    def __init__(self, router: ShardRouter, primary_db) -> None:
+        self.router = router
+        self.primary = primary_db
+        self.sessions = {0: primary_db}
+
+    def shard(self, index: int):
+        if index not in self.sessions:
+            self.sessions[index] = self.router.session_factories[index]()
+        return self.sessions[index]
+
+    def of(self, user_id: int):
+        """The session of the shard holding `user_id`'s notes."""
+        return self.shard(self.router.shard_of(self.primary, user_id))
+
+    def for_write(self, user_id: int):
+        """Like `of`, but also checks, under a lock held until the session
+        commits, that the notes have not been moved off that shard since the
+        lookup. Raises `StaleShard` if they have."""
+        db = self.of(user_id)
+        if self.router.sharded:
+            shard = db.scalar(
+                text("SELECT shard FROM users WHERE id = :id FOR SHARE"),
+                {"id": user_id},
+            )
+            if shard is not None and shard != shard_index(db):
+                self.router.forget(user_id)
+                db.rollback()
+                raise StaleShard(user_id)
+        return db
+
+    def all(self, first_user_id: int = None):
+        """Every shard's session, starting with `first_user_id`'s shard."""
+        indexes = list(range(len(self.router.engines)))
+        if first_user_id is not None:
+            first = self.router.shard_of(self.primary, first_user_id)
+            indexes.insert(0, indexes.pop(first))
+        return [self.shard(i) for i in indexes]
+
+    def new_note_id(self):
+        return self.router.new_note_id(self.primary)
+
+    def close(self):
+        for index, db in self.sessions.items():
+            if index != 0:
+                db.close()
+
 
 def get_db():
     db = SessionLocal()
@@ -18,3 +283,38 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db(request: Request, db=Depends(get_db)):
+    """Session for read-only endpoints: the replica when it is safe, else `db`."""
+    router = replica_router
+    if router is None or not router.should_use_replica(request):
+        yield db
+        return
+    replica_db = router.session_factory()
+    try:
+        yield replica_db
+    finally:
+        replica_db.close()
+
+
+def get_shards(db=Depends(get_db)):
+    shards = ShardSessions(shard_router, db)
+    try:
+        yield shards
+    finally:
+        shards.close()
+
+
+def get_read_shards(db=Depends(get_read_db)):
+    """Like `get_shards`, but shard 0 may be read from the replica."""
+    shards = ShardSessions(shard_router, db)
+    try:
+        yield shards
+    finally:
+        shards.close()
+
+
+def is_replica(db):
+    """Whether `db` reads from the replica rather than the primary."""
+    return replica_router is not None and db.get_bind() is replica_router.engine
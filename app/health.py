@@ -0,0 +1,127 @@
+"""Liveness, readiness and draining.
+
+`/readyz` fails while the worker drains, while every connection of the
+engine's pool is checked out, or when a pooled connection cannot run
+``SELECT 1``. A load balancer then sends new requests elsewhere. `/healthz`
+only says the process is up, and keeps answering through all of that.
+
+Draining starts with SIGTERM. The worker keeps serving, but `/readyz`
+answers 503 for `drain_seconds`, long enough for the load balancer to
+notice. Then the worker starts uvicorn's graceful shutdown, which lets
+in-flight requests finish. A second SIGTERM skips the wait.
+
+uvicorn's supervisor stops its workers one after another, so the first
+worker to drain also leaves a marker file named after the supervisor's
+pid and start time. The other workers report draining from then on, and
+skip the part of the wait that has already passed. The marker can also be
+created from outside, e.g. by a Kubernetes ``preStop`` hook, to drain
+every worker at once.
+"""
+import asyncio
+import functools
+import os
+import signal
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+
+from app.config import settings
+
+# Probes skip rate and concurrency limits: a worker must not look dead
+# because it is busy
+PROBE_PATHS = {"/healthz", "/readyz"}
+
+
+@functools.lru_cache
+def supervisor_run(ppid: int):
+    """The supervisor's pid and, on Linux, its start time. The pid alone
+    repeats: it is 1 in every run of a container, and a restarted container
+    keeps its /tmp."""
+    try:
+        with open(f"/proc/{ppid}/stat") as f:
+            # Field 22; the command name before it may contain spaces
+            started = f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return str(ppid)
+    return f"{ppid}-{started}"
+
+
+def marker_path():
+    directory = settings.drain_dir or tempfile.gettempdir()
+    return os.path.join(directory, f"mind-castle-{supervisor_run(os.getppid())}.drain")
+
+
+class Drain:
+    def __init__(self) -> None:
+        self.started_at = None
+
+    def draining(self):
+        return self.started_at is not None or os.path.exists(marker_path())
+
+    def start(self):
+        """Report draining from now on, here and in the sibling workers.
+        Returns the seconds left to wait before shutting down."""
+        if self.started_at is not None:
+            return 0.0
+        path = marker_path()
+        try:
+            # Another worker may have started the drain a while ago
+            self.started_at = os.stat(path).st_mtime
+        except FileNotFoundError:
+            with open(path, "a"):
+                pass
+            self.started_at = time.time()
+        return max(0.0, self.started_at + settings.drain_seconds - time.time())
+
+
+drain = Drain()
+
+
+def install_signal_handler():
+    """Drain on SIGTERM instead of shutting down at once. Takes over
+    uvicorn's handler, so call it from the server's event loop once it has
+    started."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+
+    def on_sigterm():
+        # uvicorn still handles SIGINT: a graceful shutdown
+        loop.call_later(drain.start(), os.kill, os.getpid(), signal.SIGINT)
+
+    loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+
+
+def pool_status(engine):
+    """Connections of `engine`'s pool in use and available, or None for
+    pools without a fixed size. The pool may overflow by the configured
+    `db_max_overflow`, which `create_db_engine` gives it."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool) or settings.db_max_overflow < 0:
+        return None
+    return {
+        "checked_out": pool.checkedout(),
+        "capacity": pool.size() + settings.db_max_overflow,
+    }
+
+
+def readiness(engine):
+    """`(ready, details)` of this worker."""
+    if drain.draining():
+        return False, {"status": "draining"}
+    pool = pool_status(engine)
+    if pool is not None and pool["checked_out"] >= pool["capacity"] * (
+        settings.ready_max_pool_saturation
+    ):
+        # Checking out another connection would wait for one to come back
+        return False, {"status": "pool exhausted", "pool": pool}
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        return False, {"status": "database unavailable", "pool": pool}
+    return True, {"status": "ready", "pool": pool}
@@ -0,0 +1,283 @@
+"""Background jobs backed by the `jobs` table.
+
+Request handlers `enqueue` a job and return at once; `python -m app.worker`
+runs them. A worker claims the oldest due job with `FOR UPDATE SKIP LOCKED`,
+so any number of workers can poll the same table without handing a job out
+twice. Each job type declares how many of its jobs may run at once across
+all workers; a worker enforces that by holding one of the type's
+`concurrency` advisory locks (slots) while the job runs, which PostgreSQL
+releases by itself if the worker dies.
+
+A handler that raises is retried with exponential backoff until
+`max_attempts` is reached, then marked failed.
+
+A running job holds a lease of `job_lease_seconds`, which a thread of the
+worker renews every third of that for as long as the handler runs. A job
+whose lease ran out belonged to a worker that died, and is queued again,
+however long it has been running.
+"""
+import random
+import threading
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict
+
+from sqlalchemy import func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app import database, list_cache, stats
+from app.config import settings
+from app.models import Job, Note, SharedNotes, User
+
+
+@dataclass
+class JobType:
+    handler: Callable
+    concurrency: int
+    max_attempts: int
+
+
+JOB_TYPES: Dict[str, JobType] = {}
+
+
+def job(name: str, concurrency: int = 1, max_attempts: int = 5):
+    """Register the decorated `handler(db, payload) -> result` as job `name`."""
+
+    def register(handler):
+        JOB_TYPES[name] = JobType(handler, concurrency, max_attempts)
+        return handler
+
+    return register
+
+
+def enqueue(db: Session, job_type: str, payload: dict = None, user_id: int = None):
+    """Add a job; it is visible to workers once `db` commits."""
+    new_job = Job(
+        type=job_type,
+        payload=payload or {},
+        user_id=user_id,
+        max_attempts=JOB_TYPES[job_type].max_attempts,
+    )
+    db.add(new_job)
+    db.flush()
+    return new_job
+
+
+def backoff_seconds(attempts: int):
+    """Delay before retry number `attempts`, with jitter so a burst of failing
+    jobs does not retry in lockstep."""
+    delay = settings.job_retry_base_seconds * 2 ** (attempts - 1)
+    return min(delay, settings.job_retry_max_seconds) * random.uniform(0.5, 1.0)
+
+
+def slot_key(job_type: str):
+    # pg_advisory_lock(int4, int4) takes signed 32-bit keys
+    return zlib.crc32(job_type.encode()) - 2**31
+
+
+def acquire_slot(db: Session, job_type: str):
+    """Take a free concurrency slot for `job_type`; return it, or None if all
+    are held. Slots are session-level locks, so they survive commits on `db`."""
+    key = slot_key(job_type)
+    for slot in range(JOB_TYPES[job_type].concurrency):
+        if db.scalar(select(func.pg_try_advisory_lock(key, slot))):
+            return slot
+    return None
+
+
+def release_slot(db: Session, job_type: str, slot: int):
+    db.execute(select(func.pg_advisory_unlock(slot_key(job_type), slot)))
+
+
+def claim(db: Session):
+    """Mark the oldest due job whose type has a free slot as running.
+
+    Returns `(job, slot)` or None when there is nothing to run.
+    """
+    types = set(JOB_TYPES)
+    while types:
+        candidate = db.scalars(
+            select(Job)
+            .where(
+                Job.status == "queued",
+                Job.run_at <= func.now(),
+                Job.type.in_(types),
+            )
+            .order_by(Job.run_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+        if candidate is None:
+            db.rollback()
+            return None
+        slot = acquire_slot(db, candidate.type)
+        if slot is None:
+            # Type is at its concurrency limit; look at the other types
+            types.discard(candidate.type)
+            db.rollback()
+            continue
+        candidate.status = "running"
+        candidate.attempts += 1
+        candidate.locked_at = func.now()
+        candidate.lease_until = lease_end()
+        db.commit()
+        return candidate, slot
+    return None
+
+
+def lease_end():
+    return func.now() + timedelta(seconds=settings.job_lease_seconds)
+
+
+def renew_lease(db: Session, job_id: int, attempt: int):
+    """Extend the lease of attempt `attempt` of job `job_id`. Returns False
+    if that attempt no longer runs, as when it was requeued meanwhile."""
+    renewed = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "running", Job.attempts == attempt)
+        .values(lease_until=lease_end())
+    ).rowcount
+    db.commit()
+    return renewed == 1
+
+
+class Lease:
+    """Renews a running job's lease until the block ends. It uses a
+    connection of its own, since the handler holds the worker's."""
+
+    def __init__(self, engine, job_id: int, attempt: int) -> None:
+        self.engine = engine
+        self.job_id = job_id
+        self.attempt = attempt
+        self.done = threading.Event()
+        self.thread = threading.Thread(
+            target=self.renew, name=f"job-lease-{job_id}", daemon=True
+        )
+
+    def renew(self):
+        while not self.done.wait(settings.job_lease_seconds / 3):
+            try:
+                with Session(bind=self.engine) as db:
+                    if not renew_lease(db, self.job_id, self.attempt):
+                        return
+            except SQLAlchemyError:
+                # The lease outlasts a missed renewal; try again next time
+                continue
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.thread.join()
+
+
+def run_next(db: Session):
+    """Claim and run one job. Returns the job, or None if none was due.
+
+    `db` must stay on one connection (the worker binds it to one) so the
+    slot taken in `claim` is released on the connection that holds it.
+    """
+    claimed = claim(db)
+    if claimed is None:
+        return None
+    current, slot = claimed
+    job_id, job_type, payload = current.id, current.type, current.payload
+    lease = Lease(db.get_bind().engine, job_id, current.attempts)
+    try:
+        try:
+            with lease:
+                result = JOB_TYPES[job_type].handler(db, payload)
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            current = db.get(Job, job_id)
+            current.last_error = f"{e.__class__.__name__}: {e}"
+            if current.attempts < current.max_attempts:
+                current.status = "queued"
+                current.run_at = datetime.now(timezone.utc) + timedelta(
+                    seconds=backoff_seconds(current.attempts)
+                )
+            else:
+                current.status = "failed"
+                current.finished_at = func.now()
+        else:
+            current = db.get(Job, job_id)
+            current.status = "succeeded"
+            current.result = result
+            current.finished_at = func.now()
+        current.locked_at = None
+        current.lease_until = None
+        db.commit()
+    finally:
+        release_slot(db, job_type, slot)
+        db.commit()
+    return current
+
+
+def requeue_stale(db: Session):
+    """Put back jobs left running by a worker that died mid-job: those whose
+    lease was not renewed in time."""
+    requeued = db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.lease_until < func.now())
+        .values(status="queued", locked_at=None, lease_until=None, run_at=func.now())
+    ).rowcount
+    db.commit()
+    return requeued
+
+
+# * Handlers
+@job("bulk_share", concurrency=2)
+def bulk_share(db: Session, payload: dict):
+    """Share a note with many users at once; existing shares are kept."""
+    shards = database.ShardSessions(database.shard_router, db)
+    try:
+        # Jobs enqueued before sharding name no owner; their notes are on
+        # the primary
+        shard_db = (
+            shards.for_write(payload["owner_id"]) if "owner_id" in payload else db
+        )
+        shared = share_with(shard_db, payload)
+        if shard_db is not db:
+            shard_db.commit()
+    finally:
+        shards.close()
+    return {"shared": len(shared)}
+
+
+def share_with(db: Session, payload: dict):
+    note_id = payload["note_id"]
+    live = select(Note.owner_id).where(Note.id == note_id, Note.deleted_at.is_(None))
+    owner_id = db.scalar(live)
+    if owner_id is None:
+        return []
+    recipients = select(
+        User.id,
+        literal(note_id),
+        literal(owner_id),
+        literal(payload["permission"], SharedNotes.permission.type),
+    ).where(User.id.in_(payload["user_ids"]), User.deleted_at.is_(None))
+    stmt = insert(SharedNotes).from_select(
+        ["user_id", "note_id", "owner_id", "permission"], recipients
+    )
+    shared = db.scalars(
+        stmt.on_conflict_do_nothing().returning(SharedNotes.user_id)
+    ).all()
+    stats.share_many(db, shared)
+    list_cache.invalidate(db, shared)
+    return shared
+
+
+@job("reconcile_stats")
+def reconcile_stats(db: Session, payload: dict):
+    batch_size = payload.get("batch_size", 5000)
+    repaired = stats.reconcile(db, batch_size)
+    for session_factory in database.shard_router.session_factories[1:]:
+        with session_factory() as shard_db:
+            repaired += stats.reconcile(shard_db, batch_size)
+    return {"repaired": repaired}
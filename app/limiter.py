@@ -0,0 +1,190 @@
+"""Adaptive concurrency limit for the API.
+
+When PostgreSQL slows down, requests wait for a pooled connection or a
+threadpool slot, and every request behind them gets slower. The limiter
+caps how many requests are in flight and answers the rest at once with
+``503`` and ``Retry-After``, which a client can act on, instead of a
+response that arrives after it gave up.
+
+The cap is not fixed. It grows by one for every `limit` requests that
+complete on time while the limiter is at least half used, and shrinks by
+`backoff` when recent requests take `tolerance` times longer than the
+lowest latency seen lately on their route, or a request fails with a
+5xx. That lowest latency stands for the time a request of the route takes
+without queueing, so the cap settles where requests just stop queueing
+(AIMD). Routes are compared with themselves, since a tag count is much
+cheaper than a search. Only successful requests that reached a route are
+timed: rejections, 4xx and list cache hits say nothing about the database.
+
+Requests have a priority. Cheap reads may use only part of the cap, so
+they are shed first; writes may use more, and logging in or refreshing a
+token may use all of it.
+
+The limiter counts the requests of one process and is only used from its
+event loop.
+"""
+import time
+from collections import Counter
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp
+
+from app.config import settings
+from app.health import PROBE_PATHS
+
+AUTH_PATHS = {"/api/auth/login", "/api/auth/refresh", "/api/auth/logout"}
+
+# Share of the limit each priority may fill
+PRIORITY_SHARES = {"auth": 1.0, "write": 0.9, "read": 0.75}
+
+# Weight of the latest sample in the recent latency
+SHORT_RTT_WEIGHT = 0.2
+
+# Below timer resolution; keeps the latency ratios finite
+MIN_RTT = 1e-6
+
+
+def priority(request: Request):
+    if request.url.path in AUTH_PATHS:
+        return "auth"
+    if request.method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        tolerance: float = 2.0,
+        backoff: float = 0.9,
+        baseline_samples: int = 1000,
+    ) -> None:
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.baseline_samples = baseline_samples
+        self.reset()
+
+    def reset(self):
+        self.limit = float(self.initial)
+        self.inflight = 0
+        # Recent latency as a multiple of its route's baseline, smoothed
+        self.queueing = None
+        # Per route: [lowest latency in the window, samples left in it]
+        self.baselines = {}
+        self.since_decrease = 0
+        self.admitted = Counter()
+        self.shed = Counter()
+
+    def acquire(self, priority: str) -> bool:
+        """Take a slot for a request of `priority`, unless it must be shed."""
+        if self.inflight >= self.limit * PRIORITY_SHARES[priority]:
+            self.shed[priority] += 1
+            return False
+        self.inflight += 1
+        self.admitted[priority] += 1
+        return True
+
+    def baseline(self, route, latency: float):
+        """The lowest latency of `route` lately, `latency` included."""
+        entry = self.baselines.get(route)
+        # Forget the baseline now and then: the no-load latency moves too
+        if entry is None or entry[1] <= 0:
+            entry = self.baselines[route] = [latency, self.baseline_samples]
+        entry[0] = min(entry[0], latency)
+        entry[1] -= 1
+        return entry[0]
+
+    def release(self, latency: float = None, ok: bool = True, route=None):
+        """Give back a slot. `latency` is None for requests whose duration
+        says nothing about load, such as uploads or cache hits."""
+        self.inflight -= 1
+        if ok:
+            if latency is None:
+                return
+            ratio = latency / max(self.baseline(route, latency), MIN_RTT)
+            if self.queueing is None:
+                self.queueing = ratio
+            self.queueing += SHORT_RTT_WEIGHT * (ratio - self.queueing)
+
+        self.since_decrease += 1
+        if not ok or self.queueing > self.tolerance:
+            # At most once per `limit` samples, so one slow burst does not
+            # collapse the limit before the smaller one has been tried
+            if self.since_decrease >= self.limit:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.since_decrease = 0
+        elif self.inflight + 1 >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def metrics(self):
+        return {
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "queueing": self.queueing,
+            "min_rtt": {
+                getattr(route, "__name__", str(route)): entry[0]
+                for route, entry in self.baselines.items()
+            },
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+        }
+
+
+def create():
+    return AdaptiveLimiter(
+        initial=settings.concurrency_initial_limit,
+        min_limit=settings.concurrency_min_limit,
+        max_limit=settings.concurrency_max_limit,
+        tolerance=settings.concurrency_latency_tolerance,
+        backoff=settings.concurrency_backoff,
+    )
+
+
+class ConcurrencyLimitMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app: ASGIApp, limiter: AdaptiveLimiter) -> None:
+        super().__init__(app)
+        self.limiter = limiter
+
+    async def dispatch(self, request: Request, call_next):
+        if not settings.concurrency_limit_enabled or request.url.path in PROBE_PATHS:
+            return await call_next(request)
+        if not self.limiter.acquire(priority(request)):
+            return JSONResponse(
+                content={"detail": "Server overloaded, retry later"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(settings.concurrency_retry_after_seconds)},
+            )
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        except Exception as e:
+            client_error = isinstance(e, HTTPException) and e.status_code < 500
+            self.limiter.release(ok=client_error)
+            raise
+        except BaseException:
+            # Cancelled, as when the client went away: not our failure
+            self.limiter.release()
+            raise
+        # Set by the router once the request reaches a route
+        route = request.scope.get("endpoint")
+        sampled = (
+            route is not None
+            and 200 <= response.status_code < 300
+            and response.headers.get("X-Cache") != "HIT"
+            # Upload time depends on the client's bandwidth, not on our load
+            and not request.headers.get("content-type", "").startswith("multipart/")
+        )
+        self.limiter.release(
+            time.perf_counter() - started if sampled else None,
+            ok=response.status_code < 500,
+            route=route,
+        )
+        return response
@@ -0,0 +1,195 @@
+"""Cache of rendered note list pages.
+
+`GET /api/notes` and `GET /api/notes/shared/` cache their JSON bodies under
+``(kind, user_id, generation, limit, skip, ...)``. Every write that changes
+what a user's lists show bumps that user's generation. That one increment
+makes all of their cached pages unreachable at once: nothing has to find or
+delete the old pages, which simply age out after `list_cache_ttl_seconds`.
+
+Write paths call `invalidate(db, user_ids)` in the transaction that changes
+the lists. The bump happens after that transaction commits. Bumping before
+the commit would let a concurrent reader cache the old rows under the new
+generation.
+
+Backends (`LIST_CACHE_BACKEND`):
+
+- ``memory``: this process only. Writes made by other processes, such as
+  the job worker, show up once the cached pages expire.
+- ``redis``: shared by every process. Set `LIST_CACHE_REDIS_URL`.
+- ``none``: no caching.
+"""
+import asyncio
+import math
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.utils import TTLCache
+
+PENDING_KEY = "list_cache_bumps"
+
+
+class ListCache:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def metrics(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class MemoryListCache(ListCache):
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        super().__init__()
+        self.ttl = ttl
+        self.pages = TTLCache(maxsize)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def generation(self, user_id: int):
+        return self.generations.get(user_id, 0)
+
+    def get(self, key):
+        return self.pages.get(key)
+
+    def set(self, key, body: bytes):
+        self.pages.set(key, body, expires_at=time.time() + self.ttl)
+
+    def bump(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.generations[user_id] = self.generations.get(user_id, 0) + 1
+
+
+class RedisListCache(ListCache):
+    """Pages and generations in Redis, through aioredis on a private event
+    loop thread, so sync endpoints and workers can use it as well. A Redis
+    error counts as a miss rather than failing the request.
+
+    Each call blocks its thread for up to `list_cache_redis_timeout_seconds`,
+    so the list endpoints are plain ``def`` and run in the threadpool rather
+    than on the event loop."""
+
+    def __init__(self, url: str, ttl: float, client=None) -> None:
+        super().__init__()
+        self.ttl = math.ceil(ttl)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self.loop.run_forever, name="list-cache-redis", daemon=True
+        ).start()
+        if client is None:
+            import aioredis
+
+            client = aioredis.from_url(url)
+        self.client = client
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(
+            timeout=settings.list_cache_redis_timeout_seconds
+        )
+
+    def call(self, coroutine):
+        try:
+            return self.run(coroutine)
+        except Exception:
+            self.errors += 1
+            return None
+
+    def generation(self, user_id: int):
+        """The user's generation, or None if Redis cannot be reached."""
+        try:
+            value = self.run(self.client.get(f"list-gen:{user_id}"))
+        except Exception:
+            self.errors += 1
+            return None
+        return int(value or 0)
+
+    def get(self, key):
+        return self.call(self.client.get(page_key(key)))
+
+    def set(self, key, body: bytes):
+        self.call(self.client.set(page_key(key), body, ex=self.ttl))
+
+    def bump(self, user_ids):
+        async def incr_all():
+            pipe = self.client.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.incr(f"list-gen:{user_id}")
+            await pipe.execute()
+
+        self.call(incr_all())
+
+
+def page_key(key):
+    return "list-page:" + ":".join(str(part) for part in key)
+
+
+def create():
+    # `memory` only suits a single process: the other workers and the job
+    # worker keep serving a user's old pages after a write until they expire
+    backend = settings.list_cache_backend or (
+        "redis" if settings.list_cache_redis_url else "none"
+    )
+    if backend == "memory":
+        return MemoryListCache(
+            settings.list_cache_size, settings.list_cache_ttl_seconds
+        )
+    if backend == "redis":
+        return RedisListCache(
+            settings.list_cache_redis_url, settings.list_cache_ttl_seconds
+        )
+    return None
+
+
+cache = create()
+
+
+def page(kind: str, user_id: int, params: tuple, render, store: bool = True):
+    """The page `(kind, *params)` of `user_id`'s lists as JSON bytes, and
+    whether it came from the cache. `render()` builds it on a miss."""
+    backend = cache
+    generation = None if backend is None else backend.generation(user_id)
+    if generation is None:
+        # Without a trustworthy generation any cached page could be stale
+        return render(), False
+    key = (kind, user_id, generation, *params)
+    body = backend.get(key)
+    if body is not None:
+        backend.hits += 1
+        return body, True
+    backend.misses += 1
+    body = render()
+    if store:
+        backend.set(key, body)
+    return body, False
+
+
+def invalidate(db: Session, user_ids):
+    """Bump the generations of `user_ids` once `db` commits."""
+    db.info.setdefault(PENDING_KEY, set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def bump_after_commit(db: Session):
+    user_ids = db.info.pop(PENDING_KEY, None)
+    if user_ids and cache is not None:
+        cache.bump(sorted(user_ids))
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_after_rollback(db: Session):
+    db.info.pop(PENDING_KEY, None)
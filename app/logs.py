@@ -0,0 +1,198 @@
+"""Structured logging that stays off the request path.
+
+Records are put on a bounded queue and written as one JSON object per line
+by a background thread, so a slow stdout never stalls a request. When the
+queue is full, records are dropped and counted rather than waited for.
+
+Every record logged while a request is handled carries its request id.
+`RequestIdMiddleware` takes the id from the ``X-Request-ID`` header or
+makes one, stores it in the ASGI scope (``request.state.request_id``) and
+a context variable, and returns it in the response headers.
+
+High-volume events are sampled: the access log keeps
+`log_access_sample_rate` of ordinary requests but every failed or slow
+one, and SQL statements (`log_sql`) are kept at `log_sql_sample_rate`.
+Warnings and errors are never sampled.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+
+access_logger = logging.getLogger("app.access")
+
+request_id: ContextVar = ContextVar("request_id", default=None)
+
+# Accepted from clients as is; anything else is replaced
+REQUEST_ID_RE = re.compile(r"[\w.:-]{1,64}")
+
+# Attributes every LogRecord has; the rest came in through `extra`
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Keep `rate` of the records below WARNING from logger `name` and its
+    children, and all others.
+
+    Logger filters skip the records of child loggers, so this goes on the
+    handler: SQLAlchemy logs to ``sqlalchemy.engine.Engine``, not to
+    ``sqlalchemy.engine``.
+    """
+
+    def __init__(self, name: str, rate: float) -> None:
+        super().__init__(name)
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not super().filter(record):
+            return True
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue records without blocking; count the ones that do not fit."""
+
+    def __init__(self, queue) -> None:
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord):
+        # Only what must happen on the caller's thread: the arguments and
+        # traceback may not outlive the call. Formatting waits for the
+        # listener.
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+handler = None
+listener = None
+
+
+def configure(stream=None):
+    """Send the root logger's records through the queue to `stream`
+    (stdout). Calling it again replaces the previous setup."""
+    global handler, listener
+    shutdown()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter())
+    handler = DroppingQueueHandler(queue.Queue(settings.log_queue_size))
+    handler.addFilter(SampleFilter("sqlalchemy.engine", settings.log_sql_sample_rate))
+    handler.addFilter(RequestIdFilter())
+    listener = QueueListener(handler.queue, output)
+    listener.start()
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(settings.log_level.upper())
+
+    sql_logger = logging.getLogger("sqlalchemy.engine")
+    sql_logger.setLevel(logging.INFO if settings.log_sql else logging.WARNING)
+
+
+def shutdown():
+    """Write out the queued records and stop the listener thread."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(shutdown)
+
+
+class RequestIdMiddleware:
+    """Tag each request with an id and write its access log entry."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        rid = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                rid = value.decode("latin-1")
+                break
+        if rid is None or not REQUEST_ID_RE.fullmatch(rid):
+            rid = os.urandom(16).hex()
+        scope.setdefault("state", {})["request_id"] = rid
+        token = request_id.set(rid)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = rid
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            if status_code >= 500 or ms >= settings.log_slow_request_ms:
+                level = logging.WARNING
+            elif random.random() < settings.log_access_sample_rate:
+                level = logging.INFO
+            else:
+                # Sampled out before any record is built
+                level = None
+            if level is not None:
+                access_logger.log(
+                    level,
+                    "%s %s %s",
+                    scope["method"],
+                    scope["path"],
+                    status_code,
+                    extra={"status": status_code, "ms": round(ms, 3)},
+                )
+            request_id.reset(token)
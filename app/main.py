@@ -1,16 +1,30 @@
-from fastapi import FastAPI, Request, HTTPException, status
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware, DispatchFunction
 from starlette.types import ASGIApp
 
+from app import body_limit, database, health, limiter, logs, profiling
 from .database import engine
 from app.models import Base
-from app.routers import auth, notes
+from app.routers import attachments, auth, health as health_router, jobs, notes, users
+from app.routers import profiling as profiling_router
 from app.utils import TokenBucket
+from app.config import settings
+
+
+logs.configure()
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    health.install_signal_handler()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # models.Base.metadata.create_all(bind=engine)
 
@@ -21,25 +35,56 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         self.bucket = bucket
 
     async def dispatch(self, request: Request, call_next):
-        if self.bucket.take_token():
+        if request.url.path in health.PROBE_PATHS or self.bucket.take_token():
             return await call_next(request)
-        error_response = JSONResponse(
+        # Middleware runs outside the app's exception handlers, where an
+        # HTTPException would become a 500
+        return JSONResponse(
             content={"detail": "Rate Limit Exceeded"},
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
         )
-        raise HTTPException(
-            detail="Rate Limit Exceeded",
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-        )
+
+
+class ReadYourWritesMiddleware(BaseHTTPMiddleware):
+    """Pin a client's reads to the primary for a short window after it writes."""
+
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        if (
+            database.replica_router is not None
+            and request.method not in ("GET", "HEAD", "OPTIONS")
+            and response.status_code < 400
+        ):
+            response.set_cookie(
+                key=database.READ_PRIMARY_COOKIE,
+                value="1",
+                max_age=settings.read_your_writes_seconds,
+                httponly=True,
+                # Like the refresh cookie, so the cross-site frontend sends it
+                samesite="none",
+                secure=True,
+            )
+        return response
 
 
 bucket = TokenBucket(capacity=50, refill_rate=5)
+concurrency_limiter = limiter.create()
 
+# Inside the rate limit, so rate-limited requests never take a slot
+app.add_middleware(limiter.ConcurrencyLimitMiddleware, limiter=concurrency_limiter)
 app.add_middleware(RateLimitMiddleware, bucket=bucket)
+app.add_middleware(ReadYourWritesMiddleware)
 
 
 app.include_router(auth.router)
 app.include_router(notes.router)
+app.include_router(users.router)
+app.include_router(jobs.router)
+app.include_router(attachments.router)
+app.include_router(health_router.router)
+if settings.profiling_enabled:
+    profiling.install(app)
+    app.include_router(profiling_router.router)
 origins = [
     "http://localhost:5173",
     "http://localhost:3000",
@@ -51,6 +96,7 @@ origins = [
 ]
 
 
+app.add_middleware(body_limit.BodySizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -58,6 +104,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(logs.RequestIdMiddleware)
+
+
+@app.exception_handler(database.StaleShard)
+async def stale_shard_handler(request: Request, exc: database.StaleShard):
+    # The user's notes are being moved to another shard; the next try
+    # looks them up afresh
+    return JSONResponse(
+        content={"detail": "Temporarily unavailable, please retry"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.get("/")
@@ -0,0 +1,207 @@
+"""Helpers for migrations that run while the API is serving.
+
+A plain ``CREATE INDEX`` blocks writes to its table until the index is
+built, and an ``UPDATE`` of every row holds its row locks until the
+migration commits. On a large table either one stalls the API for
+minutes. Use these instead:
+
+- `create_index_concurrently` / `drop_index_concurrently` for indexes on
+  existing tables, and `create_partitioned_index_concurrently` for indexes
+  on partitioned ones.
+- `backfill` to fill a new column in small, separately committed batches.
+- `copy_rows` to fill a new table the same way, e.g. to rebuild one with a
+  different layout while triggers keep it in step with the old one.
+
+All of them run outside the migration's transaction, so only call them from
+migrations that do nothing else that needs to be atomic with them.
+`alembic/env.py` also sets `migration_lock_timeout_ms`, so DDL that cannot
+get its lock at once fails instead of queueing. A queued lock would block
+every query on the table that arrives after it.
+"""
+import logging
+import time
+
+from alembic import op
+from sqlalchemy import text
+
+from app.config import settings
+
+# Under "alembic", so alembic.ini's logging config shows it
+log = logging.getLogger("alembic.backfill")
+
+
+def drop_invalid_index(name: str):
+    """Drop index `name` if an interrupted concurrent build left it invalid."""
+    invalid = (
+        op.get_bind()
+        .execute(
+            text(
+                "SELECT NOT i.indisvalid FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+            ),
+            {"name": name},
+        )
+        .scalar()
+    )
+    if invalid:
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def create_index_concurrently(name: str, table: str, columns, **kwargs):
+    """`op.create_index` without blocking writes to `table`. Safe to run
+    again after an interruption."""
+    with op.get_context().autocommit_block():
+        drop_invalid_index(name)
+        op.create_index(
+            name,
+            table,
+            columns,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+            **kwargs,
+        )
+
+
+def create_partitioned_index_concurrently(name: str, table: str, columns: str):
+    """`create_index_concurrently` for a partitioned `table`; `columns` is
+    the SQL between the index's parentheses.
+
+    PostgreSQL cannot build an index on a partitioned table concurrently.
+    This creates it on the parent alone, where it stays invalid, then builds
+    one on each partition concurrently and attaches it. The parent's index
+    turns valid once every partition has one. Safe to run again after an
+    interruption."""
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({columns})")
+        partitions = bind.execute(
+            text(
+                "SELECT inhrelid::regclass::text FROM pg_inherits "
+                "WHERE inhparent = CAST(:table AS regclass) ORDER BY 1"
+            ),
+            {"table": table},
+        ).scalars()
+        for partition in partitions.all():
+            partition_index = f"{partition}_{name}"[:63]
+            drop_invalid_index(partition_index)
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} "
+                f"ON {partition} ({columns})"
+            )
+            # Does nothing if it is attached already
+            op.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+
+def drop_index_concurrently(name: str, table: str):
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            name, table_name=table, postgresql_concurrently=True, if_exists=True
+        )
+
+
+def backfill(
+    table: str,
+    set_: str,
+    where: str,
+    key="id",
+    batch_size: int = None,
+    pause: float = None,
+):
+    """``UPDATE table SET set_ WHERE where``, `batch_size` rows at a time in
+    `key` order, committing each batch and sleeping `pause` seconds between
+    them. `key` is a unique key of `table`: a column, or a list of them.
+    `where` must match only the rows still to be updated (e.g.
+    ``tags IS NULL``): a backfill that was interrupted then carries on where
+    it stopped when the migration runs again. Returns the rows updated."""
+    batch_size = batch_size or settings.migration_batch_size
+    pause = settings.migration_batch_pause_seconds if pause is None else pause
+    key = [key] if isinstance(key, str) else key
+    key_names = ", ".join(key)
+    after_key = ", ".join(f":after_{i}" for i in range(len(key)))
+
+    def next_batch(after):
+        pending = (
+            f"({where})"
+            if after is None
+            else f"({key_names}) > ({after_key}) AND ({where})"
+        )
+        return text(
+            f"UPDATE {table} SET {set_} WHERE ({key_names}) IN ("
+            f"SELECT {key_names} FROM {table} WHERE {pending} "
+            f"ORDER BY {key_names} LIMIT :batch_size) RETURNING {key_names}"
+        )
+
+    after, total = None, 0
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            params = {f"after_{i}": value for i, value in enumerate(after or ())}
+            keys = bind.execute(
+                next_batch(after), {**params, "batch_size": batch_size}
+            ).all()
+            if not keys:
+                return total
+            total += len(keys)
+            after = max(tuple(row) for row in keys)
+            log.info(
+                "Backfilled %d rows of %s, up to (%s)=%s",
+                total,
+                table,
+                key_names,
+                after,
+            )
+            time.sleep(pause)
+
+
+def copy_rows(
+    table: str,
+    columns: list,
+    from_: str,
+    key: list,
+    batch_size: int = None,
+    pause: float = None,
+):
+    """``INSERT INTO table SELECT columns FROM from_``, `batch_size` rows at
+    a time in `key` order, committing each batch and sleeping `pause`
+    seconds between them. Each of `columns` is a source expression such as
+    ``s.user_id`` that ends in the name of the `table` column it fills, and
+    `key` is a unique key of the source made of some of them.
+
+    Source rows are locked while their batch is copied, so a row deleted
+    meanwhile is either copied first or not at all. Rows already in `table`
+    are skipped: a copy that was interrupted only redoes the reads when the
+    migration runs again. Returns the rows read."""
+    batch_size = batch_size or settings.migration_batch_size
+    pause = settings.migration_batch_pause_seconds if pause is None else pause
+    names = ", ".join(column.rsplit(".", 1)[-1] for column in columns)
+    key_names = ", ".join(column.rsplit(".", 1)[-1] for column in key)
+    last_first = ", ".join(f"{column.rsplit('.', 1)[-1]} DESC" for column in key)
+    after_key = ", ".join(f":after_{i}" for i in range(len(key)))
+
+    def next_batch(after):
+        pending = "" if after is None else f"WHERE ({', '.join(key)}) > ({after_key})"
+        return text(
+            f"WITH batch AS ("
+            f"SELECT {', '.join(columns)} FROM {from_} {pending} "
+            f"ORDER BY {', '.join(key)} LIMIT :batch_size FOR SHARE), "
+            f"copied AS (INSERT INTO {table} ({names}) SELECT {names} FROM batch "
+            f"ON CONFLICT DO NOTHING) "
+            f"SELECT {key_names}, (SELECT count(*) FROM batch) FROM batch "
+            f"ORDER BY {last_first} LIMIT 1"
+        )
+
+    after, total = None, 0
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            params = {f"after_{i}": value for i, value in enumerate(after or ())}
+            last = bind.execute(
+                next_batch(after), {**params, "batch_size": batch_size}
+            ).first()
+            if last is None:
+                return total
+            *after, count = last
+            total += count
+            log.info("Copied %d rows into %s, up to %s", total, table, tuple(after))
+            time.sleep(pause)
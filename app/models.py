@@ -1,11 +1,30 @@
 from .database import Base
-from sqlalchemy import Text, Enum, Column, ForeignKey, Integer, String, Index
-from sqlalchemy.types import ARRAY
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Text,
+    Enum,
+    Column,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Integer,
+    String,
+    Index,
+    collate,
+    event,
+    func,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.schema import UniqueConstraint
 
+# `notes` and `shared_notes` are hash-partitioned by the note's owner into
+# this many partitions, `notes_p0`... Changing it needs a migration that
+# repartitions both tables.
+NOTE_PARTITIONS = 16
+
 
 class User(Base):
     __tablename__ = "users"
@@ -13,12 +32,38 @@ class User(Base):
     username = Column(String, unique=True, nullable=False)
     email = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=False)
+    # Set when the account is deleted; `app.purge` removes the rows later.
+    deleted_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # The shard holding the user's notes, see `app.database.ShardRouter`
+    shard = Column(Integer, nullable=False, server_default=text("0"))
     notes = relationship("Note", back_populates="owner")
 
+    # Prefix search for the user directory. The C collation lets one index
+    # serve both `LIKE 'prefix%'` and the ORDER BY, so a lookup stops after
+    # `limit` index entries however common the prefix is.
+    __table_args__ = (
+        Index("ix_users_username_prefix", collate(func.lower(username), "C")),
+        Index("ix_users_email_prefix", collate(func.lower(email), "C")),
+        Index(
+            "ix_users_deleted_at",
+            deleted_at,
+            postgresql_where=deleted_at.isnot(None),
+        ),
+    )
+
 
 class Note(Base):
+    """A note, stored in the partition of its owner.
+
+    Every query that knows the owner should filter on `owner_id` so that
+    PostgreSQL reads one partition instead of all of them. The primary key
+    includes `owner_id` because a partitioned table can only enforce unique
+    keys that contain the partition key; `id` alone still comes from one
+    sequence and stays unique.
+    """
+
     __tablename__ = "notes"
-    id = Column(Integer, primary_key=True, nullable=False)
+    id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
     title = Column(String, nullable=False, index=True)
     detail = Column(Text, nullable=False)
     created_at = Column(
@@ -27,11 +72,31 @@ class Note(Base):
         server_default=text("now()"),
         index=True,
     )
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True, nullable=False)
+    tags = Column(ARRAY(String), nullable=False, server_default=text("'{}'"))
+    # Set when the note is deleted; `app.purge` removes it and its shares
+    # later in bounded batches.
+    deleted_at = Column(TIMESTAMP(timezone=True), nullable=True)
     owner = relationship("User", back_populates="notes")
 
+    __table_args__ = (
+        # Serves an owner's note list and feed, newest first
+        Index("ix_notes_owner_id_created_at_id", owner_id, created_at, id),
+        # Serves `tags && :tags` (any) and `tags @> :tags` (all)
+        Index("ix_notes_tags", tags, postgresql_using="gin"),
+        Index(
+            "ix_notes_deleted_at",
+            deleted_at,
+            postgresql_where=deleted_at.isnot(None),
+        ),
+        {"postgresql_partition_by": "HASH (owner_id)"},
+    )
+
 
 class SharedNotes(Base):
+    """A note shared with `user_id`, stored next to the note in the
+    partition of the note's owner, `owner_id`."""
+
     __tablename__ = "shared_notes"
     user_id = Column(
         Integer,
@@ -39,24 +104,254 @@ class SharedNotes(Base):
         primary_key=True,
         nullable=False,
     )
-    note_id = Column(
-        Integer,
-        ForeignKey(
-            "notes.id",
-            ondelete="CASCADE",
+    note_id = Column(Integer, primary_key=True, nullable=False, index=True)
+    owner_id = Column(Integer, primary_key=True, nullable=False)
+    permission = Column(
+        Enum("edit", "read_only", name="permissions"),
+        nullable=False,
+        default="read_only",
+        index=True,
+    )
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+        index=True,
+    )
+    # The note's `created_at`, copied from it on insert by a trigger (see
+    # `create_share_trigger`), so a recipient's shares can be read in the
+    # notes' order
+    note_created_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            [note_id, owner_id], ["notes.id", "notes.owner_id"], ondelete="CASCADE"
         ),
+        # Serves the feed's shared notes, newest first
+        Index(
+            "ix_shared_notes_user_id_note_created_at",
+            user_id,
+            note_created_at,
+            note_id,
+        ),
+        {"postgresql_partition_by": "HASH (owner_id)"},
+    )
+
+
+def create_partitions(table, connection, **kw):
+    for remainder in range(NOTE_PARTITIONS):
+        connection.execute(
+            text(
+                f"CREATE TABLE {table.name}_p{remainder} PARTITION OF {table.name} "
+                f"FOR VALUES WITH (MODULUS {NOTE_PARTITIONS}, REMAINDER {remainder})"
+            )
+        )
+
+
+def create_share_trigger(table, connection, **kw):
+    connection.execute(
+        text(
+            """
+            CREATE OR REPLACE FUNCTION shared_notes_note_created_at()
+            RETURNS trigger AS $$
+            BEGIN
+                IF NEW.note_created_at IS NULL THEN
+                    SELECT created_at INTO NEW.note_created_at FROM notes
+                    WHERE id = NEW.note_id AND owner_id = NEW.owner_id;
+                END IF;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+    )
+    connection.execute(
+        text(
+            "CREATE TRIGGER note_created_at BEFORE INSERT ON shared_notes "
+            "FOR EACH ROW EXECUTE FUNCTION shared_notes_note_created_at()"
+        )
+    )
+
+
+event.listen(Note.__table__, "after_create", create_partitions)
+event.listen(SharedNotes.__table__, "after_create", create_partitions)
+event.listen(SharedNotes.__table__, "after_create", create_share_trigger)
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    # sha256 of the opaque token handed to the client; the token itself is
+    # never stored.
+    token_hash = Column(String(64), primary_key=True, nullable=False)
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    # Every token issued by rotating the same login shares a family, so a
+    # replayed token can revoke all of them at once.
+    family_id = Column(String(32), nullable=False, index=True)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    rotated_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    revoked = Column(Boolean, nullable=False, server_default=text("false"))
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+    )
+
+
+class NoteStats(Base):
+    """Per-user note counters, kept in step with notes and shared_notes by
+    the write paths in `app.stats` so reading them never counts rows."""
+
+    __tablename__ = "note_stats"
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
         primary_key=True,
         nullable=False,
     )
-    permission = Column(
-        Enum("edit", "read_only", name="permissions"),
+    owned_notes = Column(Integer, nullable=False, server_default=text("0"))
+    shared_with_me = Column(Integer, nullable=False, server_default=text("0"))
+    updated_at = Column(
+        TIMESTAMP(timezone=True),
         nullable=False,
-        default="read_only",
+        server_default=text("now()"),
+    )
+
+
+class NoteRevision(Base):
+    """One saved version of a note.
+
+    Every `revision_snapshot_interval`-th revision stores the full `detail`;
+    the ones in between store only a line `delta` against the previous
+    revision (see `app.revisions`).
+    """
+
+    __tablename__ = "note_revisions"
+    # No foreign key: `notes` is partitioned, so `id` alone is not a key
+    # PostgreSQL can enforce. `app.purge` deletes revisions before the note.
+    note_id = Column(Integer, primary_key=True, nullable=False)
+    revision = Column(Integer, primary_key=True, nullable=False)
+    title = Column(String, nullable=False)
+    tags = Column(ARRAY(String), nullable=False, server_default=text("'{}'"))
+    detail = Column(Text, nullable=True)
+    delta = Column(JSONB, nullable=True)
+    editor_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="SET NULL"),
+        nullable=True,
         index=True,
     )
     created_at = Column(
         TIMESTAMP(timezone=True),
         nullable=False,
         server_default=text("now()"),
+    )
+
+
+class Blob(Base):
+    """The content of an uploaded file, stored once under its sha256 however
+    many attachments use it (see `app.attachments`)."""
+
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    # Set when an attachment using it is removed; `app.purge` then deletes
+    # the blob and its file unless another attachment still uses it.
+    released_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_blobs_released_at",
+            released_at,
+            postgresql_where=released_at.isnot(None),
+        ),
+    )
+
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+    id = Column(Integer, primary_key=True, nullable=False)
+    # Not a foreign key, see `NoteRevision.note_id`
+    note_id = Column(Integer, nullable=False, index=True)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    uploader_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="SET NULL"),
+        nullable=True,
         index=True,
     )
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+    )
+
+
+class TagCount(Base):
+    """How many of a user's notes carry each tag, kept in step by the note
+    endpoints through `app.stats`."""
+
+    __tablename__ = "tag_counts"
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    tag = Column(String, primary_key=True, nullable=False)
+    count = Column(Integer, nullable=False, server_default=text("0"))
+
+
+class Job(Base):
+    """A unit of background work, run by `python -m app.worker`."""
+
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, nullable=False)
+    type = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    status = Column(
+        Enum("queued", "running", "succeeded", "failed", name="job_status"),
+        nullable=False,
+        server_default=text("'queued'"),
+    )
+    # Who enqueued it; only they can see it through /api/jobs
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True
+    )
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    max_attempts = Column(Integer, nullable=False, server_default=text("5"))
+    # Earliest time the job may (re)start; pushed back after each failure
+    run_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+    locked_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # While running: renewed by the worker; once past, the job is requeued
+    lease_until = Column(TIMESTAMP(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    result = Column(JSONB, nullable=True)
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+    )
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index(
+            "ix_jobs_queued_run_at",
+            run_at,
+            postgresql_where=status == "queued",
+        ),
+    )
@@ -0,0 +1,279 @@
+"""CPU and memory profiling of a running worker, for admins.
+
+Off unless ``PROFILING_ENABLED`` is set: then `install` adds the
+middleware and the threadpool hook below, and `app.routers.profiling` the
+endpoints. Otherwise none of it is in the request path.
+
+CPU: once a sample rate is set, that share of requests runs under
+`cProfile`, and the results are added up per route. A profile covers the
+request's own coroutine, and is paused while it waits, so the requests it
+is interleaved with on the event loop are left out. Sync dependencies and
+endpoints run in threadpool threads; FastAPI's `run_in_threadpool` is
+wrapped to profile those calls of a sampled request in their thread, with
+a profile of their own. The results export as a pstats file, for
+``snakeviz``, ``gprof2dot`` or ``flameprof``, or as collapsed stacks, for
+``flamegraph.pl`` and speedscope. cProfile records callers, not whole
+stacks, so each function's time is split over the stacks leading to it in
+proportion to the calls along each.
+
+Memory: snapshots of `tracemalloc` are taken on demand and compared by
+line. Tracing starts with the first snapshot, slows every allocation
+down, and stops when the snapshots are dropped.
+
+Profiles and snapshots are kept in the worker that took them.
+"""
+import cProfile
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+
+import fastapi.concurrency
+import fastapi.dependencies.utils
+import fastapi.routing
+from starlette.concurrency import run_in_threadpool as starlette_run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import settings
+from app.utils import matching_route
+
+# Modules of FastAPI that run sync dependencies and endpoints in threads
+THREADPOOL_CALLERS = [fastapi.concurrency, fastapi.dependencies.utils, fastapi.routing]
+
+# Stacks with less than this share of the time are left out of the
+# collapsed stacks, which would otherwise grow with every path through the
+# call graph
+MIN_STACK_SHARE = 1e-4
+
+
+class RequestProfile:
+    """The profiles of one sampled request: one for its coroutine, and one
+    for each call it ran in a thread."""
+
+    def __init__(self) -> None:
+        self.profiles = [cProfile.Profile()]
+
+    def thread_profile(self):
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        return profile
+
+
+# The profile of the request being handled, seen by its threadpool calls
+current = ContextVar("current_profile", default=None)
+
+
+class Stepped:
+    """Await `coro` with `profile` enabled only while `coro` runs."""
+
+    def __init__(self, coro, profile: cProfile.Profile) -> None:
+        self.coro = coro
+        self.profile = profile
+
+    def __await__(self):
+        step, value = self.coro.send, None
+        while True:
+            self.profile.enable()
+            try:
+                future = step(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.profile.disable()
+            try:
+                value = yield future
+                step = self.coro.send
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                step, value = self.coro.throw, e
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    request = current.get()
+    if request is None:
+        return await starlette_run_in_threadpool(func, *args, **kwargs)
+    profile = request.thread_profile()
+
+    def profiled():
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    return await starlette_run_in_threadpool(profiled)
+
+
+class RouteProfile:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.seconds = 0.0
+        self.stats = None
+
+
+class Profiler:
+    def __init__(self, sample_rate: float = 0.0, max_snapshots: int = 10) -> None:
+        self.max_snapshots = max_snapshots
+        self.lock = threading.Lock()
+        self.sample_rate = sample_rate
+        self.routes = {}
+        self.snapshots = OrderedDict()
+        self.next_snapshot = 1
+
+    def clear(self):
+        self.routes = {}
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(self, route: str, request: RequestProfile, seconds: float):
+        entry = self.routes.get(route)
+        if entry is None:
+            entry = self.routes[route] = RouteProfile()
+        entry.requests += 1
+        entry.seconds += seconds
+        if entry.stats is None:
+            entry.stats = pstats.Stats(*request.profiles)
+        else:
+            entry.stats.add(*request.profiles)
+
+    def stats(self, route: str = None):
+        """The profile of `route`, or of every route, or None."""
+        profiles = [
+            entry.stats
+            for name, entry in self.routes.items()
+            if route is None or name == route
+        ]
+        if not profiles:
+            return None
+        merged = pstats.Stats()
+        merged.add(*profiles)
+        return merged
+
+    def take_snapshot(self):
+        """Returns the new snapshot's id, and the bytes traced."""
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            id = self.next_snapshot
+            self.next_snapshot += 1
+            self.snapshots[id] = snapshot
+            while len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False)
+            return id, tracemalloc.get_traced_memory()[0]
+
+    def compare(self, first: int, second: int, limit: int):
+        """The lines whose allocations grew the most from snapshot `first`
+        to snapshot `second`, or None if either is gone."""
+        with self.lock:
+            old, new = self.snapshots.get(first), self.snapshots.get(second)
+        if old is None or new is None:
+            return None
+        return new.compare_to(old, "lineno")[:limit]
+
+    def drop_snapshots(self):
+        with self.lock:
+            self.snapshots.clear()
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+profiler = Profiler(settings.profile_sample_rate, settings.profile_max_snapshots)
+
+
+def route_name(scope: Scope):
+    route = matching_route(scope)
+    return f"{scope['method']} {getattr(route, 'path', '(no route)')}"
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp, profiler: Profiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.profiler.sampled():
+            return await self.app(scope, receive, send)
+        request = RequestProfile()
+        token = current.set(request)
+        started = time.perf_counter()
+        try:
+            await Stepped(self.app(scope, receive, send), request.profiles[0])
+        finally:
+            current.reset(token)
+            self.profiler.record(
+                route_name(scope), request, time.perf_counter() - started
+            )
+
+
+def install(app):
+    """Profile the requests of `app`. Call before it serves."""
+    for module in THREADPOOL_CALLERS:
+        module.run_in_threadpool = run_in_threadpool
+    # Innermost, so it runs in the same task as the endpoint rather than
+    # around the tasks BaseHTTPMiddleware starts
+    app.user_middleware.append(Middleware(ProfilingMiddleware, profiler=profiler))
+
+
+def label(func):
+    filename, line, name = func
+    if filename == "~":  # built-in
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapsed_stacks(stats: pstats.Stats):
+    """`stats` as lines of ``caller;callee;... microseconds``, the input of
+    flamegraph.pl and speedscope."""
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller].append((func, cumulative))
+    roots = [func for func, entry in stats.stats.items() if not entry[4]]
+    min_seconds = MIN_STACK_SHARE * sum(stats.stats[root][3] for root in roots)
+    totals = defaultdict(float)
+
+    def visit(func, stack, on_stack, share):
+        totals[stack] += stats.stats[func][2] * share
+        for callee, seconds in callees[func]:
+            callee_cumulative = stats.stats[callee][3]
+            if (
+                callee in on_stack
+                or not callee_cumulative
+                or seconds * share < min_seconds
+            ):
+                continue
+            visit(
+                callee,
+                f"{stack};{label(callee)}",
+                on_stack | {callee},
+                seconds * share / callee_cumulative,
+            )
+
+    for root in roots:
+        visit(root, label(root), {root}, 1.0)
+    return "".join(
+        f"{stack} {round(seconds * 1e6)}\n"
+        for stack, seconds in totals.items()
+        if round(seconds * 1e6) > 0
+    )
+
+
+def dump_stats(stats: pstats.Stats):
+    """`stats` in the file format of `pstats.Stats.dump_stats`."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "profile.pstats")
+        stats.dump_stats(path)
+        with open(path, "rb") as file:
+            return file.read()
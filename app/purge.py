@@ -0,0 +1,202 @@
+"""Background removal of soft-deleted notes and users.
+
+Deleting a note or an account only sets `deleted_at`, which hides it from
+every endpoint. This worker then deletes the rows behind it (shares,
+attachments, revisions, notes, the user) a batch at a time, each batch in
+its own short transaction with a pause in between, so a note shared with
+thousands of users never holds locks for long:
+
+    python -m app.purge            # run forever
+    python -m app.purge --drain    # exit once nothing is left to purge
+
+It also deletes released attachment blobs, and their files, once no
+attachment uses them, and the refresh tokens of login families that can no
+longer be refreshed.
+
+Several workers can run side by side; each claims its note or user with
+`FOR UPDATE SKIP LOCKED`.
+"""
+import argparse
+import time
+
+from sqlalchemy import delete, exists, func, or_, select, update
+from sqlalchemy.orm import Session, aliased
+
+from app import attachments, stats
+from app.config import settings
+from app.models import (
+    Attachment,
+    Blob,
+    Note,
+    NoteRevision,
+    RefreshToken,
+    SharedNotes,
+    User,
+)
+
+
+def purge_note_batch(db: Session, note_id: int, owner_id: int, batch_size: int):
+    """Delete up to `batch_size` shares, attachments or revisions of a
+    deleted note, or the note itself once none are left. Returns the number
+    of rows deleted."""
+    shares = (SharedNotes.note_id == note_id, SharedNotes.owner_id == owner_id)
+    batch = select(SharedNotes.user_id).where(*shares).limit(batch_size)
+    recipients = db.scalars(
+        delete(SharedNotes)
+        .where(*shares, SharedNotes.user_id.in_(batch))
+        .returning(SharedNotes.user_id)
+    ).all()
+    if recipients:
+        stats.unshare_many(db, recipients)
+        return len(recipients)
+    files = select(Attachment.id).where(Attachment.note_id == note_id)
+    detached = db.scalars(
+        delete(Attachment)
+        .where(Attachment.id.in_(files.limit(batch_size)))
+        .returning(Attachment.sha256)
+    ).all()
+    if detached:
+        attachments.release(db, detached)
+        return len(detached)
+    history = (
+        select(NoteRevision.revision)
+        .where(NoteRevision.note_id == note_id)
+        .limit(batch_size)
+    )
+    removed = db.execute(
+        delete(NoteRevision).where(
+            NoteRevision.note_id == note_id, NoteRevision.revision.in_(history)
+        )
+    ).rowcount
+    if removed:
+        return removed
+    return db.execute(
+        delete(Note).where(Note.id == note_id, Note.owner_id == owner_id)
+    ).rowcount
+
+
+def purge_user_batch(db: Session, user_id: int, batch_size: int):
+    """One step of removing a deleted user: hide their notes (which are then
+    purged like any deleted note), drop the shares they received, and
+    finally delete the user row. Returns the number of rows touched."""
+    live_notes = (
+        select(Note.id)
+        .where(Note.owner_id == user_id, Note.deleted_at.is_(None))
+        .limit(batch_size)
+    )
+    hidden = db.execute(
+        update(Note)
+        .where(Note.owner_id == user_id, Note.id.in_(live_notes))
+        .values(deleted_at=func.now())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if hidden:
+        return hidden
+    if db.scalar(select(exists().where(Note.owner_id == user_id))):
+        # Another worker is still purging this user's notes
+        return 0
+
+    received = select(SharedNotes.note_id).where(SharedNotes.user_id == user_id)
+    unshared = db.execute(
+        delete(SharedNotes).where(
+            SharedNotes.user_id == user_id,
+            SharedNotes.note_id.in_(received.limit(batch_size)),
+        )
+    ).rowcount
+    if unshared:
+        return unshared
+    return db.execute(delete(User).where(User.id == user_id)).rowcount
+
+
+def purge_refresh_tokens(db: Session, batch_size: int):
+    """Delete up to `batch_size` refresh tokens of families without a usable
+    token, all revoked or expired. A family still in use keeps its rotated
+    tokens, since replaying one of them is how a leak is noticed. Returns
+    the number of rows deleted."""
+    live = aliased(RefreshToken)
+    dead = (
+        select(RefreshToken.token_hash)
+        .where(
+            or_(RefreshToken.revoked, RefreshToken.expires_at <= func.now()),
+            ~exists().where(
+                live.family_id == RefreshToken.family_id,
+                live.rotated_at.is_(None),
+                live.revoked.is_(False),
+                live.expires_at > func.now(),
+            ),
+        )
+        .limit(batch_size)
+    )
+    return db.execute(
+        delete(RefreshToken).where(RefreshToken.token_hash.in_(dead))
+    ).rowcount
+
+
+def purge_batch(db: Session, batch_size: int = None):
+    """Do one bounded unit of purge work and commit it.
+
+    Returns the number of rows touched; 0 means there was nothing to do.
+    """
+    batch_size = batch_size or settings.purge_batch_size
+    note = db.execute(
+        select(Note.id, Note.owner_id)
+        .where(Note.deleted_at.isnot(None))
+        .order_by(Note.deleted_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if note is not None:
+        touched = purge_note_batch(db, note.id, note.owner_id, batch_size)
+    else:
+        user_id = db.scalar(
+            select(User.id)
+            .where(User.deleted_at.isnot(None))
+            .order_by(User.deleted_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        if user_id is not None:
+            touched = purge_user_batch(db, user_id, batch_size)
+        else:
+            sha256 = db.scalar(
+                select(Blob.sha256)
+                .where(Blob.released_at.isnot(None))
+                .order_by(Blob.released_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            if sha256 is not None:
+                touched = attachments.purge_blob(db, sha256)
+            else:
+                touched = purge_refresh_tokens(db, batch_size)
+    db.commit()
+    return touched
+
+
+def run(drain: bool = False):
+    from app.database import shard_router
+
+    while True:
+        touched = 0
+        for session_factory in shard_router.session_factories:
+            with session_factory() as db:
+                touched += purge_batch(db)
+        if touched:
+            # Throttle so purging never saturates the primary
+            time.sleep(settings.purge_batch_pause_seconds)
+        elif drain:
+            return
+        else:
+            time.sleep(settings.purge_poll_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge soft-deleted rows.")
+    parser.add_argument(
+        "--drain", action="store_true", help="exit when nothing is left to purge"
+    )
+    run(drain=parser.parse_args().drain)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""Hot-path statements, built as lambda statements.
+
+SQLAlchemy caches a lambda statement by the code location of the lambda, so
+the expression tree is constructed and compiled once per process and later
+calls only bind new parameter values. Closure variables become bound
+parameters, which lets psycopg prepare the statement server-side as well.
+
+Soft-deleted notes and users (`deleted_at` set) are filtered out here, so
+they disappear from every endpoint as soon as they are deleted.
+
+`notes` and `shared_notes` are partitioned by the note's owner, so every
+note statement takes the owner as well as the note id; PostgreSQL then
+reads one partition. A caller who only has a note id finds its owner with
+`note_owner` first.
+"""
+from sqlalchemy import (
+    Float,
+    String,
+    case,
+    cast,
+    collate,
+    desc,
+    func,
+    lambda_stmt,
+    literal,
+    or_,
+    select,
+    tuple_,
+    union_all,
+)
+from sqlalchemy.orm import aliased, contains_eager, defer
+
+from app.models import Note, SharedNotes, User
+
+
+def user_by_id(user_id: int):
+    return lambda_stmt(
+        lambda: select(User).where(User.id == user_id, User.deleted_at.is_(None))
+    )
+
+
+def users_with_username_prefix(pattern: str, limit: int):
+    """`pattern` is a lower-cased, LIKE-escaped prefix followed by `%`."""
+    return lambda_stmt(
+        lambda: select(User)
+        .where(
+            collate(func.lower(User.username), "C").like(pattern, escape="\\"),
+            User.deleted_at.is_(None),
+        )
+        .order_by(collate(func.lower(User.username), "C"))
+        .limit(limit)
+    )
+
+
+def users_with_email_prefix(pattern: str, limit: int):
+    return lambda_stmt(
+        lambda: select(User)
+        .where(
+            collate(func.lower(User.email), "C").like(pattern, escape="\\"),
+            User.deleted_at.is_(None),
+        )
+        .order_by(collate(func.lower(User.email), "C"))
+        .limit(limit)
+    )
+
+
+def owned_note(note_id: int, owner_id: int):
+    return lambda_stmt(
+        lambda: select(Note).where(
+            Note.id == note_id, Note.owner_id == owner_id, Note.deleted_at.is_(None)
+        )
+    )
+
+
+def note_owner(note_id: int, user_id: int):
+    """The owner of note `note_id` if `user_id` owns it or it is shared with
+    them, else no row.
+
+    The recipient is not the partition key, so the share lookup is a
+    primary key probe in each `shared_notes` partition.
+    """
+    return lambda_stmt(
+        lambda: union_all(
+            select(Note.owner_id).where(Note.id == note_id, Note.owner_id == user_id),
+            select(SharedNotes.owner_id).where(
+                SharedNotes.note_id == note_id, SharedNotes.user_id == user_id
+            ),
+        ).limit(1)
+    )
+
+
+def note_with_owner(note_id: int, owner_id: int):
+    """The note with its owner loaded, unless either is deleted."""
+    return lambda_stmt(
+        lambda: select(Note)
+        .join(Note.owner)
+        .options(contains_eager(Note.owner))
+        .where(
+            Note.id == note_id,
+            Note.owner_id == owner_id,
+            Note.deleted_at.is_(None),
+            User.deleted_at.is_(None),
+        )
+    )
+
+
+def note_for_update(note_id: int, owner_id: int):
+    """The note, locked until commit so concurrent saves are serialized."""
+    return lambda_stmt(
+        lambda: select(Note)
+        .where(Note.id == note_id, Note.owner_id == owner_id, Note.deleted_at.is_(None))
+        .with_for_update()
+    )
+
+
+def share(note_id: int, owner_id: int, user_id: int):
+    return lambda_stmt(
+        lambda: select(SharedNotes).where(
+            SharedNotes.note_id == note_id,
+            SharedNotes.owner_id == owner_id,
+            SharedNotes.user_id == user_id,
+        )
+    )
+
+
+def participants(note_id: int, owner_id: int):
+    return lambda_stmt(
+        lambda: select(User, SharedNotes.permission)
+        .join(SharedNotes, SharedNotes.user_id == User.id)
+        .where(
+            SharedNotes.note_id == note_id,
+            SharedNotes.owner_id == owner_id,
+            User.deleted_at.is_(None),
+        )
+    )
+
+
+def recipients(note_id: int, owner_id: int):
+    """Ids of the users a note is shared with."""
+    return lambda_stmt(
+        lambda: select(SharedNotes.user_id).where(
+            SharedNotes.note_id == note_id, SharedNotes.owner_id == owner_id
+        )
+    )
+
+
+def owned_notes(owner_id: int, limit: int, skip: int):
+    return lambda_stmt(
+        lambda: select(Note)
+        .where(Note.owner_id == owner_id, Note.deleted_at.is_(None))
+        .order_by(desc(Note.created_at))
+        .limit(limit)
+        .offset(skip)
+    )
+
+
+def owned_notes_with_any_tag(owner_id: int, tags: list, limit: int, skip: int):
+    return lambda_stmt(
+        lambda: select(Note)
+        .where(
+            Note.owner_id == owner_id,
+            Note.deleted_at.is_(None),
+            Note.tags.overlap(tags),
+        )
+        .order_by(desc(Note.created_at))
+        .limit(limit)
+        .offset(skip)
+    )
+
+
+def owned_notes_with_all_tags(owner_id: int, tags: list, limit: int, skip: int):
+    return lambda_stmt(
+        lambda: select(Note)
+        .where(
+            Note.owner_id == owner_id,
+            Note.deleted_at.is_(None),
+            Note.tags.contains(tags),
+        )
+        .order_by(desc(Note.created_at))
+        .limit(limit)
+        .offset(skip)
+    )
+
+
+def occurrences(text, needle):
+    """How many times lower-cased `needle` occurs in `text`, NULL if empty."""
+    lowered = func.lower(text)
+    return (
+        func.length(lowered) - func.length(func.replace(lowered, needle, ""))
+    ) / func.nullif(func.length(needle), 0)
+
+
+def saturate(count):
+    """`count / (count + 2)`: 0 for no matches, approaching 1 for many."""
+    return func.coalesce(1.0 - 2.0 / (count + 2), 0.0)
+
+
+def search_owned_notes(
+    owner_id: int, needle: str, pattern: str, scan_chars: int, limit: int, skip: int
+):
+    """Notes whose title or detail contains `needle`, best match first.
+
+    `needle` is the lower-cased query and `pattern` the LIKE-escaped query
+    between `%`s. Each row is `(note, score, head)`: the score is 1 for a
+    title match plus a term frequency, saturating below 1, over `head`, the
+    first `scan_chars` characters of `detail`. `detail` itself is not loaded.
+    """
+    return lambda_stmt(
+        lambda: select(
+            Note,
+            cast(
+                case((Note.title.ilike(pattern, escape="\\"), 1.0), else_=0.0)
+                + saturate(occurrences(func.left(Note.detail, scan_chars), needle)),
+                Float,
+            ).label("score"),
+            func.left(Note.detail, scan_chars).label("head"),
+        )
+        .where(
+            Note.owner_id == owner_id,
+            Note.deleted_at.is_(None),
+            or_(
+                Note.title.ilike(pattern, escape="\\"),
+                Note.detail.ilike(pattern, escape="\\"),
+            ),
+        )
+        .options(defer(Note.detail))
+        .order_by(desc("score"), desc(Note.created_at), desc(Note.id))
+        .limit(limit)
+        .offset(skip)
+    )
+
+
+def shared_notes(user_id: int, limit: int, skip: int):
+    """Notes shared with `user_id`, newest first. Their shares are read from
+    every partition; each note is then read from its owner's."""
+    return lambda_stmt(
+        lambda: select(Note)
+        .join(
+            SharedNotes,
+            (SharedNotes.note_id == Note.id) & (SharedNotes.owner_id == Note.owner_id),
+        )
+        .join(User, User.id == Note.owner_id)
+        .where(
+            SharedNotes.user_id == user_id,
+            Note.deleted_at.is_(None),
+            User.deleted_at.is_(None),
+        )
+        .order_by(desc(Note.created_at))
+        .limit(limit)
+        .offset(skip)
+    )
+
+
+def newest_before(stmt, created_at, id, before, before_id: int, limit: int):
+    """The first `limit` rows of `stmt` that come after `(before, before_id)`
+    in newest-first `(created_at, id)` order."""
+    return (
+        stmt.where(tuple_(created_at, id) < tuple_(before, before_id))
+        .order_by(desc(created_at), desc(id))
+        .limit(limit)
+    )
+
+
+def merge_newest(page, limit: int):
+    """The first `limit` `(note, permission)` rows of the union `page`."""
+    note = aliased(Note, page)
+    return (
+        select(note, page.c.permission)
+        .order_by(desc(page.c.created_at), desc(page.c.id))
+        .limit(limit)
+    )
+
+
+def feed(user_id: int, before, before_id: int, limit: int):
+    """Notes `user_id` owns or that are shared with them, newest first from
+    the keyset `(before, before_id)`, each with the caller's permission:
+    "owner", or the share's.
+
+    Both sides are read in index order and stop at `limit` rows: owned notes
+    from `ix_notes_owner_id_created_at_id`, shares from each partition's
+    `ix_shared_notes_user_id_note_created_at`. A page therefore costs the
+    same however many notes the user has.
+    """
+    return lambda_stmt(
+        lambda: merge_newest(
+            union_all(
+                newest_before(
+                    select(Note, literal("owner", String()).label("permission")).where(
+                        Note.owner_id == user_id, Note.deleted_at.is_(None)
+                    ),
+                    Note.created_at,
+                    Note.id,
+                    before,
+                    before_id,
+                    limit,
+                ),
+                newest_before(
+                    select(
+                        Note, cast(SharedNotes.permission, String).label("permission")
+                    )
+                    .select_from(SharedNotes)
+                    .join(
+                        Note,
+                        (Note.id == SharedNotes.note_id)
+                        & (Note.owner_id == SharedNotes.owner_id),
+                    )
+                    .join(User, User.id == Note.owner_id)
+                    .where(
+                        SharedNotes.user_id == user_id,
+                        Note.deleted_at.is_(None),
+                        User.deleted_at.is_(None),
+                    ),
+                    SharedNotes.note_created_at,
+                    SharedNotes.note_id,
+                    before,
+                    before_id,
+                    limit,
+                ),
+            ).subquery(),
+            limit,
+        )
+    )
@@ -0,0 +1,140 @@
+"""Note revision history.
+
+Each save of a note appends a revision. Most revisions store only a delta
+against the one before: a list whose items are either ``[start, end]``,
+copying lines ``start:end`` of the previous `detail`, or a string of new
+text. Every `revision_snapshot_interval` revisions (or whenever the delta
+would not be smaller than the text) the full `detail` is stored instead, so
+rebuilding any revision replays at most that many deltas from the nearest
+snapshot at or before it.
+"""
+import difflib
+import json
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Note, NoteRevision
+
+
+def diff(old: str, new: str):
+    """The delta that turns `old` into `new`."""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    delta = []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append("".join(new_lines[j1:j2]))
+    return delta
+
+
+def patch(old: str, delta):
+    old_lines = old.splitlines(keepends=True)
+    return "".join(
+        op if isinstance(op, str) else "".join(old_lines[op[0] : op[1]]) for op in delta
+    )
+
+
+def record(db: Session, note: Note, changes: dict, editor_id: int):
+    """Append the revision `changes` makes to `note`, which must still hold
+    the previous version and be locked against concurrent saves."""
+    latest, latest_snapshot = db.execute(
+        select(
+            func.max(NoteRevision.revision),
+            func.max(NoteRevision.revision).filter(NoteRevision.detail.isnot(None)),
+        ).where(NoteRevision.note_id == note.id)
+    ).one()
+    if latest is None:
+        # Notes written before history existed start with their current state
+        db.add(
+            NoteRevision(
+                note_id=note.id,
+                revision=1,
+                title=note.title,
+                tags=note.tags,
+                detail=note.detail,
+                editor_id=note.owner_id,
+                created_at=note.created_at,
+            )
+        )
+        latest = latest_snapshot = 1
+
+    revision = NoteRevision(
+        note_id=note.id,
+        revision=latest + 1,
+        title=changes["title"],
+        tags=changes["tags"],
+        editor_id=editor_id,
+    )
+    detail = changes["detail"]
+    if revision.revision - latest_snapshot < settings.revision_snapshot_interval:
+        delta = diff(note.detail, detail)
+        if len(json.dumps(delta)) < len(detail):
+            revision.delta = delta
+    if revision.delta is None:
+        revision.detail = detail
+    db.add(revision)
+    db.flush()
+
+
+def initial(db: Session, note: Note):
+    """Record a newly created note as its first revision."""
+    db.add(
+        NoteRevision(
+            note_id=note.id,
+            revision=1,
+            title=note.title,
+            tags=note.tags,
+            detail=note.detail,
+            editor_id=note.owner_id,
+        )
+    )
+
+
+def rebuild(db: Session, note_id: int, revision: int = None, at: datetime = None):
+    """Rebuild a note as of `revision`, or as of the last revision saved at
+    or before `at`. Returns the revision with `detail` filled in, or None."""
+    if at is not None:
+        revision = db.scalar(
+            select(func.max(NoteRevision.revision)).where(
+                NoteRevision.note_id == note_id, NoteRevision.created_at <= at
+            )
+        )
+        if revision is None:
+            return None
+    snapshot = db.scalar(
+        select(func.max(NoteRevision.revision)).where(
+            NoteRevision.note_id == note_id,
+            NoteRevision.revision <= revision,
+            NoteRevision.detail.isnot(None),
+        )
+    )
+    if snapshot is None:
+        return None
+    chain = db.scalars(
+        select(NoteRevision)
+        .where(
+            NoteRevision.note_id == note_id,
+            NoteRevision.revision.between(snapshot, revision),
+        )
+        .order_by(NoteRevision.revision)
+    ).all()
+    if chain[-1].revision != revision:
+        return None
+    detail = chain[0].detail
+    for step in chain[1:]:
+        detail = step.detail if step.detail is not None else patch(detail, step.delta)
+    target = chain[-1]
+    return {
+        "revision": target.revision,
+        "title": target.title,
+        "detail": detail,
+        "tags": target.tags,
+        "editor_id": target.editor_id,
+        "created_at": target.created_at,
+    }
@@ -0,0 +1,115 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy import delete, select
+from sqlalchemy.orm.session import Session
+from typing import List
+
+from app import attachments, body_limit
+from app.database import ShardSessions, get_read_shards, get_shards
+from app.models import Attachment, User
+from app.oauth2 import get_current_user
+from app.routers.notes import editable_note, readable_note
+from app.schemas import AttachmentResponse
+
+router = APIRouter(prefix="/api/notes", tags=["Attachments"])
+
+
+@router.post(
+    "/{id}/attachments",
+    response_model=AttachmentResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+@body_limit.max_body_bytes(attachments.max_body_bytes)
+async def upload_attachment(
+    id: int,
+    request: Request,
+    shards: ShardSessions = Depends(get_shards),
+    current_user: User = Depends(get_current_user),
+):
+    editable_note(shards, id, current_user)
+    # Don't hold pooled connections for as long as the body takes to arrive
+    for db in shards.all():
+        db.commit()
+
+    upload = await attachments.receive(request)
+    db = None
+    try:
+        # Checked again: the note may have been deleted or unshared meanwhile
+        note = editable_note(shards, id, current_user)
+        db = shards.for_write(note.owner_id)
+        attachments.store(db, upload)
+        attachment = Attachment(
+            note_id=id,
+            sha256=upload.sha256,
+            filename=upload.filename,
+            content_type=upload.content_type,
+            size=upload.size,
+            uploader_id=current_user.id,
+        )
+        db.add(attachment)
+        db.commit()
+    except BaseException:
+        if db is not None:
+            db.rollback()
+        attachments.discard(upload)
+        raise
+    db.refresh(attachment)
+    return attachment
+
+
+@router.get("/{id}/attachments", response_model=List[AttachmentResponse])
+def list_attachments(
+    id: int,
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user: User = Depends(get_current_user),
+):
+    note = readable_note(shards, id, current_user)
+    return (
+        shards.of(note.owner_id)
+        .scalars(
+            select(Attachment).where(Attachment.note_id == id).order_by(Attachment.id)
+        )
+        .all()
+    )
+
+
+def note_attachment(db: Session, id: int, attachment_id: int):
+    attachment = db.scalars(
+        select(Attachment).where(
+            Attachment.id == attachment_id, Attachment.note_id == id
+        )
+    ).first()
+    if not attachment:
+        raise HTTPException(
+            detail=f"Attachment with id {attachment_id} does not exist",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return attachment
+
+
+@router.get("/{id}/attachments/{attachment_id}")
+def download_attachment(
+    id: int,
+    attachment_id: int,
+    request: Request,
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user: User = Depends(get_current_user),
+):
+    note = readable_note(shards, id, current_user)
+    db = shards.of(note.owner_id)
+    return attachments.download(request, note_attachment(db, id, attachment_id))
+
+
+@router.delete("/{id}/attachments/{attachment_id}")
+def delete_attachment(
+    id: int,
+    attachment_id: int,
+    shards: ShardSessions = Depends(get_shards),
+    current_user: User = Depends(get_current_user),
+):
+    note = editable_note(shards, id, current_user)
+    db = shards.for_write(note.owner_id)
+    attachment = note_attachment(db, id, attachment_id)
+    db.execute(delete(Attachment).where(Attachment.id == attachment.id))
+    attachments.release(db, [attachment.sha256])
+    db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -5,21 +5,43 @@ from sqlalchemy.exc import IntegrityError
 
 
 from app.schemas import UserBase, UserCreate, ResponseToken, UserResponse
-from app.models import User
+from app.models import User, RefreshToken
+from app import database, queries, shards
 from app.database import get_db
 from app.utils import hash_password, verify_password
-from app.oauth2 import create_access_token, create_refresh_token, verify_refresh_token
+from app.oauth2 import (
+    REFRESH_EXPIRE_MINUTES,
+    create_access_token,
+    create_refresh_token,
+    hash_refresh_token,
+    revoke_refresh_family,
+    rotate_refresh_token,
+)
 
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
 
+def set_refresh_cookie(response: Response, refresh_token: str):
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        max_age=REFRESH_EXPIRE_MINUTES * 60,
+        httponly=True,
+        samesite="none",
+        secure=True,
+        domain=None,
+    )  # set HttpOnly cookie in response
+
+
 @router.post("/signup", response_model=UserResponse)
 async def signup(user: UserCreate, db: Session = Depends(get_db)):
     user.password = hash_password(plain_password=user.password)
     try:
         new_user = User(**user.model_dump())
         db.add(new_user)
+        db.flush()
+        new_user.shard = shards.home_shard(database.shard_router, new_user.id)
         db.commit()
         db.refresh(new_user)
     except IntegrityError as e:
@@ -29,6 +51,19 @@ async def signup(user: UserCreate, db: Session = Depends(get_db)):
         )
     except Exception as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    if database.shard_router.sharded:
+        try:
+            shards.sync_users(database.shard_router, db, [new_user.id])
+        except Exception:
+            # Notes on a shard without a copy could not be shared with the
+            # account, so it is taken back rather than left half made
+            db.rollback()
+            shards.remove_user(database.shard_router, db, new_user.id)
+            raise HTTPException(
+                detail="The account could not be created, try again",
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "1"},
+            )
     return new_user
 
 
@@ -38,7 +73,11 @@ def login(
     user_cred: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db),
 ):
-    user = db.query(User).filter(User.username == user_cred.username).first()
+    user = (
+        db.query(User)
+        .filter(User.username == user_cred.username, User.deleted_at.is_(None))
+        .first()
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="invalid credentials"
@@ -50,18 +89,9 @@ def login(
     access_token = create_access_token(
         data={"user_id": user.id, "username": user.username}
     )
-    refresh_token = create_refresh_token(
-        data={"user_id": user.id, "username": user.username}
-    )
+    refresh_token = create_refresh_token(db, user_id=user.id)
 
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token,
-        httponly=True,
-        samesite="none",
-        secure=True,
-        domain=None,
-    )  # set HttpOnly cookie in response
+    set_refresh_cookie(response, refresh_token)
 
     return {
         "access_token": access_token,
@@ -69,18 +99,40 @@ def login(
     }
 
 
-@router.post("/refresh")
-def refresh_token(request: Request, response: Response):
+@router.post("/refresh", response_model=ResponseToken)
+def refresh_token(
+    request: Request, response: Response, db: Session = Depends(get_db)
+):
     refresh_token = request.cookies.get("refresh_token")
     if not refresh_token:
         raise HTTPException(status_code=400, detail="No refresh token found in cookies")
 
-    payload = verify_refresh_token(refresh_token)
-    if not payload:
+    rotated = rotate_refresh_token(db, refresh_token)
+    if not rotated:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+    user_id, refresh_token = rotated
+    user = db.scalars(queries.user_by_id(user_id)).first()
+    if user is None:
+        # The account was deleted after the token was issued
         raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
 
-    new_access_token = create_access_token(data=payload)
-    refresh_token = create_refresh_token(data={"user_id": payload})
+    new_access_token = create_access_token(
+        data={"user_id": user.id, "username": user.username}
+    )
 
-    response.set_cookie(key="refresh_token", value=refresh_token, httponly=True)
+    set_refresh_cookie(response, refresh_token)
     return {"access_token": new_access_token, "token_type": "bearer"}
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(request: Request, db: Session = Depends(get_db)):
+    refresh_token = request.cookies.get("refresh_token")
+    if refresh_token:
+        stored = db.get(RefreshToken, hash_refresh_token(refresh_token))
+        if stored is not None:
+            revoke_refresh_family(db, stored.family_id)
+    response = Response(status_code=status.HTTP_204_NO_CONTENT)
+    response.delete_cookie(
+        key="refresh_token", httponly=True, samesite="none", secure=True
+    )
+    return response
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+from app import database, health
+
+router = APIRouter(tags=["Health"])
+
+
+@router.get("/healthz")
+async def liveness():
+    # async: must answer even when every threadpool thread is stuck
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+def readiness():
+    ready, details = health.readiness(database.engine)
+    return JSONResponse(
+        content=details,
+        status_code=(
+            status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        ),
+    )
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import desc, select
+from sqlalchemy.orm.session import Session
+from typing import List
+
+from app.database import get_read_db
+from app.models import Job
+from app.oauth2 import get_current_user
+from app.schemas import JobResponse
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"])
+
+
+@router.get("", response_model=List[JobResponse])
+def list_jobs(
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    current_user=Depends(get_current_user),
+):
+    return db.scalars(
+        select(Job)
+        .where(Job.user_id == current_user.id)
+        .order_by(desc(Job.id))
+        .limit(limit)
+    ).all()
+
+
+@router.get("/{id}", response_model=JobResponse)
+def get_job(
+    id: int,
+    db: Session = Depends(get_read_db),
+    current_user=Depends(get_current_user),
+):
+    job = db.scalars(
+        select(Job).where(Job.id == id, Job.user_id == current_user.id)
+    ).first()
+    if not job:
+        raise HTTPException(
+            detail=f"Job with id {id} does not exist",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return job
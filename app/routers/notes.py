@@ -1,134 +1,366 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request, Query
+from sqlalchemy import desc, func, select, update
 from sqlalchemy.orm.session import Session
-from sqlalchemy import desc, or_
 from sqlalchemy.exc import IntegrityError
-from psycopg2.errors import UniqueViolation
+from pydantic import TypeAdapter
+import base64
+from datetime import datetime, timezone
 from typing import Optional, List
 
+from app import jobs, list_cache, queries, revisions, search, stats
+from app.config import settings
 from app.oauth2 import get_current_user
 
 
 from app.schemas import (
+    BulkShareNote,
+    FeedNote,
+    JobResponse,
     NoteResponse,
     NoteResponseWithParticipants,
+    NoteRevisionResponse,
+    NoteVersionResponse,
     NoteBase,
+    NoteFeedPage,
+    NoteSearchResult,
+    NoteStatsResponse,
     ShareNote,
     ShareNoteResponse,
+    TagCountResponse,
+    UserResponse,
+    normalize_tags,
 )
-from app.database import get_db
-from app.models import Note, User, SharedNotes
+from app.database import ShardSessions, get_read_shards, get_shards, is_replica
+from app.models import Note, NoteRevision, User, SharedNotes
+from app.utils import SingleFlight, TTLCache, escape_like
 
 router = APIRouter(prefix="/api/notes", tags=["Notes"])
 
+note_page = TypeAdapter(List[NoteResponse])
+
+
+def render_page(notes):
+    return note_page.dump_json(note_page.validate_python(notes, from_attributes=True))
+
+
+def page_response(body: bytes, hit: bool):
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"X-Cache": "HIT" if hit else "MISS"},
+    )
+
 
 @router.get("", response_model=List[NoteResponse])
-async def list_notes(
+def list_notes(
     limit: Optional[int] = 10,
     skip: Optional[int] = 0,
-    db: Session = Depends(get_db),
+    tags: Optional[str] = Query(None, description="Comma-separated tags"),
+    match: str = Query("any", pattern="^(any|all)$"),
+    shards: ShardSessions = Depends(get_read_shards),
     current_user=Depends(get_current_user),
 ):
-    notes = (
-        db.query(Note)
-        .filter(
-            Note.owner_id == current_user.id,
-        )
-        .order_by(desc(Note.created_at))
-        .limit(limit)
-        .offset(skip)
-        .all()
+    db = shards.of(current_user.id)
+    if tags:
+        try:
+            tags = normalize_tags(tags.split(","))
+        except ValueError as e:
+            raise HTTPException(
+                detail=str(e), status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+    if not tags:
+        stmt = queries.owned_notes(current_user.id, limit, skip)
+    elif match == "all":
+        stmt = queries.owned_notes_with_all_tags(current_user.id, tags, limit, skip)
+    else:
+        stmt = queries.owned_notes_with_any_tag(current_user.id, tags, limit, skip)
+    body, hit = list_cache.page(
+        "owned",
+        current_user.id,
+        (limit, skip, ",".join(tags or []), match),
+        lambda: render_page(db.scalars(stmt).all()),
+        # A lagging replica could cache old rows under the newest generation
+        store=not is_replica(db),
     )
 
-    return notes
+    return page_response(body, hit)
 
 
-@router.get("/search", response_model=List[NoteResponse])
-async def search_notes(
+@router.get("/search", response_model=List[NoteSearchResult])
+def search_notes(
     q: Optional[str] = "",
-    limit: Optional[int] = 10,
-    skip: Optional[int] = 0,
-    db: Session = Depends(get_db),
+    limit: int = Query(10, ge=1, le=settings.search_max_results),
+    skip: int = Query(0, ge=0),
+    shards: ShardSessions = Depends(get_read_shards),
     current_user=Depends(get_current_user),
 ):
-    notes = (
-        db.query(Note)
-        .filter(
-            Note.owner_id == current_user.id,
-            or_(
-                Note.title.ilike(f"%{q}%"),
-                Note.detail.ilike(f"%{q}%"),
-            ),
+    rows = (
+        shards.of(current_user.id)
+        .execute(
+            queries.search_owned_notes(
+                current_user.id,
+                q.lower(),
+                f"%{escape_like(q)}%",
+                settings.search_scan_chars,
+                limit,
+                skip,
+            )
         )
-        .order_by(desc(Note.created_at))
-        .limit(limit)
-        .offset(skip)
         .all()
     )
 
-    return notes
+    return search.results(rows, q)
+
+
+@router.get("/stats", response_model=NoteStatsResponse)
+async def note_stats(
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user=Depends(get_current_user),
+):
+    return stats.get(shards.all(), current_user.id)
+
+
+@router.get("/tags", response_model=List[TagCountResponse])
+async def list_tags(
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user=Depends(get_current_user),
+):
+    return stats.tag_counts(shards.of(current_user.id), current_user.id)
+
+
+# The feed's first page starts after this `(created_at, id)`
+FEED_START = (datetime.max.replace(tzinfo=timezone.utc), 0)
+
+
+def encode_cursor(note: Note):
+    key = f"{note.created_at.isoformat()}|{note.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        key = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, note_id = key.split("|")
+        return datetime.fromisoformat(created_at), int(note_id)
+    except ValueError:
+        raise HTTPException(
+            detail="Invalid cursor", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+
+@router.get("/feed", response_model=NoteFeedPage)
+def note_feed(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user: User = Depends(get_current_user),
+):
+    """The caller's own and shared notes in one stream, newest first. Unlike
+    `skip`, following `next_cursor` never repeats or skips a note when
+    notes are added in the meantime."""
+    before, before_id = decode_cursor(cursor) if cursor else FEED_START
+    rows = {}
+    for db in shards.all(first_user_id=current_user.id):
+        stmt = queries.feed(current_user.id, before, before_id, limit)
+        for note, permission in db.execute(stmt):
+            # A user being moved has their notes on two shards for a while
+            rows.setdefault(note.id, (note, permission))
+    page = sorted(
+        rows.values(), key=lambda row: (row[0].created_at, row[0].id), reverse=True
+    )[:limit]
+    return {
+        "notes": [
+            FeedNote(
+                **NoteResponse.model_validate(note, from_attributes=True).model_dump(),
+                permission=permission,
+            )
+            for note, permission in page
+        ],
+        "next_cursor": encode_cursor(page[-1][0]) if len(page) == limit else None,
+    }
+
+
+# Clients of a widely shared note all refetch it when it changes; concurrent
+# loads of the same note share one set of queries.
+note_reads = SingleFlight()
+
+# Note id -> owner id. A note never changes owner, so the owner looked up
+# for one caller saves the lookup for the next; `get_note` still checks
+# every caller against the note it loads.
+note_owners = TTLCache(maxsize=settings.note_owner_cache_size)
+
+
+def find_owner(shards: ShardSessions, id: int, user_id: int):
+    """The owner of note `id` if `user_id` owns it or it is shared with them,
+    else None. A note and its shares are on the owner's shard, which is not
+    known yet: the user's own shard is asked first, then the others."""
+    for db in shards.all(first_user_id=user_id):
+        owner_id = db.scalar(queries.note_owner(id, user_id))
+        if owner_id is not None:
+            return owner_id
+    return None
+
+
+def load_note(db: Session, id: int, owner_id: int):
+    """The note and its participants, serialized so that concurrent callers
+    on other sessions can share them, or None if it does not exist."""
+    note = db.scalars(queries.note_with_owner(id, owner_id)).first()
+    if not note:
+        return None
+    participants = db.execute(queries.participants(note.id, owner_id)).all()
+    return NoteResponseWithParticipants(
+        note=NoteResponse.model_validate(note, from_attributes=True),
+        participants=[
+            {
+                "user": UserResponse.model_validate(user, from_attributes=True),
+                "permission": permission,
+            }
+            for user, permission in participants
+        ],
+    ).model_dump()
 
 
 @router.get("/{id}", response_model=NoteResponseWithParticipants)
-async def get_note(
+def get_note(
     id: int,
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_read_shards),
     current_user: User = Depends(get_current_user),
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
+    owner_id = note_owners.get(id)
+    if owner_id is None:
+        owner_id = find_owner(shards, id, current_user.id)
+        if owner_id is not None:
+            note_owners.set(id, owner_id, expires_at=float("inf"))
+    if owner_id is None:
+        note = None
+    elif settings.coalesce_note_reads:
+        db = shards.of(owner_id)
+        # Replica and primary reads must not be shared with each other
+        key = (id, owner_id, db.get_bind().engine)
+        note = note_reads.do(key, lambda: load_note(db, id, owner_id))
+    else:
+        note = load_note(shards.of(owner_id), id, owner_id)
+
+    # Authorization is checked per caller against the shared result
+    if note and (
+        note["note"]["owner_id"] == current_user.id
+        or any(p["user"]["id"] == current_user.id for p in note["participants"])
+    ):
+        return note
+    raise HTTPException(
+        detail=f"Note with id {id} is not shared with or owned by the current user",
+        status_code=status.HTTP_404_NOT_FOUND,
     )
 
+
+def readable_note(shards: ShardSessions, id: int, user: User):
+    # Only found if the user owns the note or it is shared with them
+    owner_id = find_owner(shards, id, user.id)
+    note = (
+        owner_id
+        and shards.of(owner_id).scalars(queries.owned_note(id, owner_id)).first()
+    )
     if note:
-        participants = (
-            db.query(User, SharedNotes.permission)
-            .join(SharedNotes, SharedNotes.user_id == User.id)
-            .filter(SharedNotes.note_id == note.id)
-            .all()
+        return note
+    raise HTTPException(
+        detail=f"Note with id {id} is not shared with or owned by the current user",
+        status_code=status.HTTP_404_NOT_FOUND,
+    )
+
+
+def editable_note(shards: ShardSessions, id: int, user: User):
+    note = readable_note(shards, id, user)
+    if note.owner_id != user.id:
+        shared_note = (
+            shards.of(note.owner_id)
+            .scalars(queries.share(id, note.owner_id, user.id))
+            .first()
         )
+        if shared_note.permission != "edit":
+            raise HTTPException(
+                detail="You do not have permission to edit this note",
+                status_code=status.HTTP_403_FORBIDDEN,
+            )
+    return note
 
-        participants_info = [
-            {"user": user, "permission": permission}
-            for user, permission in participants
-        ]
-        return {"note": note, "participants": participants_info}
-
-    # If the note is not owned by the current user, check if it's shared
-    shared_note = (
-        db.query(Note)
-        .join(SharedNotes, SharedNotes.note_id == Note.id)
-        .filter(Note.id == id, SharedNotes.user_id == current_user.id)
-        .first()
+
+@router.get("/{id}/revisions", response_model=List[NoteRevisionResponse])
+def list_revisions(
+    id: int,
+    limit: int = Query(20, ge=1, le=100),
+    skip: int = Query(0, ge=0),
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user: User = Depends(get_current_user),
+):
+    note = readable_note(shards, id, current_user)
+    rows = shards.of(note.owner_id).execute(
+        select(
+            NoteRevision.revision,
+            NoteRevision.title,
+            NoteRevision.tags,
+            NoteRevision.editor_id,
+            NoteRevision.created_at,
+            NoteRevision.detail.isnot(None).label("snapshot"),
+        )
+        .where(NoteRevision.note_id == id)
+        .order_by(desc(NoteRevision.revision))
+        .limit(limit)
+        .offset(skip)
     )
-    note = shared_note
+    return rows.mappings().all()
 
-    if not shared_note:
+
+@router.get("/{id}/revisions/at", response_model=NoteVersionResponse)
+def get_note_at(
+    id: int,
+    time: datetime,
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user: User = Depends(get_current_user),
+):
+    note = readable_note(shards, id, current_user)
+    version = revisions.rebuild(shards.of(note.owner_id), id, at=time)
+    if version is None:
         raise HTTPException(
-            detail=f"Note with id {id} is not shared with or owned by the current user",
+            detail=f"Note with id {id} has no revision at {time}",
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    participants = (
-        db.query(User, SharedNotes.permission)
-        .join(SharedNotes, SharedNotes.user_id == User.id)
-        .filter(SharedNotes.note_id == note.id)
-        .all()
-    )
+    return version
 
-    participants_info = [
-        {"user": user, "permission": permission} for user, permission in participants
-    ]
 
-    return {"note": note, "participants": participants_info}
+@router.get("/{id}/revisions/{revision}", response_model=NoteVersionResponse)
+def get_revision(
+    id: int,
+    revision: int,
+    shards: ShardSessions = Depends(get_read_shards),
+    current_user: User = Depends(get_current_user),
+):
+    note = readable_note(shards, id, current_user)
+    version = revisions.rebuild(shards.of(note.owner_id), id, revision=revision)
+    if version is None:
+        raise HTTPException(
+            detail=f"Note with id {id} has no revision {revision}",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return version
 
 
 @router.post("", response_model=NoteResponse)
 async def create_note(
     note: NoteBase,
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
     current_user: User = Depends(get_current_user),
 ):
+    db = shards.for_write(current_user.id)
     try:
-        new_note = Note(**note.model_dump(), owner_id=current_user.id)
+        new_note = Note(
+            **note.model_dump(), id=shards.new_note_id(), owner_id=current_user.id
+        )
         db.add(new_note)
+        stats.bump(db, current_user.id, owned_notes=1)
+        stats.retag(db, current_user.id, added=new_note.tags)
+        list_cache.invalidate(db, [current_user.id])
+        db.flush()
+        revisions.initial(db, new_note)
         db.commit()
         db.refresh(new_note)
     except Exception as e:
@@ -140,25 +372,23 @@ async def create_note(
 async def update_note(
     id: int,
     updated_note: NoteBase,
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
     current_user: User = Depends(get_current_user),
 ):
-    note_query = db.query(Note).filter(Note.id == id)
+    owner_id = find_owner(shards, id, current_user.id)
+    db = owner_id and shards.for_write(owner_id)
+    note = owner_id and db.scalars(queries.note_for_update(id, owner_id)).first()
 
-    if not note_query.first():
+    if not note:
         raise HTTPException(
             detail=f"Note with id {id} does not exist",
             status_code=status.HTTP_404_NOT_FOUND,
         )
 
     # Check if the current user has access to the note
-    if note_query.first().owner_id != current_user.id:
+    if note.owner_id != current_user.id:
         # Check if the note is shared with the current user
-        shared_note = (
-            db.query(SharedNotes)
-            .filter(SharedNotes.note_id == id, SharedNotes.user_id == current_user.id)
-            .first()
-        )
+        shared_note = db.scalars(queries.share(id, owner_id, current_user.id)).first()
         if not shared_note or shared_note.permission != "edit":
             raise HTTPException(
                 detail="You do not have permission to edit this note",
@@ -170,26 +400,53 @@ async def update_note(
         delattr(updated_note, "owner_id")
 
     # Update the note
+    old_tags, new_tags = set(note.tags), set(updated_note.tags)
+    revisions.record(db, note, updated_note.model_dump(), current_user.id)
+    note_query = db.query(Note).filter(
+        Note.id == id, Note.owner_id == owner_id, Note.deleted_at.is_(None)
+    )
     note_query.update(updated_note.model_dump(), synchronize_session=False)
+    stats.retag(
+        db, note.owner_id, added=new_tags - old_tags, removed=old_tags - new_tags
+    )
+    list_cache.invalidate(
+        db, [note.owner_id, *db.scalars(queries.recipients(id, owner_id)).all()]
+    )
     db.commit()
+    db.refresh(note)
 
-    return note_query.first()
+    return note
 
 
 @router.delete("/{id}", response_model=NoteResponse)
 async def delete_note(
     id: int,
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
     current_user: User = Depends(get_current_user),
 ):
-    note_query = db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id)
-    note = note_query.first()
-    if not note:
+    db = shards.for_write(current_user.id)
+    # Only hide the note here: removing it and its shares can touch thousands
+    # of rows, which `app.purge` does in the background in bounded batches.
+    deleted = db.scalars(
+        update(Note)
+        .where(
+            Note.id == id, Note.owner_id == current_user.id, Note.deleted_at.is_(None)
+        )
+        .values(deleted_at=func.now())
+        .returning(Note.tags),
+        execution_options={"synchronize_session": False},
+    ).first()
+    if deleted is None:
         raise HTTPException(
             detail=f"Note with id {id} Does not Exist",
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    note_query.delete(synchronize_session=False)
+    stats.bump(db, current_user.id, owned_notes=-1)
+    stats.retag(db, current_user.id, removed=deleted)
+    list_cache.invalidate(
+        db,
+        [current_user.id, *db.scalars(queries.recipients(id, current_user.id)).all()],
+    )
     db.commit()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -198,26 +455,31 @@ async def delete_note(
 async def share_note(
     share_note: ShareNote,
     id: int,
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
     current_user: User = Depends(get_current_user),
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
-    )
+    # Shares live with the note, on the owner's shard, as does the copy of
+    # the recipient's user row they refer to
+    db = shards.for_write(current_user.id)
+    note = db.scalars(queries.owned_note(id, current_user.id)).first()
     if not note:
         raise HTTPException(
             detail=f"Note with id {id} Does not Exist",
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    other_user = db.query(User).filter(User.id == share_note.user_id).first()
+    other_user = db.scalars(queries.user_by_id(share_note.user_id)).first()
     if not other_user:
         raise HTTPException(
             detail=f"User with id {id} Does not Exist",
             status_code=status.HTTP_404_NOT_FOUND,
         )
     try:
-        shared = SharedNotes(**share_note.model_dump(), note_id=id)
+        shared = SharedNotes(
+            **share_note.model_dump(), note_id=id, owner_id=current_user.id
+        )
         db.add(shared)
+        stats.bump(db, share_note.user_id, shared_with_me=1)
+        list_cache.invalidate(db, [share_note.user_id])
         db.commit()
     except Exception as e:
         db.rollback()
@@ -230,16 +492,53 @@ async def share_note(
     return {"note": note, "user": other_user, "permission": share_note.permission}
 
 
+@router.post(
+    "/{id}/share/bulk",
+    response_model=JobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def bulk_share_note(
+    bulk_share: BulkShareNote,
+    id: int,
+    shards: ShardSessions = Depends(get_shards),
+    current_user: User = Depends(get_current_user),
+):
+    db = shards.primary
+    note = (
+        shards.of(current_user.id)
+        .scalars(queries.owned_note(id, current_user.id))
+        .first()
+    )
+    if not note:
+        raise HTTPException(
+            detail=f"Note with id {id} Does not Exist",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    # Runs in `python -m app.worker`; poll /api/jobs/{job id} for the outcome
+    job = jobs.enqueue(
+        db,
+        "bulk_share",
+        {
+            "note_id": id,
+            "owner_id": current_user.id,
+            **bulk_share.model_dump(mode="json"),
+        },
+        user_id=current_user.id,
+    )
+    db.commit()
+    db.refresh(job)
+    return job
+
+
 @router.delete("/{id}/share")
 async def unshare_note(
     id: int,
     user_id: int,
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
     current_user: User = Depends(get_current_user),
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
-    )
+    db = shards.for_write(current_user.id)
+    note = db.scalars(queries.owned_note(id, current_user.id)).first()
     if not note:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -251,11 +550,7 @@ async def unshare_note(
             status_code=status.HTTP_403_FORBIDDEN,
         )
     # Delete the shared note entry
-    shared_note = (
-        db.query(SharedNotes)
-        .filter(SharedNotes.note_id == id, SharedNotes.user_id == user_id)
-        .first()
-    )
+    shared_note = db.scalars(queries.share(id, current_user.id, user_id)).first()
     if not shared_note:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -263,6 +558,8 @@ async def unshare_note(
         )
     try:
         db.delete(shared_note)
+        stats.bump(db, user_id, shared_with_me=-1)
+        list_cache.invalidate(db, [user_id])
         db.commit()
 
     except IntegrityError as e:
@@ -280,12 +577,11 @@ async def unshare_note(
 async def update_permission(
     share_note: ShareNote,
     id: int,
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
     current_user: User = Depends(get_current_user),
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
-    )
+    db = shards.for_write(current_user.id)
+    note = db.scalars(queries.owned_note(id, current_user.id)).first()
     if not note:
         raise HTTPException(
             detail=f"Note with id {id} Does not Exist",
@@ -296,17 +592,15 @@ async def update_permission(
             detail="you are not the owner of this note",
             status_code=status.HTTP_403_FORBIDDEN,
         )
-    other_user = db.query(User).filter(User.id == share_note.user_id).first()
+    other_user = db.scalars(queries.user_by_id(share_note.user_id)).first()
     if not other_user:
         raise HTTPException(
             detail=f"User with id {id} Does not Exist",
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    shared_note = (
-        db.query(SharedNotes)
-        .filter(SharedNotes.note_id == id, SharedNotes.user_id == share_note.user_id)
-        .first()
-    )
+    shared_note = db.scalars(
+        queries.share(id, current_user.id, share_note.user_id)
+    ).first()
     if not shared_note:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -326,19 +620,30 @@ async def update_permission(
 
 
 @router.get("/shared/", response_model=List[NoteResponse])
-async def list_shared_notes(
-    db: Session = Depends(get_db),
+def list_shared_notes(
+    shards: ShardSessions = Depends(get_read_shards),
     current_user: User = Depends(get_current_user),
     limit: Optional[int] = 10,
     skip: Optional[int] = 0,
 ):
-    shared_notes = (
-        db.query(Note)
-        .join(SharedNotes, SharedNotes.note_id == Note.id)
-        .filter(SharedNotes.user_id == current_user.id)
-        .order_by(desc(Note.created_at))
-        .limit(limit)
-        .offset(skip)
-        .all()
+    body, hit = list_cache.page(
+        "shared",
+        current_user.id,
+        (limit, skip),
+        lambda: render_page(shared_page(shards, current_user.id, limit, skip)),
+        store=not is_replica(shards.primary),
     )
-    return shared_notes
+    return page_response(body, hit)
+
+
+def shared_page(shards: ShardSessions, user_id: int, limit: int, skip: int):
+    """Notes shared with `user_id`, newest first. They are on their owners'
+    shards, so with several shards each returns its first `skip + limit`
+    and the page is cut from those merged."""
+    if not shards.router.sharded:
+        return shards.primary.scalars(queries.shared_notes(user_id, limit, skip)).all()
+    notes = []
+    for db in shards.all():
+        notes += db.scalars(queries.shared_notes(user_id, skip + limit, 0)).all()
+    notes.sort(key=lambda note: note.created_at, reverse=True)
+    return notes[skip : skip + limit]
@@ -0,0 +1,118 @@
+import tracemalloc
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+
+from app import profiling
+from app.oauth2 import get_admin_user
+from app.schemas import (
+    MemoryDiffLine,
+    MemorySnapshotResponse,
+    ProfilingResponse,
+    ProfilingUpdate,
+)
+
+# Included only with PROFILING_ENABLED; see app.profiling
+router = APIRouter(
+    prefix="/api/admin/profiling",
+    tags=["Profiling"],
+    dependencies=[Depends(get_admin_user)],
+)
+
+profiler = profiling.profiler
+
+EXPORT_FORMATS = {
+    "pstats": ("application/octet-stream", "profile.pstats"),
+    "collapsed": ("text/plain", "profile.folded"),
+}
+
+
+def status_response():
+    return {
+        "sample_rate": profiler.sample_rate,
+        "routes": [
+            {"route": route, "requests": entry.requests, "seconds": entry.seconds}
+            for route, entry in sorted(
+                profiler.routes.items(), key=lambda item: -item[1].seconds
+            )
+        ],
+        "tracing_memory": tracemalloc.is_tracing(),
+        "snapshots": list(profiler.snapshots),
+    }
+
+
+# async: the profiles are only touched from the event loop
+@router.get("", response_model=ProfilingResponse)
+async def profiling_status():
+    return status_response()
+
+
+@router.put("", response_model=ProfilingResponse)
+async def set_sample_rate(update: ProfilingUpdate):
+    profiler.sample_rate = update.sample_rate
+    return status_response()
+
+
+@router.delete("", status_code=status.HTTP_204_NO_CONTENT)
+async def clear_profiles():
+    profiler.clear()
+
+
+@router.get("/export")
+async def export_profile(
+    route: Optional[str] = None,
+    format: str = Query("pstats", pattern="^(pstats|collapsed)$"),
+):
+    stats = profiler.stats(route)
+    if stats is None:
+        raise HTTPException(
+            detail="No requests profiled" + (f" for {route}" if route else ""),
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    if format == "pstats":
+        content = profiling.dump_stats(stats)
+    else:
+        content = profiling.collapsed_stacks(stats)
+    media_type, filename = EXPORT_FORMATS[format]
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Snapshots are slow to take and compare, so these run in the threadpool
+@router.post(
+    "/snapshots",
+    response_model=MemorySnapshotResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+def take_snapshot():
+    id, traced_bytes = profiler.take_snapshot()
+    return {"id": id, "traced_bytes": traced_bytes}
+
+
+@router.get("/snapshots/{first}/diff/{second}", response_model=List[MemoryDiffLine])
+def compare_snapshots(first: int, second: int, limit: int = Query(20, ge=1, le=500)):
+    diff = profiler.compare(first, second, limit)
+    if diff is None:
+        raise HTTPException(
+            detail=f"Snapshot {first} or {second} does not exist",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return [
+        {
+            "file": stat.traceback[0].filename,
+            "line": stat.traceback[0].lineno,
+            "size": stat.size,
+            "size_diff": stat.size_diff,
+            "count": stat.count,
+            "count_diff": stat.count_diff,
+        }
+        for stat in diff
+    ]
+
+
+@router.delete("/snapshots", status_code=status.HTTP_204_NO_CONTENT)
+def drop_snapshots():
+    profiler.drop_snapshots()
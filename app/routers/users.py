@@ -0,0 +1,86 @@
+import time
+
+from fastapi import APIRouter, Depends, Query, Response, status
+from sqlalchemy import func, select
+from sqlalchemy.orm.session import Session
+from typing import List
+
+from app import list_cache, queries
+from app.config import settings
+from app.database import ShardSessions, get_read_db, get_shards
+from app.models import RefreshToken, SharedNotes, User
+from app.oauth2 import get_current_user
+from app.schemas import UserResponse
+from app.utils import TTLCache, escape_like
+
+
+router = APIRouter(prefix="/api/users", tags=["Users"])
+
+# Result pages keyed by (lower-cased prefix, limit). Typing a name sends the
+# same prefixes over and over, so even a short TTL absorbs most lookups.
+search_cache = TTLCache(maxsize=settings.user_search_cache_size)
+
+
+def like_prefix(prefix: str):
+    return escape_like(prefix.lower()) + "%"
+
+
+@router.get("/search", response_model=List[UserResponse])
+def search_users(
+    prefix: str = Query(min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=settings.user_search_max_results),
+    db: Session = Depends(get_read_db),
+    current_user=Depends(get_current_user),
+):
+    key = (prefix.lower(), limit)
+    users = search_cache.get(key)
+    if users is not None:
+        return users
+
+    # Two index-ordered scans, each reading at most `limit` rows; username
+    # matches rank ahead of email matches.
+    pattern = like_prefix(prefix)
+    matches = {}
+    for stmt in (
+        queries.users_with_username_prefix(pattern, limit),
+        queries.users_with_email_prefix(pattern, limit),
+    ):
+        for user in db.scalars(stmt):
+            matches.setdefault(user.id, user)
+
+    users = [
+        UserResponse.model_validate(user, from_attributes=True).model_dump()
+        for user in list(matches.values())[:limit]
+    ]
+    search_cache.set(
+        key, users, expires_at=time.time() + settings.user_search_cache_ttl_seconds
+    )
+    return users
+
+
+@router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
+def delete_account(
+    shards: ShardSessions = Depends(get_shards),
+    current_user=Depends(get_current_user),
+):
+    db = shards.primary
+    # The account disappears now, on every shard's copy of it; its notes and
+    # shares are removed by `app.purge` in the background.
+    for shard_db in shards.all():
+        shard_db.query(User).filter(User.id == current_user.id).update(
+            {"deleted_at": func.now()}, synchronize_session=False
+        )
+    db.query(RefreshToken).filter(RefreshToken.user_id == current_user.id).update(
+        {"revoked": True}, synchronize_session=False
+    )
+    # Their notes drop out of everyone's shared lists
+    recipients = (
+        select(SharedNotes.user_id)
+        .where(SharedNotes.owner_id == current_user.id)
+        .distinct()
+    )
+    list_cache.invalidate(db, shards.of(current_user.id).scalars(recipients).all())
+    for shard_db in reversed(shards.all()):
+        shard_db.commit()
+    search_cache.clear()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
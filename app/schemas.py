@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from enum import Enum
-from typing import Optional, List
+from typing import Any, Optional, List, Tuple
 from datetime import datetime
 
 
@@ -11,7 +11,8 @@ class UserBase(BaseModel):
 
 
 class UserCreate(UserBase):
-    password: str
+    username: str = Field(min_length=1, max_length=50)
+    password: str = Field(min_length=1, max_length=128)
 
     class config:
         orm_mode = True
@@ -35,16 +36,79 @@ class TokenData(BaseModel):
 
 
 # * Notes Schemas
+MAX_TAGS = 20
+MAX_TAG_LENGTH = 50
+MAX_TITLE_LENGTH = 200
+MAX_DETAIL_LENGTH = 100_000
+
+
+def normalize_tags(tags):
+    """Lower-case, trim and de-duplicate tags, keeping their order."""
+    normalized = []
+    for tag in tags:
+        tag = tag.strip().lower()
+        if not tag:
+            continue
+        if len(tag) > MAX_TAG_LENGTH:
+            raise ValueError(f"tags must be at most {MAX_TAG_LENGTH} characters")
+        if tag not in normalized:
+            normalized.append(tag)
+    if len(normalized) > MAX_TAGS:
+        raise ValueError(f"a note can have at most {MAX_TAGS} tags")
+    return normalized
+
+
 class NoteBase(BaseModel):
+    title: str = Field(max_length=MAX_TITLE_LENGTH)
+    detail: str = Field(max_length=MAX_DETAIL_LENGTH)
+    # Bounds the work of normalizing; at most MAX_TAGS survive
+    tags: List[str] = Field([], max_length=4 * MAX_TAGS)
+
+    @field_validator("tags")
+    @classmethod
+    def clean_tags(cls, tags):
+        return normalize_tags(tags)
+
+
+class NoteResponse(NoteBase):
+    # Notes written before the limits, or not through the API, may exceed them
     title: str
     detail: str
+    id: int
+    owner_id: int
+    owner: UserResponse
+    created_at: datetime
 
 
-class NoteResponse(NoteBase):
+class SearchSnippet(BaseModel):
+    text: str
+    # Offset of `text` in the note's detail
+    start: int
+    # (start, end) of each match within `text`
+    highlights: List[Tuple[int, int]]
+
+
+class FeedNote(NoteResponse):
+    # "owner", or the permission of the share the caller sees it through
+    permission: str
+
+
+class NoteFeedPage(BaseModel):
+    notes: List[FeedNote]
+    # Pass back as `cursor` for the next page; None on the last one
+    next_cursor: Optional[str] = None
+
+
+class NoteSearchResult(BaseModel):
     id: int
+    title: str
+    tags: List[str]
     owner_id: int
     owner: UserResponse
     created_at: datetime
+    score: float
+    title_highlights: List[Tuple[int, int]]
+    snippets: List[SearchSnippet]
 
 
 class ParticipantInfo(BaseModel):
@@ -67,7 +131,98 @@ class ShareNote(BaseModel):
     permission: Permissions = Permissions.read_only
 
 
+class BulkShareNote(BaseModel):
+    user_ids: List[int] = Field(min_length=1, max_length=10000)
+    permission: Permissions = Permissions.read_only
+
+
 class ShareNoteResponse(BaseModel):
     note: NoteResponse
     user: UserResponse
     permission: str
+
+
+class NoteStatsResponse(BaseModel):
+    owned_notes: int
+    shared_with_me: int
+
+
+class NoteRevisionResponse(BaseModel):
+    revision: int
+    title: str
+    tags: List[str]
+    editor_id: Optional[int] = None
+    created_at: datetime
+    snapshot: bool
+
+
+class NoteVersionResponse(BaseModel):
+    revision: int
+    title: str
+    detail: str
+    tags: List[str]
+    editor_id: Optional[int] = None
+    created_at: datetime
+
+
+class AttachmentResponse(BaseModel):
+    id: int
+    note_id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    uploader_id: Optional[int] = None
+    created_at: datetime
+
+
+class TagCountResponse(BaseModel):
+    tag: str
+    count: int
+
+
+# * Job Schemas
+class JobResponse(BaseModel):
+    id: int
+    type: str
+    status: str
+    attempts: int
+    max_attempts: int
+    run_at: datetime
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    result: Optional[Any] = None
+
+
+# * Profiling Schemas
+class ProfilingUpdate(BaseModel):
+    # Share of requests to profile, from 0 (none) to 1 (all)
+    sample_rate: float = Field(ge=0, le=1)
+
+
+class RouteProfileResponse(BaseModel):
+    route: str
+    requests: int
+    seconds: float
+
+
+class ProfilingResponse(BaseModel):
+    sample_rate: float
+    routes: List[RouteProfileResponse]
+    tracing_memory: bool
+    snapshots: List[int]
+
+
+class MemorySnapshotResponse(BaseModel):
+    id: int
+    traced_bytes: int
+
+
+class MemoryDiffLine(BaseModel):
+    file: str
+    line: int
+    size: int
+    size_diff: int
+    count: int
+    count_diff: int
@@ -0,0 +1,91 @@
+"""Highlighted snippets for note search results.
+
+Search matches the query anywhere in a note, so a bare result does not say
+where. Snippets are cut only for the page being returned, from the first
+`search_scan_chars` characters of each note that the search query fetches
+in place of the whole `detail`. A request scans at most
+`search_snippet_budget_chars` characters in total. Results past the budget
+come back without snippets, so a page of huge notes costs no more than a
+page of small ones.
+"""
+import re
+from bisect import bisect_left
+from itertools import islice
+
+from app.config import settings
+
+# Matches looked at per note; a one-letter query can match everywhere
+MAX_MATCHES = 1000
+
+
+def find(text: str, q: str):
+    """Spans of the case-insensitive occurrences of `q` in `text`."""
+    if not q:
+        return []
+    matches = re.finditer(re.escape(q), text, re.IGNORECASE)
+    return [m.span() for m in islice(matches, MAX_MATCHES)]
+
+
+def snippets(text: str, q: str, width: int = None, count: int = None):
+    """Up to `count` windows of `width` characters of `text`, those holding
+    the most matches first, each with its matches' spans within it. Without
+    matches, the start of `text`."""
+    width = width or settings.search_snippet_chars
+    count = count or settings.search_max_snippets
+    spans = find(text, q)
+    if not spans:
+        return [snippet(text, 0, width, [])] if text else []
+
+    starts = [start for start, _ in spans]
+    candidates = []
+    for start, end in spans:
+        # Centre the window on this match, kept inside the text
+        lo = max(0, min(start - (width - (end - start)) // 2, len(text) - width))
+        hits = bisect_left(starts, lo + width - (end - start) + 1) - bisect_left(
+            starts, lo
+        )
+        candidates.append((-hits, lo))
+    candidates.sort()
+
+    chosen = []
+    for _, lo in candidates:
+        if all(lo + width <= other or other + width <= lo for other in chosen):
+            chosen.append(lo)
+            if len(chosen) == count:
+                break
+    return [snippet(text, lo, width, spans) for lo in chosen]
+
+
+def snippet(text: str, lo: int, width: int, spans):
+    hi = min(lo + width, len(text))
+    return {
+        "text": text[lo:hi],
+        "start": lo,
+        "highlights": [
+            (start - lo, min(end, hi) - lo) for start, end in spans if lo <= start < hi
+        ],
+    }
+
+
+def results(rows, q: str):
+    """Search results for `(note, score, head)` rows, with snippets cut
+    within the request's budget."""
+    budget = settings.search_snippet_budget_chars
+    found = []
+    for note, score, head in rows:
+        scanned = head[:budget]
+        budget -= len(scanned)
+        found.append(
+            {
+                "id": note.id,
+                "title": note.title,
+                "tags": note.tags,
+                "owner_id": note.owner_id,
+                "owner": note.owner,
+                "created_at": note.created_at,
+                "score": score,
+                "title_highlights": find(note.title, q),
+                "snippets": snippets(scanned, q),
+            }
+        )
+    return found
@@ -0,0 +1,282 @@
+"""Keeping several shards in step, and moving users between them.
+
+`app.database.ShardRouter` sends everything about a user's notes to the
+shard named by `users.shard` on the primary. New users are spread over the
+shards by id. Every shard also has a copy of `users`, without passwords, so
+notes and shares keep their foreign keys and joins. Signing up and deleting
+an account update the copies; `sync-users` repairs them:
+
+    python -m app.shards sync-users
+    python -m app.shards move 42 --to 2     # move user 42's notes to shard 2
+
+A move runs while the API is serving:
+
+1. Copy the user's notes, shares and revisions to the new shard in batches.
+2. Lock the user's row on the old shard, which waits for the user's
+   in-flight writes and holds back new ones (see `ShardSessions.for_write`).
+   Copy what changed meanwhile, then point `users.shard` at the new shard.
+   Writers that were waiting, or that still have the old shard cached, get
+   `StaleShard` (503) and retry on the new one.
+3. Wait out the directory cache, during which stale readers still find the
+   old rows, then delete them in batches.
+
+Attachments get new ids on the new shard.
+"""
+import argparse
+import os
+import time
+
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app import attachments, stats
+from app.config import settings
+from app.database import ShardRouter, shard_router
+from app.models import Attachment, Blob, Note, NoteRevision, SharedNotes, TagCount, User
+
+# Copied to the other shards; the password stays on the primary
+USER_COLUMNS = [c for c in User.__table__.c if c.name != "password"]
+
+
+def home_shard(router: ShardRouter, user_id: int):
+    """The shard a new user's notes go to."""
+    return user_id % len(router.engines)
+
+
+def sync_users(router: ShardRouter, primary_db: Session, user_ids=None):
+    """Copy the primary's `users` rows (all, or `user_ids`) to the other
+    shards. Returns the number of rows written."""
+    copied = 0
+    for session_factory in router.session_factories[1:]:
+        with session_factory() as shard_db:
+            after = 0
+            while True:
+                stmt = (
+                    select(*USER_COLUMNS)
+                    .where(User.id > after)
+                    .order_by(User.id)
+                    .limit(settings.shard_move_batch_size)
+                )
+                if user_ids is not None:
+                    stmt = stmt.where(User.id.in_(user_ids))
+                rows = primary_db.execute(stmt).mappings().all()
+                if not rows:
+                    break
+                stmt = insert(User).values([{**row, "password": ""} for row in rows])
+                shard_db.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[User.id],
+                        set_={
+                            c.name: stmt.excluded[c.name]
+                            for c in USER_COLUMNS
+                            if c.name != "id"
+                        },
+                    )
+                )
+                shard_db.commit()
+                copied += len(rows)
+                after = rows[-1]["id"]
+    return copied
+
+
+def remove_user(router: ShardRouter, primary_db: Session, user_id: int):
+    """Delete a user who owns nothing yet from every shard. The primary goes
+    last: if a shard fails here too, the account stays whole enough for
+    `sync-users` to repair."""
+    for session_factory in router.session_factories[1:]:
+        with session_factory() as shard_db:
+            shard_db.execute(delete(User).where(User.id == user_id))
+            shard_db.commit()
+    primary_db.execute(delete(User).where(User.id == user_id))
+    primary_db.commit()
+
+
+def upsert_batches(source: Session, target: Session, table, where, batch_size: int):
+    """Copy the rows of `table` matching `where` from `source` to `target`,
+    replacing those already there, `batch_size` at a time in primary key
+    order. Returns the primary keys copied."""
+    key = list(table.primary_key.columns)
+    copied = []
+    while True:
+        stmt = select(table).where(where).order_by(*key).limit(batch_size)
+        if copied:
+            stmt = stmt.where(tuple_(*key) > tuple_(*copied[-1]))
+        rows = source.execute(stmt).mappings().all()
+        if not rows:
+            return copied
+        upsert = insert(table).values([dict(row) for row in rows])
+        target.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[c.name for c in key],
+                set_={
+                    c.name: upsert.excluded[c.name]
+                    for c in table.c
+                    if not c.primary_key
+                },
+            )
+        )
+        copied.extend(tuple(row[c.name] for c in key) for row in rows)
+
+
+def moved_tables(user_id: int):
+    """The tables moved with a user, in foreign key order, with the rows
+    of theirs."""
+    notes = select(Note.id).where(Note.owner_id == user_id)
+    return [
+        (Note.__table__, Note.owner_id == user_id),
+        (SharedNotes.__table__, SharedNotes.owner_id == user_id),
+        (NoteRevision.__table__, NoteRevision.note_id.in_(notes)),
+        (TagCount.__table__, TagCount.user_id == user_id),
+    ]
+
+
+def copy_attachments(source: Session, target: Session, user_id: int):
+    """Replace the attachments of `user_id`'s notes on `target` with those
+    on `source`, linking their blob files into `target`'s directory."""
+    notes = select(Note.id).where(Note.owner_id == user_id)
+    replaced = target.scalars(
+        delete(Attachment)
+        .where(Attachment.note_id.in_(notes))
+        .returning(Attachment.sha256)
+    ).all()
+    attachments.release(target, replaced)
+    rows = (
+        source.execute(
+            select(Attachment.__table__).where(Attachment.note_id.in_(notes))
+        )
+        .mappings()
+        .all()
+    )
+    if not rows:
+        return
+    target.execute(
+        insert(Blob)
+        .values([{"sha256": row["sha256"], "size": row["size"]} for row in rows])
+        .on_conflict_do_update(index_elements=[Blob.sha256], set_={"released_at": None})
+    )
+    target.execute(
+        insert(Attachment).values(
+            [{k: v for k, v in row.items() if k != "id"} for row in rows]
+        )
+    )
+    source_shard, target_shard = source.info["shard"], target.info["shard"]
+    for sha256 in {row["sha256"] for row in rows}:
+        path = attachments.blob_path(sha256, target_shard)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.link(attachments.blob_path(sha256, source_shard), path)
+
+
+def switch(source: Session, target: Session, user_id: int, batch_size: int):
+    """Step 2 of a move: with the user's writes held back on `source`, bring
+    `target` up to date and mark the user as moved on both."""
+    target_shard = target.info["shard"]
+    source.execute(select(User.id).where(User.id == user_id).with_for_update())
+    for table, where in moved_tables(user_id):
+        keys = upsert_batches(source, target, table, where, batch_size)
+        # Rows deleted on the source since step 1
+        key = tuple_(*table.primary_key.columns)
+        gone = delete(table).where(where)
+        if keys:
+            gone = gone.where(key.not_in(keys))
+        target.execute(gone)
+    copy_attachments(source, target, user_id)
+
+    recipients = source.scalars(
+        select(SharedNotes.user_id).where(SharedNotes.owner_id == user_id).distinct()
+    ).all()
+    stats.recount(target, [user_id, *recipients])
+    stats.recount(source, [user_id, *recipients], excluding_owner=user_id)
+    for db in (target, source):
+        db.execute(update(User).where(User.id == user_id).values(shard=target_shard))
+    # The target first: should the source's commit fail, the user's notes
+    # are still served from the source, and the move can be run again
+    target.commit()
+    source.commit()
+
+
+def purge_moved(source: Session, user_id: int, batch_size: int):
+    """Step 3 of a move: delete the user's rows from the old shard."""
+    notes = select(Note.id).where(Note.owner_id == user_id)
+    detached = source.scalars(
+        delete(Attachment)
+        .where(Attachment.note_id.in_(notes))
+        .returning(Attachment.sha256)
+    ).all()
+    attachments.release(source, detached)
+    source.commit()
+    for table, where in reversed(moved_tables(user_id)):
+        key = tuple_(*table.primary_key.columns)
+        while True:
+            batch = select(*table.primary_key.columns).where(where).limit(batch_size)
+            removed = source.execute(delete(table).where(key.in_(batch))).rowcount
+            source.commit()
+            if not removed:
+                break
+            time.sleep(settings.purge_batch_pause_seconds)
+
+
+def move_user(
+    router: ShardRouter,
+    primary_db: Session,
+    user_id: int,
+    target_shard: int,
+    batch_size: int = None,
+    wait: float = None,
+):
+    """Move `user_id`'s notes to `target_shard`; see the module docstring.
+    `wait` defaults to the directory cache's lifetime."""
+    batch_size = batch_size or settings.shard_move_batch_size
+    wait = router.directory_ttl + 1 if wait is None else wait
+    source_shard = primary_db.scalar(select(User.shard).where(User.id == user_id))
+    if source_shard is None:
+        raise ValueError(f"User {user_id} does not exist")
+    if source_shard == target_shard:
+        return False
+    sync_users(router, primary_db, [user_id])
+
+    with router.session_factories[source_shard]() as source, router.session_factories[
+        target_shard
+    ]() as target:
+        for table, where in moved_tables(user_id):
+            upsert_batches(source, target, table, where, batch_size)
+            target.commit()
+        switch(source, target, user_id, batch_size)
+
+        primary_db.execute(
+            update(User).where(User.id == user_id).values(shard=target_shard)
+        )
+        primary_db.commit()
+        router.forget(user_id)
+        sync_users(router, primary_db, [user_id])
+
+        time.sleep(wait)
+        purge_moved(source, user_id, batch_size)
+    return True
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Manage note shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync-users", help="copy users to every shard")
+    move = commands.add_parser("move", help="move a user's notes to another shard")
+    move.add_argument("user_id", type=int)
+    move.add_argument("--to", type=int, required=True, dest="target")
+    args = parser.parse_args()
+    if args.command == "move" and not 0 <= args.target < len(shard_router.engines):
+        parser.error(f"--to must be a shard from 0 to {len(shard_router.engines) - 1}")
+
+    with SessionLocal() as primary_db:
+        if args.command == "sync-users":
+            print(f"copied {sync_users(shard_router, primary_db)} user rows")
+        elif move_user(shard_router, primary_db, args.user_id, args.target):
+            print(f"moved user {args.user_id} to shard {args.target}")
+        else:
+            print(f"user {args.user_id} is already on shard {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Per-user note and tag counters.
+
+The note and share endpoints adjust `note_stats` and `tag_counts` in the
+same transaction as the row they change, so `GET /api/notes/stats` and
+`GET /api/notes/tags` never count notes. A deleted note leaves its owner's count at once; its
+recipients' counts drop as `app.purge` removes the shares. `reconcile`
+recomputes the counters from the source tables in user-id batches and
+repairs any drift; run it periodically with
+
+    python -m app.stats --batch-size 5000
+
+With several shards each one counts its own rows: a share is counted on the
+shard of the note it shares, so `shared_with_me` is the sum over all shards.
+"""
+import argparse
+
+from sqlalchemy import delete, desc, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models import NoteStats, TagCount, User
+
+
+def bump(db: Session, user_id: int, owned_notes: int = 0, shared_with_me: int = 0):
+    """Add the given deltas to a user's counters, creating the row if needed."""
+    stmt = insert(NoteStats).values(
+        user_id=user_id, owned_notes=owned_notes, shared_with_me=shared_with_me
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[NoteStats.user_id],
+            set_={
+                "owned_notes": NoteStats.owned_notes + owned_notes,
+                "shared_with_me": NoteStats.shared_with_me + shared_with_me,
+                "updated_at": func.now(),
+            },
+        )
+    )
+
+
+def share_many(db: Session, user_ids):
+    """Increment `shared_with_me` once for each of `user_ids`."""
+    if user_ids:
+        stmt = insert(NoteStats).values(
+            [{"user_id": user_id, "shared_with_me": 1} for user_id in user_ids]
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[NoteStats.user_id],
+                set_={
+                    "shared_with_me": NoteStats.shared_with_me + 1,
+                    "updated_at": func.now(),
+                },
+            )
+        )
+
+
+def unshare_many(db: Session, user_ids):
+    """Decrement `shared_with_me` once for each of `user_ids`."""
+    if user_ids:
+        db.execute(
+            update(NoteStats)
+            .where(NoteStats.user_id.in_(user_ids))
+            .values(
+                shared_with_me=NoteStats.shared_with_me - 1, updated_at=func.now()
+            ),
+            execution_options={"synchronize_session": False},
+        )
+
+
+def retag(db: Session, user_id: int, added=(), removed=()):
+    """Count `added` tags up and `removed` tags down for a user's notes."""
+    if added:
+        stmt = insert(TagCount).values(
+            [{"user_id": user_id, "tag": tag, "count": 1} for tag in added]
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[TagCount.user_id, TagCount.tag],
+                set_={"count": TagCount.count + 1},
+            )
+        )
+    if removed:
+        mine = (TagCount.user_id == user_id, TagCount.tag.in_(removed))
+        db.execute(
+            update(TagCount).where(*mine).values(count=TagCount.count - 1),
+            execution_options={"synchronize_session": False},
+        )
+        db.execute(
+            delete(TagCount).where(*mine, TagCount.count <= 0),
+            execution_options={"synchronize_session": False},
+        )
+
+
+def tag_counts(db: Session, user_id: int):
+    return db.execute(
+        select(TagCount.tag, TagCount.count)
+        .where(TagCount.user_id == user_id, TagCount.count > 0)
+        .order_by(desc(TagCount.count), TagCount.tag)
+    ).all()
+
+
+def get(dbs, user_id: int):
+    """The counters of `user_id`, summed over the shards `dbs`."""
+    totals = {"owned_notes": 0, "shared_with_me": 0}
+    for db in dbs:
+        stats = db.get(NoteStats, user_id)
+        if stats is not None:
+            totals["owned_notes"] += stats.owned_notes
+            totals["shared_with_me"] += stats.shared_with_me
+    return totals
+
+
+def recount(db: Session, user_ids, excluding_owner: int = None):
+    """Set the counters of `user_ids` from the rows on `db`'s shard,
+    leaving out the notes of `excluding_owner` (who is being moved away)."""
+    if not user_ids:
+        return
+    db.execute(
+        RECOUNT,
+        {"user_ids": sorted(set(user_ids)), "excluding_owner": excluding_owner},
+    )
+
+
+RECOUNT = text(
+    """
+    INSERT INTO note_stats (user_id, owned_notes, shared_with_me)
+    SELECT u.id,
+           (SELECT count(*) FROM notes n
+            WHERE n.owner_id = u.id AND n.deleted_at IS NULL
+              AND n.owner_id IS DISTINCT FROM :excluding_owner),
+           (SELECT count(*) FROM shared_notes s
+            WHERE s.user_id = u.id
+              AND s.owner_id IS DISTINCT FROM :excluding_owner)
+    FROM users u
+    WHERE u.id = ANY(:user_ids)
+    ON CONFLICT (user_id) DO UPDATE
+    SET owned_notes = excluded.owned_notes,
+        shared_with_me = excluded.shared_with_me,
+        updated_at = now()
+    """
+)
+
+
+RECONCILE_BATCH = text(
+    """
+    WITH actual AS (
+        SELECT u.id AS user_id,
+               (SELECT count(*) FROM notes n
+                WHERE n.owner_id = u.id AND n.deleted_at IS NULL) AS owned_notes,
+               (SELECT count(*) FROM shared_notes s WHERE s.user_id = u.id)
+                   AS shared_with_me
+        FROM users u
+        WHERE u.id > :after AND u.id <= :upto
+    )
+    INSERT INTO note_stats (user_id, owned_notes, shared_with_me)
+    SELECT user_id, owned_notes, shared_with_me FROM actual
+    ON CONFLICT (user_id) DO UPDATE
+    SET owned_notes = excluded.owned_notes,
+        shared_with_me = excluded.shared_with_me,
+        updated_at = now()
+    WHERE note_stats.owned_notes <> excluded.owned_notes
+       OR note_stats.shared_with_me <> excluded.shared_with_me
+    """
+)
+
+
+RECONCILE_TAGS_BATCH = text(
+    """
+    WITH actual AS (
+        SELECT owner_id AS user_id, tag, count(*) AS count
+        FROM notes, unnest(tags) AS tag
+        WHERE owner_id > :after AND owner_id <= :upto AND deleted_at IS NULL
+        GROUP BY owner_id, tag
+    ),
+    stale AS (
+        DELETE FROM tag_counts t
+        WHERE t.user_id > :after AND t.user_id <= :upto
+          AND NOT EXISTS (
+              SELECT 1 FROM actual a WHERE a.user_id = t.user_id AND a.tag = t.tag
+          )
+        RETURNING 1
+    ),
+    fixed AS (
+        INSERT INTO tag_counts (user_id, tag, count)
+        SELECT user_id, tag, count FROM actual
+        ON CONFLICT (user_id, tag) DO UPDATE
+        SET count = excluded.count
+        WHERE tag_counts.count <> excluded.count
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM stale) + (SELECT count(*) FROM fixed)
+    """
+)
+
+
+def reconcile(db: Session, batch_size: int = 5000):
+    """Recompute every user's note and tag counters; return how many rows
+    were repaired.
+
+    Each batch of users is its own short transaction, so concurrent writers
+    only wait on the rows of the batch being fixed. A write that lands
+    between counting and upserting is picked up by the next run.
+    """
+    repaired = 0
+    last_id = db.scalar(select(func.max(User.id))) or 0
+    after = 0
+    while after < last_id:
+        upto = after + batch_size
+        batch = {"after": after, "upto": upto}
+        repaired += db.execute(RECONCILE_BATCH, batch).rowcount
+        repaired += db.execute(RECONCILE_TAGS_BATCH, batch).scalar()
+        db.commit()
+        after = upto
+    return repaired
+
+
+def main():
+    from app.database import shard_router
+
+    parser = argparse.ArgumentParser(description="Repair drifted note counters.")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    for shard, session_factory in enumerate(shard_router.session_factories):
+        with session_factory() as db:
+            print(f"shard {shard}: repaired {reconcile(db, args.batch_size)} users")
+
+
+if __name__ == "__main__":
+    main()
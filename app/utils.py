@@ -1,4 +1,7 @@
 from passlib.context import CryptContext
+from starlette.routing import Match
+from collections import OrderedDict
+import threading
 import time
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -12,6 +15,22 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def escape_like(text):
+    """`text` with LIKE wildcards escaped, for patterns using escape '\\'."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%")
+    return escaped.replace("_", "\\_")
+
+
+def matching_route(scope):
+    """The route of the app in `scope` that a request with `scope` goes to,
+    or None."""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
 class TokenBucket:
     def __init__(self, capacity, refill_rate) -> None:
         self.capacity = capacity
@@ -32,3 +51,88 @@ class TokenBucket:
             self.tokens -= 1
             return True
         return False
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire at an absolute unix time."""
+
+    def __init__(self, maxsize) -> None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one.
+
+    The first thread to ask for a key runs the function; threads asking for
+    the same key while it runs wait and get its result (or its exception).
+    Nothing is kept once the call finishes, so this never serves stale data.
+    """
+
+    class Call:
+        def __init__(self) -> None:
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self) -> None:
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.shared = 0  # calls answered by another thread's result
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
@@ -0,0 +1,67 @@
+"""Background job worker.
+
+    python -m app.worker                       # run jobs until SIGTERM/SIGINT
+    python -m app.worker --enqueue reconcile_stats
+
+Each thread holds one database connection for its whole life: the job
+type's concurrency slot is an advisory lock on that connection. On SIGTERM
+the threads finish the job they are running and exit.
+"""
+import argparse
+import json
+import signal
+import threading
+
+from sqlalchemy.orm import Session
+
+from app import jobs, logs
+from app.config import settings
+from app.database import SessionLocal, engine
+
+
+def work(stop: threading.Event):
+    with engine.connect() as connection, Session(bind=connection) as db:
+        while not stop.is_set():
+            if jobs.run_next(db) is None:
+                stop.wait(settings.job_poll_seconds)
+
+
+def run(threads: int):
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    workers = [
+        threading.Thread(target=work, args=(stop,), name=f"job-worker-{i}")
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    while not stop.wait(settings.job_poll_seconds * 10):
+        with SessionLocal() as db:
+            jobs.requeue_stale(db)
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs.")
+    parser.add_argument("--threads", type=int, default=settings.job_worker_threads)
+    parser.add_argument(
+        "--enqueue", choices=sorted(jobs.JOB_TYPES), help="queue a job and exit"
+    )
+    parser.add_argument("--payload", type=json.loads, default={})
+    args = parser.parse_args()
+
+    if args.enqueue:
+        with SessionLocal() as db:
+            queued = jobs.enqueue(db, args.enqueue, args.payload)
+            db.commit()
+            print(f"queued job {queued.id}")
+        return
+    logs.configure()
+    run(args.threads)
+
+
+if __name__ == "__main__":
+    main()
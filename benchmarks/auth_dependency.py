@@ -0,0 +1,53 @@
+"""Per-request cost of access-token verification in the auth dependency.
+
+Compares an uncached verification with each JWT backend against a hit in the
+verified-token cache.
+
+    python -m benchmarks.auth_dependency --iterations 20000
+"""
+import argparse
+import timeit
+
+from fastapi import HTTPException
+
+from app import oauth2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = oauth2.create_access_token(data={"user_id": 1, "username": "bench"})
+    exc = HTTPException(status_code=401)
+    original_backend = oauth2.jwt_backend
+
+    def uncached():
+        oauth2.verified_tokens.clear()
+        oauth2.verify_access_token(token, exc)
+
+    def clear_only():
+        oauth2.verified_tokens.clear()
+
+    def cached():
+        oauth2.verify_access_token(token, exc)
+
+    # Clearing the cache is part of the uncached loop, so subtract it out.
+    baseline = timeit.timeit(clear_only, number=args.iterations)
+    for name, backend in oauth2.JWT_BACKENDS.items():
+        try:
+            oauth2.jwt_backend = backend()
+        except ImportError:
+            print(f"{name:>8} uncached: backend not installed")
+            continue
+        elapsed = timeit.timeit(uncached, number=args.iterations) - baseline
+        print(f"{name:>8} uncached: {elapsed / args.iterations * 1e6:8.2f} us/request")
+    oauth2.jwt_backend = original_backend
+
+    cached()
+    elapsed = timeit.timeit(cached, number=args.iterations)
+    print(f"{'cache':>8} hit:      {elapsed / args.iterations * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
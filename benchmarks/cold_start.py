@@ -0,0 +1,93 @@
+"""Measure cold-start-to-first-request time of the API server.
+
+Starts uvicorn the same way ``entrypoint.sh`` does in production mode, polls
+``GET /`` until it answers and reports the elapsed wall time.
+
+    python -m benchmarks.cold_start --workers 4 --runs 5
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def server_command(port: int, workers: int, reload: bool):
+    cmd = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "app.main:app",
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(port),
+    ]
+    if reload:
+        return cmd + ["--reload"]
+    return cmd + [
+        "--workers",
+        str(workers),
+        "--loop",
+        "uvloop",
+        "--http",
+        "httptools",
+        "--no-access-log",
+    ]
+
+
+def measure_once(port: int, workers: int, reload: bool, timeout: float) -> float:
+    url = f"http://127.0.0.1:{port}/"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        server_command(port, workers, reload),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(url, timeout=0.5).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            time.sleep(0.01)
+        raise TimeoutError(f"no response from {url} after {timeout}s")
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--reload", action="store_true", help="measure the development mode instead"
+    )
+    args = parser.parse_args()
+
+    samples = [
+        measure_once(args.port, args.workers, args.reload, args.timeout)
+        for _ in range(args.runs)
+    ]
+    mode = "reload" if args.reload else f"{args.workers} workers"
+    print(
+        f"cold start ({mode}): "
+        f"min {min(samples) * 1000:.0f}ms "
+        f"median {statistics.median(samples) * 1000:.0f}ms "
+        f"max {max(samples) * 1000:.0f}ms over {args.runs} runs"
+    )
+
+
+if __name__ == "__main__":
+    main()
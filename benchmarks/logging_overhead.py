@@ -0,0 +1,104 @@
+"""Per-request cost of request ids and access logging.
+
+Calls a bare ASGI app directly, with and without `RequestIdMiddleware`, at
+the default access-log sample rate and with every request logged. Records
+go to /dev/null, and to a stream that takes `--slow-write-us` per write,
+like a terminal or a full pipe. For comparison, the same records are also
+written synchronously from the request path by a plain `StreamHandler`, as
+`print()` used to do.
+
+    python -m benchmarks.logging_overhead --requests 100000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from app import logs
+from app.config import settings
+
+
+async def bare_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+class SlowStream:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def write(self, text):
+        time.sleep(self.seconds)
+
+    def flush(self):
+        pass
+
+
+def per_request(app, requests):
+    async def run():
+        for _ in range(requests):
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": "/api/notes",
+                "headers": [(b"authorization", b"Bearer x")],
+            }
+            await app(scope, receive, send)
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--slow-write-us", type=float, default=100)
+    args = parser.parse_args()
+
+    logged = logs.RequestIdMiddleware(bare_app)
+    bare = per_request(bare_app, args.requests)
+    print(f"{'no middleware':>42}: {bare:8.2f} us/request")
+
+    rate = settings.log_access_sample_rate
+    sinks = {
+        "/dev/null": open(os.devnull, "w"),
+        f"{args.slow_write_us:g}us writes": SlowStream(args.slow_write_us / 1e6),
+    }
+    for sink, stream in sinks.items():
+        for sample_rate in (rate, 1.0):
+            settings.log_access_sample_rate = sample_rate
+            logs.configure(stream)
+            cost = per_request(logged, args.requests) - bare
+            logs.shutdown()
+            mode = f"queued, sample rate {sample_rate:g}"
+            print(
+                f"{sink:>14}, {mode:<26}: {cost:8.2f} us/request"
+                f"  ({logs.handler.dropped} dropped)"
+            )
+
+        # JSON written from the request path, every request
+        settings.log_access_sample_rate = 1.0
+        logs.configure(stream)
+        logs.shutdown()
+        output = logging.StreamHandler(stream)
+        output.setFormatter(logs.JSONFormatter())
+        output.addFilter(logs.RequestIdFilter())
+        logging.getLogger().handlers = [output]
+        cost = per_request(logged, args.requests) - bare
+        mode = "synchronous, every request"
+        print(f"{sink:>14}, {mode:<26}: {cost:8.2f} us/request")
+    settings.log_access_sample_rate = rate
+
+
+if __name__ == "__main__":
+    main()
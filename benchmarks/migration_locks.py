@@ -0,0 +1,216 @@
+"""How long each migration locks the tables the API uses.
+
+Creates a scratch database and runs the migrations in ``alembic/versions``
+one at a time. As soon as ``users``, ``notes`` and ``shared_notes`` exist,
+they are seeded with ``--users``, ``--notes`` and ``--shares`` rows. While
+each migration runs, its table locks are sampled from ``pg_locks``. The
+report shows how long each migration held locks that block the API's
+writes, and which of those also block reads.
+
+Exits with status 1 if a migration newer than ``--since`` blocked writes for
+more than ``--max-lock-seconds``, so CI can check new migrations only.
+
+    python -m benchmarks.migration_locks --notes 2000000
+    python -m benchmarks.migration_locks --since 17b67b9fd658
+"""
+import argparse
+import sys
+import threading
+import time
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, func, inspect, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.database import create_db_engine
+
+# Lock modes that conflict with the ROW EXCLUSIVE lock INSERT, UPDATE and
+# DELETE take, and the one that conflicts with SELECT's ACCESS SHARE
+BLOCKS_WRITES = {
+    "ShareLock",
+    "ShareRowExclusiveLock",
+    "ExclusiveLock",
+    "AccessExclusiveLock",
+}
+BLOCKS_READS = {"AccessExclusiveLock"}
+
+LOCKS_QUERY = text(
+    """
+    SELECT c.relname, l.mode
+    FROM pg_locks l JOIN pg_class c ON c.oid = l.relation
+    WHERE l.pid = :pid AND l.granted AND c.relkind IN ('r', 'p')
+    """
+)
+
+SEED = [
+    """
+    INSERT INTO users (username, email, password)
+    SELECT 'user' || g, 'user' || g || '@example.com', 'x'
+    FROM generate_series(1, :users) g
+    """,
+    """
+    INSERT INTO notes (title, detail, owner_id)
+    SELECT 'note ' || g, repeat('lorem ipsum ', 20), 1 + g % :users
+    FROM generate_series(1, :notes) g
+    """,
+    """
+    INSERT INTO shared_notes (user_id, note_id, permission)
+    SELECT 1 + (g * 7) % :users, g, 'read_only'
+    FROM generate_series(1, :shares) g
+    """,
+]
+
+
+def create_database(url: str, name: str):
+    base = make_url(url)
+    admin = create_engine(base, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+    admin.dispose()
+    return base.set(database=name).render_as_string(hide_password=False)
+
+
+def drop_database(url: str, name: str):
+    admin = create_engine(url, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    admin.dispose()
+
+
+def ready_to_seed(engine):
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    return {"users", "notes", "shared_notes"} <= tables and "owner_id" in {
+        column["name"] for column in inspector.get_columns("notes")
+    }
+
+
+def seed(engine, args):
+    started = time.perf_counter()
+    params = {"users": args.users, "notes": args.notes, "shares": args.shares}
+    with engine.begin() as conn:
+        for statement in SEED:
+            conn.execute(text(statement), params)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
+    print(
+        f"seeded {args.users} users, {args.notes} notes and {args.shares} shares "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def upgrade(cfg, revision, errors):
+    try:
+        command.upgrade(cfg, revision)
+    except BaseException as e:
+        errors.append(e)
+
+
+def held_locks(watcher, pid, thread, interval):
+    """Seconds each `(table, mode)` lock of backend `pid` was held while
+    `thread` ran."""
+    held = {}
+    last = time.perf_counter()
+    while thread.is_alive():
+        rows = watcher.execute(LOCKS_QUERY, {"pid": pid}).all()
+        now = time.perf_counter()
+        for table, mode in rows:
+            held[table, mode] = held.get((table, mode), 0.0) + now - last
+        last = now
+        time.sleep(interval)
+    return held
+
+
+def blocked(held, modes):
+    """Longest time each table was held in one of `modes`."""
+    tables = {}
+    for (table, mode), seconds in held.items():
+        if mode in modes:
+            tables[table] = max(tables.get(table, 0.0), seconds)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=settings.database_test_url)
+    parser.add_argument("--database", default="migration_lock_check")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--notes", type=int, default=2_000_000)
+    parser.add_argument("--shares", type=int, default=500_000)
+    parser.add_argument("--interval", type=float, default=0.005)
+    parser.add_argument("--max-lock-seconds", type=float, default=1.0)
+    parser.add_argument("--since", help="only fail for migrations after this revision")
+    parser.add_argument("--keep", action="store_true", help="keep the database")
+    args = parser.parse_args()
+    args.shares = min(args.shares, args.notes)
+
+    engine = create_db_engine(create_database(args.url, args.database))
+    # No alembic.ini: its logging setup would repeat on every migration
+    cfg = Config()
+    cfg.set_main_option("script_location", "alembic")
+    revisions = list(reversed(list(ScriptDirectory.from_config(cfg).walk_revisions())))
+
+    checking = args.since is None
+    failures = []
+    seeded = False
+    try:
+        with engine.connect() as migrating, engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as watcher:
+            pid = migrating.execute(select(func.pg_backend_pid())).scalar()
+            migrating.commit()
+            cfg.attributes["connection"] = migrating
+
+            for revision in revisions:
+                if not seeded and ready_to_seed(engine):
+                    seed(engine, args)
+                    seeded = True
+
+                errors = []
+                thread = threading.Thread(
+                    target=upgrade, args=(cfg, revision.revision, errors)
+                )
+                started = time.perf_counter()
+                thread.start()
+                held = held_locks(watcher, pid, thread, args.interval)
+                thread.join()
+                elapsed = time.perf_counter() - started
+                if errors:
+                    print(f"{revision.revision} failed: {errors[0]}")
+                    sys.exit(2)
+
+                writes = blocked(held, BLOCKS_WRITES)
+                reads = blocked(held, BLOCKS_READS)
+                print(f"{revision.revision} {revision.doc[:40]:40} {elapsed:8.2f}s")
+                for table, seconds in sorted(writes.items()):
+                    also = "and reads " if table in reads else ""
+                    flag = ""
+                    if seconds > args.max_lock_seconds and checking:
+                        flag = "  <- too long"
+                        failures.append(revision.revision)
+                    print(
+                        f"    blocks writes {also:10}on {table:16} "
+                        f"{seconds:8.3f}s{flag}"
+                    )
+                if revision.revision == args.since:
+                    checking = True
+    finally:
+        engine.dispose()
+        if not args.keep:
+            drop_database(args.url, args.database)
+
+    if failures:
+        print(
+            f"{len(set(failures))} migration(s) blocked writes for more than "
+            f"{args.max_lock_seconds}s: {', '.join(dict.fromkeys(failures))}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Database load when many clients fetch the same shared note at once.
+
+Fires rounds of concurrent ``GET /api/notes/{id}`` requests, one per reader
+of a note shared with ``--readers`` users, through the ASGI app against the
+test database, with request coalescing on and off. Reports the statements
+that touch notes per round and per second; with coalescing they stay flat
+as the number of concurrent readers grows. Seeds its own rows and removes
+them afterwards.
+
+    python -m benchmarks.note_fanout --readers 1 8 32 64 --seconds 5
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app import main as app_main
+from app import oauth2
+from app.config import settings
+from app.database import Base, create_db_engine, get_db
+from app.models import Note, SharedNotes, User
+
+
+async def run_rounds(client, note_id, tokens, seconds):
+    rounds = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        responses = await asyncio.gather(
+            *(
+                client.get(
+                    f"/api/notes/{note_id}",
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+                for token in tokens
+            )
+        )
+        assert all(r.status_code == 200 for r in responses), responses[0].text
+        rounds += 1
+    return rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=settings.database_test_url)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    # A request keeps its connection while it waits for a threadpool slot, so
+    # give every concurrent reader one (stay under max_connections).
+    engine = create_db_engine(args.url, pool_size=max(args.readers), max_overflow=0)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    def override_get_db():
+        with Session() as db:
+            yield db
+
+    app_main.app.dependency_overrides[get_db] = override_get_db
+    app_main.bucket.capacity = app_main.bucket.tokens = float("inf")
+
+    suffix = uuid.uuid4().hex[:8]
+    with Session() as db:
+        users = [
+            User(
+                username=f"fan-{suffix}-{i}", email=f"f-{suffix}-{i}@x.io", password="x"
+            )
+            for i in range(max(args.readers) + 1)
+        ]
+        db.add_all(users)
+        db.flush()
+        owner, readers = users[0], users[1:]
+        note = Note(title="shared", detail="d" * 500, owner_id=owner.id)
+        db.add(note)
+        db.flush()
+        db.add_all(
+            SharedNotes(user_id=r.id, note_id=note.id, owner_id=owner.id)
+            for r in readers
+        )
+        db.commit()
+        note_id, user_ids = note.id, [u.id for u in users]
+        tokens = [
+            oauth2.create_access_token(data={"user_id": r.id, "username": r.username})
+            for r in readers
+        ]
+
+    statements = 0
+
+    def count(conn, cursor, statement, *args):
+        nonlocal statements
+        if "notes" in statement:
+            statements += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    transport = httpx.ASGITransport(app=app_main.app)
+    try:
+        for coalesce in (False, True):
+            settings.coalesce_note_reads = coalesce
+            for n in args.readers:
+                statements = 0
+
+                async def bench():
+                    async with httpx.AsyncClient(
+                        transport=transport, base_url="http://bench"
+                    ) as client:
+                        return await run_rounds(
+                            client, note_id, tokens[:n], args.seconds
+                        )
+
+                rounds = asyncio.run(bench())
+                print(
+                    f"coalesce={str(coalesce):5} readers={n:4}: "
+                    f"{rounds / args.seconds:7.1f} rounds/s  "
+                    f"{statements / rounds:6.1f} note queries/round  "
+                    f"{statements / args.seconds:8.1f} note queries/s"
+                )
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+        with Session() as db:
+            db.query(SharedNotes).filter(SharedNotes.note_id == note_id).delete()
+            db.query(Note).filter(Note.id == note_id).delete()
+            db.query(User).filter(User.id.in_(user_ids)).delete()
+            db.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Note queries on hash-partitioned vs. unpartitioned notes and shared_notes.
+
+Creates two scratch databases next to ``--url``: one with the schema of
+`app.models`, and one with the same tables left unpartitioned. Both are
+seeded with the same ``--users``, ``--notes`` and ``--shares`` rows. Then
+the queries behind ``app/routers/notes.py`` are timed on each with random
+owners and recipients, and so is a ``VACUUM`` of the largest unit
+autovacuum works on: the whole table, or one partition.
+
+    python -m benchmarks.note_partitions --notes 20000000 --shares 5000000
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import event, select, text, update
+from sqlalchemy.orm import Session
+
+from app import queries
+from app.config import settings
+from app.database import Base, create_db_engine
+from app.models import Note, SharedNotes, create_partitions
+from benchmarks.migration_locks import create_database, drop_database
+from benchmarks.user_search import percentile
+
+SEED = [
+    """
+    INSERT INTO users (username, email, password)
+    SELECT 'user' || g, 'user' || g || '@example.com', 'x'
+    FROM generate_series(1, :users) g
+    """,
+    """
+    INSERT INTO notes (id, title, detail, owner_id)
+    SELECT g, 'note ' || g, repeat('lorem ipsum ', 20), 1 + g % :users
+    FROM generate_series(1, :notes) g
+    """,
+    """
+    INSERT INTO shared_notes (user_id, note_id, owner_id, permission)
+    SELECT 1 + (g * 7) % :users, g, 1 + g % :users, 'read_only'
+    FROM generate_series(1, :shares) g
+    """,
+]
+
+
+def create_schema(engine, partitioned):
+    tables = [Note.__table__, SharedNotes.__table__]
+    for table in tables:
+        table.dialect_options["postgresql"]["partition_by"] = (
+            "HASH (owner_id)" if partitioned else None
+        )
+        if not partitioned:
+            event.remove(table, "after_create", create_partitions)
+    try:
+        Base.metadata.create_all(bind=engine)
+    finally:
+        for table in tables:
+            table.dialect_options["postgresql"]["partition_by"] = "HASH (owner_id)"
+            if not partitioned:
+                event.listen(table, "after_create", create_partitions)
+
+
+def seed(engine, args):
+    started = time.perf_counter()
+    params = {"users": args.users, "notes": args.notes, "shares": args.shares}
+    with engine.begin() as conn:
+        for statement in SEED:
+            conn.execute(text(statement), params)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
+    return time.perf_counter() - started
+
+
+def requests(args):
+    """Arguments for one of each request, the same for both databases."""
+    for _ in range(args.lookups):
+        note_id = random.randint(1, args.shares)
+        owner_id = 1 + note_id % args.users
+        recipient_id = 1 + (note_id * 7) % args.users
+        yield note_id, owner_id, recipient_id
+
+
+def time_queries(engine, args, seed_):
+    random.seed(seed_)
+    routes = {
+        "list notes": lambda db, n, o, r: db.scalars(
+            queries.owned_notes(o, 10, 0)
+        ).all(),
+        "get own note": lambda db, n, o, r: (
+            db.scalar(queries.note_owner(n, o)),
+            db.scalars(queries.note_with_owner(n, o)).first(),
+            db.scalars(queries.participants(n, o)).all(),
+        ),
+        "get shared note": lambda db, n, o, r: (
+            db.scalar(queries.note_owner(n, r)),
+            db.scalars(queries.note_with_owner(n, o)).first(),
+        ),
+        "list shared": lambda db, n, o, r: db.execute(
+            queries.shared_notes(r, 10, 0)
+        ).all(),
+        "update note": lambda db, n, o, r: (
+            db.scalars(queries.note_for_update(n, o)).first(),
+            db.execute(
+                update(Note)
+                .where(Note.id == n, Note.owner_id == o)
+                .values(title="edited")
+            ),
+            db.rollback(),
+        ),
+    }
+    samples = {route: [] for route in routes}
+    with Session(engine) as db:
+        for i, (note_id, owner_id, recipient_id) in enumerate(requests(args)):
+            for route, run in routes.items():
+                start = time.perf_counter()
+                run(db, note_id, owner_id, recipient_id)
+                if i >= 100:  # warm-up
+                    samples[route].append(time.perf_counter() - start)
+            db.rollback()
+            db.expunge_all()
+    return samples
+
+
+def time_vacuum(engine, table):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Dirty a tenth of the pages so there is something to clean up
+        conn.execute(text(f"UPDATE {table} SET title = title WHERE id % 10 = 0"))
+        start = time.perf_counter()
+        conn.execute(text(f"VACUUM {table}"))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=settings.database_test_url)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--notes", type=int, default=5_000_000)
+    parser.add_argument("--shares", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--keep", action="store_true", help="keep the databases")
+    args = parser.parse_args()
+    args.shares = min(args.shares, args.notes)
+    args.lookups = min(args.lookups + 100, args.shares)
+
+    results = {}
+    for name, partitioned in (("unpartitioned", False), ("partitioned", True)):
+        database = f"note_partitions_{name}"
+        engine = create_db_engine(create_database(args.url, database))
+        try:
+            create_schema(engine, partitioned)
+            seeded = seed(engine, args)
+            print(f"{name}: seeded in {seeded:.1f}s")
+            samples = time_queries(engine, args, seed_=0)
+            largest = "notes_p0" if partitioned else "notes"
+            vacuum = time_vacuum(engine, largest)
+            with engine.connect() as conn:
+                size = conn.execute(
+                    select(text(f"pg_total_relation_size('{largest}')"))
+                ).scalar()
+            results[name] = samples, largest, vacuum, size
+        finally:
+            engine.dispose()
+            if not args.keep:
+                drop_database(args.url, database)
+
+    print(
+        f"\n{args.users} users, {args.notes} notes, {args.shares} shares, "
+        f"{args.lookups - 100} requests each"
+    )
+    for name, (samples, largest, vacuum, size) in results.items():
+        print(f"{name}:")
+        for route, times in samples.items():
+            print(
+                f"    {route:16} p50 {percentile(times, 50) * 1000:7.2f}ms "
+                f"p99 {percentile(times, 99) * 1000:7.2f}ms"
+            )
+        print(
+            f"    VACUUM {largest:10} {vacuum:7.2f}s  "
+            f"({size / 2**20:.0f} MiB with indexes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Python CPU time per request spent in the ORM layer for the hot note queries.
+
+"before" rebuilds the ``db.query(...)`` trees on psycopg2 the way the routers
+used to; "after" runs the lambda statements from ``app.queries`` on psycopg 3
+with server-side prepared statements. Seeds its own rows into the test
+database and removes them afterwards.
+
+    python -m benchmarks.orm_cpu --iterations 2000
+"""
+import argparse
+import time
+import uuid
+
+from sqlalchemy import create_engine, desc
+from sqlalchemy.orm import sessionmaker
+
+from app import queries
+from app.config import settings
+from app.database import Base, create_db_engine
+from app.models import Note, SharedNotes, User
+
+
+def before(db, user_id, note_id):
+    db.query(User).filter(user_id == User.id).first()
+    db.query(Note).filter(Note.owner_id == user_id).order_by(
+        desc(Note.created_at)
+    ).limit(10).offset(0).all()
+    db.query(Note).filter(Note.id == note_id, Note.owner_id == user_id).first()
+    db.query(User, SharedNotes.permission).join(
+        SharedNotes, SharedNotes.user_id == User.id
+    ).filter(SharedNotes.note_id == note_id).all()
+
+
+def after(db, user_id, note_id):
+    db.scalars(queries.user_by_id(user_id)).first()
+    db.scalars(queries.owned_notes(user_id, 10, 0)).all()
+    db.scalars(queries.owned_note(note_id, user_id)).first()
+    db.execute(queries.participants(note_id, user_id)).all()
+
+
+def measure(session_factory, fn, user_id, note_id, iterations):
+    with session_factory() as db:
+        for _ in range(50):
+            fn(db, user_id, note_id)
+            db.expunge_all()
+        cpu, wall = time.process_time(), time.perf_counter()
+        for _ in range(iterations):
+            fn(db, user_id, note_id)
+            db.expunge_all()
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return cpu / iterations * 1e6, wall / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=settings.database_test_url)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    url = args.url.split("://", 1)[1]
+    psycopg2_engine = create_engine("postgresql+psycopg2://" + url)
+    psycopg_engine = create_db_engine("postgresql+psycopg://" + url)
+    Base.metadata.create_all(bind=psycopg_engine)
+
+    Session = sessionmaker(bind=psycopg_engine)
+    suffix = uuid.uuid4().hex[:8]
+    with Session() as db:
+        owner = User(username=f"bench-{suffix}", email=f"b-{suffix}@x.io", password="x")
+        readers = [
+            User(
+                username=f"bench-{suffix}-{i}",
+                email=f"b-{suffix}-{i}@x.io",
+                password="x",
+            )
+            for i in range(5)
+        ]
+        db.add_all([owner, *readers])
+        db.flush()
+        notes = [
+            Note(title=f"n{i}", detail="d" * 200, owner_id=owner.id) for i in range(50)
+        ]
+        db.add_all(notes)
+        db.flush()
+        db.add_all(
+            SharedNotes(user_id=r.id, note_id=notes[0].id, owner_id=owner.id)
+            for r in readers
+        )
+        db.commit()
+        user_ids = [owner.id, *(r.id for r in readers)]
+        user_id, note_id = owner.id, notes[0].id
+
+    try:
+        for name, engine, fn in (
+            ("before (db.query, psycopg2)", psycopg2_engine, before),
+            ("after (lambda_stmt, psycopg 3)", psycopg_engine, after),
+        ):
+            cpu, wall = measure(
+                sessionmaker(bind=engine), fn, user_id, note_id, args.iterations
+            )
+            print(f"{name:>32}: {cpu:8.1f} us CPU  {wall:8.1f} us wall per request")
+    finally:
+        with Session() as db:
+            db.query(SharedNotes).filter(SharedNotes.note_id == note_id).delete()
+            db.query(Note).filter(Note.owner_id == user_id).delete()
+            db.query(User).filter(User.id.in_(user_ids)).delete()
+            db.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Storage and rebuild cost of note revision history.
+
+Edits one large note ``--edits`` times, changing a few lines per save the
+way `update_note` does, then compares the bytes PostgreSQL stores for its
+revisions with storing a full copy per save, and times rebuilding random
+revisions. Seeds its own rows in the test database and removes them
+afterwards.
+
+    python -m benchmarks.revision_storage --edits 2000 --lines 400
+"""
+import argparse
+import random
+import time
+import uuid
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import revisions
+from app.config import settings
+from app.database import Base, create_db_engine
+from app.models import Note, NoteRevision, User
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=settings.database_test_url)
+    parser.add_argument("--edits", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=400)
+    parser.add_argument("--rebuilds", type=int, default=500)
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    rng = random.Random(0)
+
+    def line():
+        return " ".join(uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(2))
+
+    lines = [line() + "\n" for _ in range(args.lines)]
+    suffix = uuid.uuid4().hex[:8]
+    with Session() as db:
+        owner = User(username=f"rev-{suffix}", email=f"r-{suffix}@x.io", password="x")
+        db.add(owner)
+        db.flush()
+        note = Note(title="t", detail="".join(lines), owner_id=owner.id)
+        db.add(note)
+        db.flush()
+        revisions.initial(db, note)
+        db.commit()
+        note_id, owner_id = note.id, owner.id
+
+    full_copy_bytes = len("".join(lines).encode())
+    start = time.perf_counter()
+    with Session() as db:
+        for _ in range(args.edits):
+            for _ in range(rng.randint(1, 3)):
+                lines[rng.randrange(len(lines))] = line() + "\n"
+            if rng.random() < 0.1:
+                lines.append(line() + "\n")
+            detail = "".join(lines)
+            full_copy_bytes += len(detail.encode())
+            note = db.get(Note, (note_id, owner_id), with_for_update=True)
+            changes = {"title": "t", "detail": detail, "tags": []}
+            revisions.record(db, note, changes, owner_id)
+            note.detail = detail
+            db.commit()
+    save_seconds = time.perf_counter() - start
+
+    try:
+        with Session() as db:
+            stored = db.scalar(
+                select(
+                    func.sum(
+                        func.pg_column_size(NoteRevision.title)
+                        + func.coalesce(func.pg_column_size(NoteRevision.detail), 0)
+                        + func.coalesce(func.pg_column_size(NoteRevision.delta), 0)
+                    )
+                ).where(NoteRevision.note_id == note_id)
+            )
+            samples = []
+            for _ in range(args.rebuilds):
+                revision = rng.randint(1, args.edits + 1)
+                start = time.perf_counter()
+                revisions.rebuild(db, note_id, revision=revision)
+                samples.append(time.perf_counter() - start)
+                db.expunge_all()
+
+        print(
+            f"{args.edits} edits of a {args.lines}-line note, "
+            f"snapshot every {settings.revision_snapshot_interval}:"
+        )
+        print(f"  full copies: {full_copy_bytes / 1e6:8.2f} MB")
+        print(
+            f"  stored:      {stored / 1e6:8.2f} MB "
+            f"({full_copy_bytes / stored:.1f}x smaller)"
+        )
+        print(f"  save:        {save_seconds / args.edits * 1000:8.2f} ms per edit")
+        print(
+            f"  rebuild:     p50 {percentile(samples, 50) * 1000:.2f}ms "
+            f"p99 {percentile(samples, 99) * 1000:.2f}ms"
+        )
+    finally:
+        with Session() as db:
+            db.query(NoteRevision).filter(NoteRevision.note_id == note_id).delete()
+            db.query(Note).filter(Note.id == note_id).delete()
+            db.query(User).filter(User.id == owner_id).delete()
+            db.commit()
+
+
+if __name__ == "__main__":
+    main()
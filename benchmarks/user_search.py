@@ -0,0 +1,77 @@
+"""Latency of the user directory prefix lookup on a large users table.
+
+Seeds ``--users`` rows into the database at ``--url`` (only the missing ones,
+so reruns are cheap), then times the two index-ordered queries behind
+``GET /api/users/search`` with random 1-3 character prefixes, bypassing the
+result cache. Point it at a scratch database, not one holding real data.
+
+    python -m benchmarks.user_search --url postgresql://.../bench --users 5000000
+"""
+import argparse
+import random
+import string
+import time
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from app import queries
+from app.database import Base, create_db_engine
+from app.models import User
+from app.routers.users import like_prefix
+
+SEED_USERS = text(
+    """
+    INSERT INTO users (username, email, password)
+    SELECT md5(i::text) || '_' || i, md5((i * 7)::text) || i || '@example.com', 'x'
+    FROM generate_series(:start, :stop) AS i
+    """
+)
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--users", type=int, default=5_000_000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.count()).select_from(User)).scalar()
+        if existing < args.users:
+            print(f"seeding {args.users - existing} users ...")
+            conn.execute(SEED_USERS, {"start": existing + 1, "stop": args.users})
+            conn.execute(text("ANALYZE users"))
+
+    alphabet = string.ascii_lowercase + string.digits
+    samples = []
+    with Session(engine) as db:
+        for i in range(args.lookups + 100):
+            pattern = like_prefix(
+                "".join(random.choices(alphabet, k=random.randint(1, 3)))
+            )
+            start = time.perf_counter()
+            db.scalars(queries.users_with_username_prefix(pattern, args.limit)).all()
+            db.scalars(queries.users_with_email_prefix(pattern, args.limit)).all()
+            if i >= 100:  # warm-up
+                samples.append(time.perf_counter() - start)
+            db.expunge_all()
+
+    print(
+        f"{args.users} users, {args.lookups} lookups: "
+        f"p50 {percentile(samples, 50) * 1000:.2f}ms "
+        f"p99 {percentile(samples, 99) * 1000:.2f}ms "
+        f"max {max(samples) * 1000:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
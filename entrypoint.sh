@@ -1,10 +1,35 @@
 #!/bin/sh
 
+# APP_ENV selects how the container boots:
+#   development (default) - migrate, run the test suite, serve with --reload
+#   production            - migrate once, then serve with preforked workers
+APP_ENV="${APP_ENV:-development}"
+
+if [ "$APP_ENV" = "production" ]; then
+    # Apply Alembic migrations once, before any worker is started
+    alembic upgrade head || exit 1
+
+    # One worker per core unless WEB_CONCURRENCY says otherwise
+    WORKERS="${WEB_CONCURRENCY:-$(nproc)}"
+
+    # exec so uvicorn receives SIGTERM directly and drains in-flight requests
+    exec uvicorn app.main:app \
+        --host 0.0.0.0 \
+        --port "${PORT:-8000}" \
+        --workers "$WORKERS" \
+        --loop uvloop \
+        --http httptools \
+        --proxy-headers \
+        --no-access-log \
+        --timeout-keep-alive "${KEEP_ALIVE_TIMEOUT:-5}" \
+        --timeout-graceful-shutdown "${GRACEFUL_TIMEOUT:-30}"
+fi
+
 # Apply Alembic migrations
 alembic upgrade head
 
-# Run pytest
-pytest
+# Run the test suite, skipping long-running tests
+pytest -m "not slow"
 
 # Start the FastAPI server
-uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload
+exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload